@@ -1,49 +1,101 @@
-from flask import Flask, render_template
-from flask_caching import Cache
-from config import Config
-from utils.db import init_db
+from flask import Flask
+from config import Config, DevelopmentConfig
+from utils.db import init_db, mongo
 from routes import main_bp, auth_bp, admin_bp, api_bp
 from models.user import User
-import os
-
-app = Flask(__name__)
-app.config.from_object(Config)
-
-# Initialize database
-init_db(app)
-
-# Initialize cache
-cache = Cache(app, config={
-    'CACHE_TYPE': Config.CACHE_TYPE,
-    'CACHE_DEFAULT_TIMEOUT': Config.CACHE_DEFAULT_TIMEOUT
-})
-
-# Register blueprints
-app.register_blueprint(main_bp)
-app.register_blueprint(auth_bp)
-app.register_blueprint(admin_bp)
-app.register_blueprint(api_bp)
-
-# Ensure upload directories exist
-os.makedirs(Config.PDF_FOLDER, exist_ok=True)
-os.makedirs(Config.COVER_FOLDER, exist_ok=True)
-os.makedirs(Config.AUTHOR_FOLDER, exist_ok=True)
-
-# Custom date filter
-from datetime import datetime
-@app.template_filter('format_date')
-def format_date(value, format='%B %d, %Y'):
-    try:
-        return datetime.strptime(value, '%Y-%m-%d').strftime(format)
-    except:
-        return value
+from utils.cli import wrdc_cli
+from utils.metrics import init_metrics, command_listener, pool_listener
+from utils import profiler
+from utils.cache import init_cache
+from utils.recommender import init_recommender
+from utils.assets import init_assets
+from utils.stats import init_stats
+from utils.storage import init_storage
+from utils.versions import init_versions
+from utils.spelling import init_spelling
+from utils.invalidation import init_invalidation
+from utils.catalog import init_catalog_snapshot
+from utils.feeds import init_feeds
+from datetime import date, datetime
+
+def create_app(config_class=Config):
+    """Application factory
+
+    Creates the MongoClient, so under a prefork server it must be called in
+    each worker after the fork (see wsgi.py and gunicorn.conf.py). One-off
+    startup work lives in run_startup_tasks().
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+
+    # Request metrics (/metrics) and per-request MongoDB command accounting
+    if app.config['METRICS_ENABLED']:
+        init_metrics(app)
+
+    # Query profiler: N+1 detection and slow-query log (debug mode or QUERY_PROFILER_ENABLED)
+    profiler.init_profiler(app)
+
+    # Initialize database
+    event_listeners = [profiler.command_listener]
+    if app.config['METRICS_ENABLED']:
+        event_listeners.extend([command_listener, pool_listener])
+    init_db(app, event_listeners=event_listeners)
+
+    # Initialize cache (app.extensions['wrdc_cache'])
+    init_cache(app)
+
+    # Queue related-publication refreshes on publication writes
+    init_recommender(app)
+
+    # Mark the stats snapshot dirty on catalog writes
+    init_stats(app)
+
+    # Collection version counters behind the API's ETag/Last-Modified headers
+    init_versions(app)
+
+    # Search spelling suggestions, vocabulary kept current on catalog writes
+    init_spelling(app)
+
+    # Invalidate this process's caches on writes made by other workers and nodes
+    init_invalidation(app)
+
+    # Per-worker columnar catalog snapshot for listings, counts and facets, patched on writes
+    init_catalog_snapshot(app)
+
+    # Register blueprints
+    app.register_blueprint(main_bp)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(api_bp)
+
+    # Fingerprinted third-party assets (asset_url() in templates, served from /assets/)
+    init_assets(app)
+
+    # Register CLI commands (flask wrdc ...)
+    app.cli.add_command(wrdc_cli)
+
+    # Upload storage (app.extensions['wrdc_storage'], upload_url() in templates, /files/ route)
+    init_storage(app, mongo.db)
+
+    # sitemap.xml and Atom feeds served from FEEDS_FOLDER; catalog writes queue their regeneration
+    init_feeds(app)
+
+    # Custom date filter
+    @app.template_filter('format_date')
+    def format_date(value, format='%B %d, %Y'):
+        # publish_date is a datetime; documents not yet migrated still hold 'YYYY-MM-DD'
+        if isinstance(value, date):
+            return value.strftime(format)
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').strftime(format)
+        except:
+            return value
+
+    return app
 
 # Create default admin user if it doesn't exist
-def create_default_admin():
+def create_default_admin(db):
     """Create default admin user if no users exist"""
-    from utils.db import get_db
-    db = get_db()
-    
     if db.users.count_documents({}) == 0:
         # Create default admin user
         User.create_user(
@@ -56,42 +108,30 @@ def create_default_admin():
         print("Default admin user created: username='admin', password='admin123'")
         print("⚠️  IMPORTANT: Change the default password in production!")
 
-# Migrate publications from single author to authors array
-def migrate_authors_to_array():
-    """Convert existing publications with single 'author' field to 'authors' array"""
-    from utils.db import get_db
-    from datetime import datetime
-    db = get_db()
-    
-    # Find publications that have 'author' field but not 'authors' array
-    publications_to_migrate = db.publications.find({
-        'author': {'$exists': True},
-        'authors': {'$exists': False}
-    })
-    
-    migrated_count = 0
-    for pub in publications_to_migrate:
-        if pub.get('author') and not pub.get('authors'):
-            # Convert single author to authors array
-            db.publications.update_one(
-                {'_id': pub['_id']},
-                {
-                    '$set': {
-                        'authors': [pub['author']],
-                        'updated_at': datetime.utcnow()
-                    }
-                }
-            )
-            migrated_count += 1
-    
-    if migrated_count > 0:
-        print(f"✅ Migrated {migrated_count} publication(s) from single author to authors array")
-
-# Note: before_first_request is deprecated in Flask 2.2+
-# Using app context instead
+def run_startup_tasks(config_class=Config, build_indexes=False):
+    """Seed the admin user, apply pending migrations and check indexes
+
+    Run once per deployment (gunicorn's on_starting hook, or `python app.py`),
+    not in every worker. Uses its own short-lived MongoClient so nothing is
+    left open to be inherited by forked workers.
+    """
+    from pymongo import MongoClient
+    from utils.db import mongo_client_options
+    from utils.migrations import run_migrations
+    from utils.indexes import ensure_indexes, verify_indexes
+
+    options = mongo_client_options(config_class)
+    options.pop('socketTimeoutMS', None)  # migrations and index builds can run long
+    with MongoClient(config_class.MONGO_URI, **options) as client:
+        db = client.get_default_database()
+        create_default_admin(db)
+        run_migrations(db, batch_size=config_class.MIGRATION_BATCH_SIZE)
+        if build_indexes:
+            ensure_indexes(db)
+        else:
+            verify_indexes(db)
 
 if __name__ == '__main__':
-    with app.app_context():
-        create_default_admin()
-        migrate_authors_to_array()
-    app.run(host='0.0.0.0', port=2000, debug=True)
+    # Development server; use gunicorn (gunicorn.conf.py) in production
+    run_startup_tasks(DevelopmentConfig, build_indexes=True)
+    create_app(DevelopmentConfig).run(host='0.0.0.0', port=2000)
@@ -0,0 +1,21 @@
+"""ASGI entry point: async /api/v1 reads in front of the Flask app
+
+Usage:
+    uvicorn asgi:application --workers 4 --port 2000
+
+The read-only API endpoints (routes/api_async.py) run as async handlers on
+Motor so slow queries don't tie up a worker. Everything else -- the HTML
+site, API writes and login -- falls through to the Flask app, which runs in
+a thread pool through a2wsgi's WSGI adapter.
+
+Run startup tasks (admin seeding, migrations, index checks) once before
+starting the workers, e.g. ``python -c "from app import run_startup_tasks; run_startup_tasks()"``.
+"""
+import os
+
+from app import create_app
+from config import get_config
+from routes.api_async import create_asgi_app
+
+# Created at import, i.e. in each uvicorn worker process
+application = create_asgi_app(create_app(get_config(os.environ.get('WRDC_CONFIG', 'production'))))
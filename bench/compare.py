@@ -0,0 +1,41 @@
+"""Compare two benchmark result files
+
+Usage:
+    python -m bench.compare bench/results/OLD.json bench/results/NEW.json
+"""
+import argparse
+import json
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'mongo_ops_per_request')
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return ''
+    return f"{(new - old) / old * 100:+.1f}%"
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"old: {old['meta']['commit']} {old['meta']['timestamp']} {old['meta'].get('label', '')}")
+    print(f"new: {new['meta']['commit']} {new['meta']['timestamp']} {new['meta'].get('label', '')}")
+    for name in sorted(set(old['scenarios']) | set(new['scenarios'])):
+        before = old['scenarios'].get(name)
+        after = new['scenarios'].get(name)
+        print(f"\n{name}")
+        if not before or not after:
+            print('  only in ' + ('new' if after else 'old'))
+            continue
+        for metric in METRICS:
+            print(f"  {metric:<22} {before.get(metric)!s:>10} -> {after.get(metric)!s:>10}  "
+                  f"{change(before.get(metric), after.get(metric))}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Benchmark runner
+
+Usage:
+    python -m bench.run [--scenario NAME ...] [--requests 200] [--concurrency 4]
+                        [--target wsgi|asgi|both]
+
+Runs the scenarios in bench/scenarios.py in-process through Flask test
+clients against the database in BENCH_MONGO_URI (seed it first with
+``python -m bench.seed``). For every scenario it reports p50/p95/p99
+latency, throughput and MongoDB commands per request, and writes the
+results to bench/results/<timestamp>-<commit>.json. Compare two runs with
+``python -m bench.compare OLD.json NEW.json``.
+
+With ``--target asgi`` or ``both`` the read-only API scenarios are also
+replayed against the async tier (asgi.py) through httpx's ASGI transport;
+those results are stored as ``<scenario>@asgi``.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from pymongo import monitoring
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts MongoDB commands issued by the current thread and in total
+
+    Motor issues commands from its executor threads, so async runs use the
+    process-wide ``total`` instead of the per-thread ``count``.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.total = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+    def reset(self):
+        self._local.count = 0
+
+    def started(self, event):
+        self._local.count = self.count + 1
+        with self._lock:
+            self.total += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+def run_scenario(app, ctx, counter, name, scenario, needs_login, requests, concurrency, warmup, seed_value):
+    """Run one scenario and return its latency/throughput summary"""
+    from bench.scenarios import login
+
+    latencies = []
+    ops = []
+    errors = 0
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def worker(index, count):
+        nonlocal errors
+        rng = random.Random(seed_value + index)
+        client = app.test_client()
+        if needs_login:
+            login(client, ctx)
+        for _ in range(warmup if index == 0 else 0):
+            scenario(client, ctx, rng)
+        local_latencies, local_ops, local_errors = [], [], 0
+        for _ in range(count):
+            counter.reset()
+            start = time.perf_counter()
+            response = scenario(client, ctx, rng)
+            elapsed = time.perf_counter() - start
+            # Failed requests are counted but kept out of the latency and ops figures
+            if response.status_code >= 400:
+                local_errors += 1
+                continue
+            local_latencies.append(elapsed * 1000.0)
+            local_ops.append(counter.count)
+        with lock:
+            latencies.extend(local_latencies)
+            ops.extend(local_ops)
+            errors += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_worker)]
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+
+    return summarize(latencies, sum(ops), errors, concurrency, wall)
+
+def summarize(latencies, total_ops, errors, concurrency, wall):
+    """Latency percentiles, throughput and MongoDB commands per successful request
+
+    ``latencies`` and ``total_ops`` cover only the successful requests.
+    """
+    latencies = sorted(latencies)
+    summary = {'requests': len(latencies) + errors, 'errors': errors, 'concurrency': concurrency}
+    if not latencies:
+        # Every request failed: there is nothing to measure
+        return dict(summary, p50_ms=None, p95_ms=None, p99_ms=None, mean_ms=None, throughput_rps=None,
+                    mongo_ops_per_request=None)
+    return dict(summary,
+                p50_ms=round(percentile(latencies, 50), 3),
+                p95_ms=round(percentile(latencies, 95), 3),
+                p99_ms=round(percentile(latencies, 99), 3),
+                mean_ms=round(sum(latencies) / len(latencies), 3),
+                throughput_rps=round(len(latencies) / wall, 2) if wall else None,
+                mongo_ops_per_request=round(total_ops / len(latencies), 2))
+
+async def run_asgi_scenario(client, ctx, counter, build_request, requests, concurrency, warmup, seed_value):
+    """Run one API scenario against the ASGI app with ``concurrency`` concurrent coroutines"""
+    import asyncio
+
+    latencies = []
+    errors = 0
+
+    async def worker(index, count):
+        nonlocal errors
+        rng = random.Random(seed_value + index)
+        for _ in range(count):
+            path, params = build_request(ctx, rng)
+            start = time.perf_counter()
+            response = await client.get(path, params=params)
+            elapsed = time.perf_counter() - start
+            if response.status_code >= 400:
+                errors += 1
+                continue
+            latencies.append(elapsed * 1000.0)
+
+    warmup_rng = random.Random(seed_value)
+    for _ in range(warmup):
+        path, params = build_request(ctx, warmup_rng)
+        await client.get(path, params=params)
+
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    # Concurrent coroutines share the counter, so commands issued by failed
+    # requests cannot be told apart and stay in the total
+    ops_start = counter.total
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker(i, n) for i, n in enumerate(per_worker)))
+    wall = time.perf_counter() - wall_start
+    return summarize(latencies, counter.total - ops_start, errors, concurrency, wall)
+
+async def run_asgi_scenarios(app, ctx, counter, names, args):
+    """Run the API scenarios in ``names`` against the async tier wrapped around ``app``"""
+    import httpx
+    from routes.api_async import create_asgi_app
+    from bench.scenarios import API_REQUESTS
+    from utils.db import close_async_db
+
+    results = {}
+    transport = httpx.ASGITransport(app=create_asgi_app(app))
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            for name in names:
+                summary = await run_asgi_scenario(client, ctx, counter, API_REQUESTS[name], args.requests,
+                                                  args.concurrency, args.warmup, args.seed)
+                results[f"{name}@asgi"] = summary
+                print_summary(f"{name}@asgi", summary)
+    finally:
+        close_async_db()
+    return results
+
+def print_summary(name, summary):
+    if summary['p50_ms'] is None:
+        print(f"{name:<18} no successful requests  errors {summary['errors']}")
+        return
+    print(f"{name:<18} p50 {summary['p50_ms']:>8.2f} ms  p95 {summary['p95_ms']:>8.2f} ms  "
+          f"p99 {summary['p99_ms']:>8.2f} ms  {summary['throughput_rps']:>8.1f} req/s  "
+          f"{summary['mongo_ops_per_request']:>6.1f} ops/req  errors {summary['errors']}")
+
+def cleanup_uploads(db, storage):
+    """Remove publications and files created by the upload scenario"""
+    from bench.scenarios import UPLOAD_PREFIX
+    from utils.storage import upload_key
+    query = {'pdf_filename': {'$regex': f"^{UPLOAD_PREFIX}"}}
+    for pub in db.publications.find(query, {'pdf_filename': 1, 'cover_filename': 1}):
+        for kind, key in (('pdfs', 'pdf_filename'), ('covers', 'cover_filename')):
+            filename = pub.get(key)
+            if filename and filename.startswith(UPLOAD_PREFIX):
+                storage.delete(upload_key(kind, filename))
+    db.publications.delete_many(query)
+
+def main():
+    from bench.scenarios import SCENARIOS
+
+    parser = argparse.ArgumentParser(description='Run WRDC benchmark scenarios')
+    parser.add_argument('--mongo-uri', default=os.environ.get('BENCH_MONGO_URI', 'mongodb://localhost:27017/wrdc_bench'))
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run (repeatable, default: all)')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent client threads')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured warm-up requests per scenario')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--target', choices=['wsgi', 'asgi', 'both'], default='wsgi',
+                        help='Run API scenarios on the Flask app, the async tier (asgi.py) or both')
+    parser.add_argument('--label', default='', help='Free-form label stored with the results')
+    parser.add_argument('--output', default=None, help='Result file (default: bench/results/<timestamp>-<commit>.json)')
+    args = parser.parse_args()
+
+    # The listener must be registered before the app creates its MongoClient
+    counter = CommandCounter()
+    monitoring.register(counter)
+    os.environ['MONGO_URI'] = args.mongo_uri
+
+    from app import create_app
+    from utils.db import mongo
+    from bench.scenarios import BenchContext, API_REQUESTS
+
+    app = create_app()
+    app.config['TESTING'] = True
+    db = mongo.db
+    ctx = BenchContext(db)
+    names = args.scenario or list(SCENARIOS)
+
+    results = {}
+    try:
+        for name in (names if args.target != 'asgi' else []):
+            scenario, needs_login = SCENARIOS[name]
+            if needs_login and not ctx.admin_username:
+                print(f"Skipping {name}: no admin user in the benchmark database")
+                continue
+            summary = run_scenario(app, ctx, counter, name, scenario, needs_login,
+                                   args.requests, args.concurrency, args.warmup, args.seed)
+            results[name] = summary
+            print_summary(name, summary)
+        if args.target in ('asgi', 'both'):
+            import asyncio
+            api_names = [name for name in names if name in API_REQUESTS]
+            results.update(asyncio.run(run_asgi_scenarios(app, ctx, counter, api_names, args)))
+    finally:
+        cleanup_uploads(db, app.extensions['wrdc_storage'])
+
+    commit = git_commit()
+    timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    output = args.output or os.path.join(RESULTS_DIR, f"{timestamp}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {
+                'commit': commit,
+                'timestamp': timestamp,
+                'label': args.label,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'requests': args.requests,
+                'concurrency': args.concurrency,
+                'target': args.target,
+                'catalog': {
+                    'publications': db.publications.estimated_document_count(),
+                    'authors': db.authors.estimated_document_count(),
+                    'users': db.users.estimated_document_count(),
+                },
+            },
+            'scenarios': results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Scripted benchmark scenarios
+
+Each scenario is a function ``(client, ctx, rng)`` that issues one request
+through a Flask test client and returns the response. The read-only API
+scenarios are built from ``(ctx, rng) -> (path, params)`` request functions
+in API_REQUESTS so bench.run can replay them against the ASGI tier too. ``ctx`` is a
+BenchContext holding sample ids and values read from the seeded catalog.
+"""
+import io
+import itertools
+import threading
+
+from bench.seed import BENCH_PASSWORD, WORDS
+
+UPLOAD_PREFIX = 'bench_upload_'
+
+class BenchContext:
+    """Sample values drawn from the seeded catalog"""
+
+    def __init__(self, db, per_page=9):
+        self.publication_ids = [str(p['_id']) for p in db.publications.find({}, {'_id': 1}).limit(5000)]
+        self.author_ids = [str(a['_id']) for a in db.authors.find({}, {'_id': 1}).limit(5000)]
+        self.author_names = [a['name'] for a in db.authors.find({}, {'name': 1}).limit(5000)]
+        self.categories = db.publications.distinct('category')
+        self.publish_years = [str(year) for year in db.publications.distinct('publish_year')]
+        self.total_pages = max(1, (db.publications.count_documents({}) + per_page - 1) // per_page)
+        admin = db.users.find_one({'role': 'admin'}, {'username': 1})
+        self.admin_username = admin['username'] if admin else None
+        self.admin_password = BENCH_PASSWORD
+        self._upload_counter = itertools.count()
+        self._lock = threading.Lock()
+        self.pdf_bytes = _small_pdf_bytes()
+
+    def next_upload_name(self):
+        with self._lock:
+            return f"{UPLOAD_PREFIX}{next(self._upload_counter):06d}.pdf"
+
+def _small_pdf_bytes():
+    import fitz  # PyMuPDF
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), 'Benchmark upload', fontsize=14)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def login(client, ctx):
+    """Log a test client in as the seeded admin user"""
+    return client.post('/auth/login', data={'username': ctx.admin_username, 'password': ctx.admin_password})
+
+def homepage_filters(client, ctx, rng):
+    params = {'sort': rng.choice(['title', 'publish_date', 'author'])}
+    if rng.random() < 0.6:
+        params['category'] = rng.choice(ctx.categories)
+    if rng.random() < 0.3:
+        params['author'] = rng.choice(ctx.author_names)
+    if rng.random() < 0.1 and ctx.publish_years:
+        params['from'], params['to'] = sorted(rng.sample(ctx.publish_years, 2) if len(ctx.publish_years) > 1
+                                              else ctx.publish_years * 2)
+    return client.get('/', query_string=params)
+
+def deep_pagination(client, ctx, rng):
+    start = max(1, ctx.total_pages * 3 // 4)
+    return client.get('/', query_string={'page': rng.randint(start, ctx.total_pages)})
+
+def search(client, ctx, rng):
+    return client.get('/', query_string={'search': rng.choice(WORDS)})
+
+def author_profile(client, ctx, rng):
+    return client.get(f"/author/{rng.choice(ctx.author_ids)}")
+
+# Read-only API requests, described as (path, params) so the same request mix
+# can be sent to the Flask app and to the async tier in asgi.py
+def api_list_request(ctx, rng):
+    params = {'page': rng.randint(1, 20), 'per_page': 20}
+    if rng.random() < 0.5:
+        params['category'] = rng.choice(ctx.categories)
+    return '/api/v1/publications', params
+
+def api_detail_request(ctx, rng):
+    return f"/api/v1/publications/{rng.choice(ctx.publication_ids)}", {}
+
+def api_stats_request(ctx, rng):
+    return '/api/v1/stats', {}
+
+def _api_scenario(build_request):
+    def scenario(client, ctx, rng):
+        path, params = build_request(ctx, rng)
+        return client.get(path, query_string=params)
+    scenario.__name__ = build_request.__name__.replace('_request', '')
+    return scenario
+
+def view_pdf(client, ctx, rng):
+    return client.get(f"/view_pdf/{rng.choice(ctx.publication_ids)}")
+
+def upload(client, ctx, rng):
+    filename = ctx.next_upload_name()
+    return client.post('/admin/add_publication', data={
+        'title': f"Benchmark upload {filename}",
+        'authors': [rng.choice(ctx.author_names)],
+        'category': rng.choice(ctx.categories),
+        'publish_date': '2024-01-15',
+        'pdf': (io.BytesIO(ctx.pdf_bytes), filename),
+    }, content_type='multipart/form-data')
+
+# name -> (scenario, needs_login)
+SCENARIOS = {
+    'homepage_filters': (homepage_filters, False),
+    'deep_pagination': (deep_pagination, False),
+    'search': (search, False),
+    'author_profile': (author_profile, False),
+    'api_list': (_api_scenario(api_list_request), False),
+    'api_detail': (_api_scenario(api_detail_request), False),
+    'api_stats': (_api_scenario(api_stats_request), False),
+    'view_pdf': (view_pdf, False),
+    'upload': (upload, True),
+}
+
+# API scenarios that can also run against the ASGI tier (--target asgi)
+API_REQUESTS = {
+    'api_list': api_list_request,
+    'api_detail': api_detail_request,
+    'api_stats': api_stats_request,
+}
@@ -0,0 +1,183 @@
+"""Synthetic catalog generator for benchmarks
+
+Usage:
+    python -m bench.seed --publications 5000 --authors 400 --users 200 [--pdfs] [--drop]
+
+Seeds the database named in BENCH_MONGO_URI (a dedicated benchmark database,
+default mongodb://localhost:27017/wrdc_bench). Distributions are skewed the way
+the real catalog is: most publications have one or two authors, a few
+categories hold most of the documents and a few prolific authors appear on
+many publications.
+"""
+import argparse
+import io
+import os
+import random
+from datetime import datetime, date, timedelta
+
+from pymongo import MongoClient
+from werkzeug.security import generate_password_hash
+from config import Config
+
+CATEGORIES = [
+    ('Evaporator', 30), ('Heat Exchanger', 20), ('Desalination', 15), ('Water Quality', 10),
+    ('Corrosion', 8), ('Membranes', 6), ('Energy', 5), ('Pumps', 3), ('Instrumentation', 2), ('Other', 1)
+]
+
+# Number of authors per publication and its relative frequency
+AUTHOR_COUNTS = [(1, 50), (2, 30), (3, 12), (4, 5), (5, 2), (6, 1)]
+
+WORDS = (
+    'thermal performance analysis scaling multi stage flash brine recirculation reverse osmosis '
+    'membrane fouling heat transfer coefficient evaporator tube corrosion resistance seawater '
+    'intake pretreatment energy recovery optimization pilot plant study evaluation model design '
+    'control system monitoring efficiency distillation condenser vapor compression chemical dosing '
+    'antiscalant boron removal groundwater aquifer storage network pressure pump maintenance'
+).split()
+
+FIRST_NAMES = ['Ahmad', 'Fatima', 'Mohammad', 'Noura', 'Khalid', 'Sara', 'Yousef', 'Mariam',
+               'Abdullah', 'Huda', 'Omar', 'Dana', 'Ali', 'Reem', 'Hamad', 'Lulwa']
+LAST_NAMES = ['Al-Sabah', 'Al-Mutairi', 'Al-Enezi', 'Al-Rashidi', 'Al-Ajmi', 'Al-Kandari',
+              'Al-Shammari', 'Al-Azmi', 'Al-Hajri', 'Al-Otaibi', 'Al-Fadhli', 'Al-Dosari']
+
+BENCH_PASSWORD = 'bench-password'
+
+def weighted_choice(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights, k=1)[0]
+
+def make_title(rng):
+    words = rng.sample(WORDS, rng.randint(4, 9))
+    return ' '.join(words).capitalize()
+
+def make_author_names(rng, count):
+    names = set()
+    while len(names) < count:
+        names.add(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {len(names) + 1}")
+    return sorted(names)
+
+def make_pdf(title, pages=2):
+    """Build a small PDF with a few pages of text and return its bytes"""
+    import fitz  # PyMuPDF
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"{title} - page {number + 1}", fontsize=14)
+        page.insert_text((72, 110), ' '.join(WORDS[:40]), fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def seed(db, publications=1000, authors=100, users=50, pdfs=False, drop=False, seed_value=42, log=print):
+    """Generate a synthetic catalog and return a summary of what was written"""
+    rng = random.Random(seed_value)
+
+    if drop:
+        for name in ('publications', 'authors', 'users', 'favorites'):
+            db[name].drop()
+
+    author_names = make_author_names(rng, authors)
+    now = datetime.utcnow()
+    db.authors.insert_many([{
+        'name': name,
+        'image': 'default_author.jpg',
+        'profile': f"{name} is a researcher at WRDC.",
+        'education': 'PhD, Chemical Engineering',
+        'experience': f"{rng.randint(2, 30)} years",
+        'skills': ', '.join(rng.sample(WORDS, 4)),
+        'created_at': now - timedelta(days=rng.randint(0, 3650)),
+        'updated_at': now
+    } for name in author_names])
+    log(f"Inserted {authors} author(s)")
+
+    # A few prolific authors appear on many publications (Pareto-like weights)
+    author_weights = [1.0 / (rank + 1) ** 0.8 for rank in range(len(author_names))]
+
+    if pdfs:
+        # PDFs go to the configured upload storage (STORAGE_BACKEND)
+        from utils.storage import create_storage, upload_key
+        storage = create_storage(Config, db)
+
+    batch = []
+    start = date(2000, 1, 1)
+    for number in range(publications):
+        count = min(weighted_choice(rng, AUTHOR_COUNTS), len(author_names))
+        pub_authors = set()
+        while len(pub_authors) < count:
+            pub_authors.add(rng.choices(author_names, weights=author_weights, k=1)[0])
+        title = make_title(rng)
+        pdf_filename = f"bench_{number:07d}.pdf"
+        if pdfs:
+            storage.put(upload_key('pdfs', pdf_filename), io.BytesIO(make_pdf(title)), 'application/pdf')
+        created_at = now - timedelta(minutes=publications - number)
+        published = start + timedelta(days=rng.randint(0, 9000))
+        batch.append({
+            'title': title,
+            'authors': sorted(pub_authors),
+            'category': weighted_choice(rng, CATEGORIES),
+            'publish_date': datetime(published.year, published.month, published.day),
+            'publish_year': published.year,
+            'pdf_filename': pdf_filename,
+            'cover_filename': 'default_cover.jpg',
+            'created_at': created_at,
+            'updated_at': created_at,
+            'download_count': rng.randint(0, 500),
+            'view_count': rng.randint(0, 5000)
+        })
+        if len(batch) >= 1000:
+            db.publications.insert_many(batch)
+            batch = []
+    if batch:
+        db.publications.insert_many(batch)
+    log(f"Inserted {publications} publication(s){' with PDFs' if pdfs else ''}")
+
+    # Hashing is deliberately slow, so every benchmark user shares one hash
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    roles = [('viewer', 80), ('editor', 15), ('admin', 5)]
+    db.users.insert_many([{
+        'username': f"bench_user_{number}",
+        'email': f"bench_user_{number}@wrdc.kw",
+        'password_hash': password_hash,
+        'role': 'admin' if number == 0 else weighted_choice(rng, roles),
+        'created_at': now,
+        'last_login': None
+    } for number in range(users)])
+    log(f"Inserted {users} user(s); password for all is '{BENCH_PASSWORD}', bench_user_0 is admin")
+
+    # Most users keep a handful of favorites; a few power users keep hundreds
+    publication_ids = [p['_id'] for p in db.publications.find({}, {'_id': 1})]
+    favorites = []
+    for user in db.users.find({'username': {'$regex': '^bench_user_'}}, {'_id': 1}):
+        count = rng.randint(200, 500) if rng.random() < 0.05 else rng.randint(0, 10)
+        for publication_id in rng.sample(publication_ids, min(count, len(publication_ids))):
+            favorites.append({'user_id': user['_id'], 'publication_id': publication_id, 'created_at': now})
+    for offset in range(0, len(favorites), 1000):
+        db.favorites.insert_many(favorites[offset:offset + 1000])
+    log(f"Inserted {len(favorites)} favorite(s)")
+
+    return {
+        'publications': publications,
+        'authors': authors,
+        'users': users,
+        'pdfs': pdfs,
+        'author_names': author_names,
+        'categories': [name for name, _ in CATEGORIES]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a synthetic WRDC catalog for benchmarking')
+    parser.add_argument('--mongo-uri', default=os.environ.get('BENCH_MONGO_URI', 'mongodb://localhost:27017/wrdc_bench'))
+    parser.add_argument('--publications', type=int, default=1000)
+    parser.add_argument('--authors', type=int, default=100)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--pdfs', action='store_true', help='Also generate small PDF files')
+    parser.add_argument('--drop', action='store_true', help='Drop existing catalog collections first')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for reproducible catalogs')
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri)
+    db = client.get_default_database()
+    seed(db, args.publications, args.authors, args.users, pdfs=args.pdfs, drop=args.drop, seed_value=args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,30 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     MONGO_URI = os.environ.get('MONGO_URI') or 'mongodb://localhost:27017/library'
     
+    # MongoDB connection pool and timeouts (per process; see gunicorn.conf.py)
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000))
+    MONGO_APP_NAME = os.environ.get('MONGO_APP_NAME') or 'wrdc-library'
+    
+    # Read routing for anonymous catalog pages: 'primary', 'primaryPreferred',
+    # 'secondary', 'secondaryPreferred' or 'nearest'. Signed-in users always
+    # read from the primary so they see their own writes.
+    CATALOG_READ_PREFERENCE = os.environ.get('CATALOG_READ_PREFERENCE') or 'secondaryPreferred'
+    CATALOG_MAX_STALENESS_SECONDS = int(os.environ.get('CATALOG_MAX_STALENESS_SECONDS', -1))  # -1: no limit, else >= 90
+    
+    # Server-side time budgets (maxTimeMS) per query class
+    QUERY_TIME_BUDGETS_MS = {
+        'catalog': int(os.environ.get('QUERY_BUDGET_CATALOG_MS', 2000)),   # listing pages and counts
+        'search': int(os.environ.get('QUERY_BUDGET_SEARCH_MS', 3000)),     # free-text / regex search
+        'facets': int(os.environ.get('QUERY_BUDGET_FACETS_MS', 5000)),     # facet aggregations (cached)
+        'stats': int(os.environ.get('QUERY_BUDGET_STATS_MS', 10000)),      # reporting aggregations
+    }
+    
     # Upload configuration
     UPLOAD_FOLDER = 'static/uploads'
     PDF_FOLDER = os.path.join(UPLOAD_FOLDER, 'pdfs')
@@ -15,6 +39,19 @@ class Config:
     AUTHOR_FOLDER = os.path.join(UPLOAD_FOLDER, 'authors')
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif'}
     
+    # Upload storage backend: 'local' (UPLOAD_FOLDER), 'gridfs' or 's3' (see utils/storage.py)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND') or 'local'
+    STORAGE_LOCAL_ROOT = os.environ.get('STORAGE_LOCAL_ROOT') or UPLOAD_FOLDER
+    STORAGE_GRIDFS_BUCKET = os.environ.get('STORAGE_GRIDFS_BUCKET') or 'uploads'
+    STORAGE_S3_BUCKET = os.environ.get('STORAGE_S3_BUCKET') or 'wrdc-uploads'
+    STORAGE_S3_ENDPOINT_URL = os.environ.get('STORAGE_S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+    STORAGE_S3_REGION = os.environ.get('STORAGE_S3_REGION')
+    STORAGE_S3_ACCESS_KEY_ID = os.environ.get('STORAGE_S3_ACCESS_KEY_ID')
+    STORAGE_S3_SECRET_ACCESS_KEY = os.environ.get('STORAGE_S3_SECRET_ACCESS_KEY')
+    STORAGE_S3_PREFIX = os.environ.get('STORAGE_S3_PREFIX') or ''
+    STORAGE_S3_PUBLIC_URL = os.environ.get('STORAGE_S3_PUBLIC_URL')  # public bucket/CDN base URL instead of presigning
+    STORAGE_URL_EXPIRES = int(os.environ.get('STORAGE_URL_EXPIRES', 3600))
+    
     # Session configuration
     SESSION_COOKIE_SECURE = os.environ.get('SESSION_COOKIE_SECURE', 'False').lower() == 'true'
     SESSION_COOKIE_HTTPONLY = True
@@ -28,8 +65,81 @@ class Config:
     PUBLICATIONS_PER_PAGE = 9
     
     # Cache configuration
-    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'simple'
+    # CACHE_TYPE: 'lru' (per process), 'filesystem' (per host), 'redis' (shared)
+    # or 'fakeredis' (in-memory Redis stand-in for development and tests)
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'lru'
     CACHE_DEFAULT_TIMEOUT = 300
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join('instance', 'cache')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+    CACHE_KEY_PREFIX = os.environ.get('CACHE_KEY_PREFIX') or 'wrdc:'
+    CACHE_LOCK_TIMEOUT = 10
+    CACHE_EARLY_REFRESH_BETA = 1.0
+    
+    # Invalidate per-process caches on writes made by other workers and nodes (utils/invalidation.py)
+    INVALIDATION_LISTENER_ENABLED = os.environ.get('INVALIDATION_LISTENER_ENABLED', 'true').lower() == 'true'
+    INVALIDATION_LISTENER_ID = os.environ.get('INVALIDATION_LISTENER_ID')  # resume-token key; default: hostname
+    INVALIDATION_POLL_SECONDS = int(os.environ.get('INVALIDATION_POLL_SECONDS', 5))  # without change streams
+    
+    # In-process catalog snapshot serving listings, counts and facets (utils/catalog.py)
+    CATALOG_SNAPSHOT_ENABLED = os.environ.get('CATALOG_SNAPSHOT_ENABLED', 'true').lower() == 'true'
+    CATALOG_SNAPSHOT_MAX_DOCUMENTS = int(os.environ.get('CATALOG_SNAPSHOT_MAX_DOCUMENTS', 200000))
+    CATALOG_SNAPSHOT_MAX_PENDING = int(os.environ.get('CATALOG_SNAPSHOT_MAX_PENDING', 500))  # more queued changes: rebuild
+    
+    # Metrics (Prometheus text format)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+    METRICS_PATH = '/metrics'
+    # Shared by gunicorn workers so /metrics covers all of them (gunicorn.conf.py sets a default)
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+    METRICS_FLUSH_SECONDS = int(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+    # Scrapers need the bearer token or an address in the allow-list (IPs or CIDR ranges)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+    
+    # Query profiler (always on in debug mode; enable explicitly on staging)
+    QUERY_PROFILER_ENABLED = os.environ.get('QUERY_PROFILER_ENABLED', 'False').lower() == 'true'
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 100))
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+    
+    # Related publications (flask wrdc related)
+    RELATED_PUBLICATIONS_K = int(os.environ.get('RELATED_PUBLICATIONS_K', 6))
+    RELATED_MIN_SCORE = float(os.environ.get('RELATED_MIN_SCORE', 0.05))
+    RELATED_TEXT_PAGES = int(os.environ.get('RELATED_TEXT_PAGES', 3))
+    
+    # Stats snapshots served by the admin dashboard and /api/v1/stats (flask wrdc stats)
+    STATS_SNAPSHOT_MAX_AGE_SECONDS = int(os.environ.get('STATS_SNAPSHOT_MAX_AGE_SECONDS', 300))
+    STATS_SNAPSHOT_MIN_INTERVAL_SECONDS = int(os.environ.get('STATS_SNAPSHOT_MIN_INTERVAL_SECONDS', 30))
+    
+    # View/download analytics rollups (flask wrdc analytics) and trending
+    ANALYTICS_HOURLY_RETENTION_DAYS = int(os.environ.get('ANALYTICS_HOURLY_RETENTION_DAYS', 7))
+    ANALYTICS_DAILY_RETENTION_DAYS = int(os.environ.get('ANALYTICS_DAILY_RETENTION_DAYS', 400))
+    TRENDING_CACHE_SECONDS = int(os.environ.get('TRENDING_CACHE_SECONDS', 300))
+    
+    # "Did you mean" suggestions for searches without results (flask wrdc spelling)
+    SPELLING_MAX_EDIT_DISTANCE = int(os.environ.get('SPELLING_MAX_EDIT_DISTANCE', 2))
+    SPELLING_SYNC_SECONDS = int(os.environ.get('SPELLING_SYNC_SECONDS', 60))
+    
+    # Self-hosted third-party assets (flask wrdc assets); relative to the app root
+    ASSETS_VENDOR_FOLDER = os.path.join('static', 'vendor')
+    ASSETS_DIST_FOLDER = os.path.join('static', 'dist')
+    ASSETS_URL_PATH = '/assets'
+    
+    # sitemap.xml and Atom feeds, generated by `flask wrdc feeds` and served from FEEDS_FOLDER
+    SITE_URL = os.environ.get('SITE_URL') or 'http://localhost:2000'  # public base URL used in the files
+    FEEDS_FOLDER = os.environ.get('FEEDS_FOLDER') or os.path.join('instance', 'feeds')
+    FEEDS_MAX_ENTRIES = int(os.environ.get('FEEDS_MAX_ENTRIES', 50))
+    FEEDS_CACHE_SECONDS = int(os.environ.get('FEEDS_CACHE_SECONDS', 300))
+    
+    # Catalog and upload backups (flask wrdc backup / restore)
+    BACKUP_FOLDER = os.environ.get('BACKUP_FOLDER') or 'backups'
+    BACKUP_WORKERS = int(os.environ.get('BACKUP_WORKERS', 4))
+    
+    # Removal of uploads no publication or author refers to (flask wrdc gc)
+    GC_GRACE_HOURS = int(os.environ.get('GC_GRACE_HOURS', 24))
+    GC_DELETES_PER_SECOND = int(os.environ.get('GC_DELETES_PER_SECOND', 10))
+    
+    # Data migrations (flask wrdc migrate)
+    MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 500))
 
 class DevelopmentConfig(Config):
     """Development configuration"""
@@ -39,3 +149,13 @@ class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
     SESSION_COOKIE_SECURE = True
+
+config_by_name = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'default': Config
+}
+
+def get_config(name=None):
+    """Config class named by ``name`` or the WRDC_CONFIG environment variable"""
+    return config_by_name[name or os.environ.get('WRDC_CONFIG') or 'default']
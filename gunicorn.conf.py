@@ -0,0 +1,73 @@
+"""Gunicorn configuration
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Sizing can be overridden with environment variables:
+  WEB_CONCURRENCY   worker processes (default: 2 x CPU cores + 1)
+  GUNICORN_THREADS  threads per worker (default: 4)
+  GUNICORN_BIND     listen address (default: 0.0.0.0:2000)
+  GUNICORN_TIMEOUT  seconds before a silent worker is restarted (default: 60)
+
+Requests are mostly waiting on MongoDB, so each worker runs a few threads
+(gthread); PDF thumbnailing is CPU-bound, which is why the process count
+still follows the core count. Every worker has its own MongoDB connection
+pool, so budget roughly workers x threads connections against the server's
+connection limit.
+"""
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:2000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth from PDF rendering
+max_requests = 2000
+max_requests_jitter = 200
+
+# The app must be imported in each worker after the fork, never in the
+# master: a MongoClient created before fork() is not fork-safe.
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+# Workers share request metrics through this directory so /metrics covers all
+# of them, whichever worker answers the scrape; set before the workers fork
+os.environ.setdefault('METRICS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), f"wrdc-metrics-{os.getpid()}"))
+
+def on_starting(server):
+    """Run one-off startup tasks in the master before any worker is forked"""
+    from app import run_startup_tasks
+    from config import get_config
+    from utils.metrics import clear_multiproc_dir
+    clear_multiproc_dir(os.environ['METRICS_MULTIPROC_DIR'])
+    run_startup_tasks(get_config(os.environ.get('WRDC_CONFIG', 'production')))
+
+def post_worker_init(worker):
+    """Start the worker's cache invalidation listener and catalog snapshot before it takes requests"""
+    from utils.invalidation import start_listener
+    from utils.catalog import start_snapshot
+    start_listener(worker.wsgi)
+    start_snapshot(worker.wsgi)
+
+def worker_exit(server, worker):
+    """Flush the worker's metrics one last time"""
+    store = getattr(worker, 'wsgi', None) and worker.wsgi.extensions.get('wrdc_metrics_store')
+    if store is not None:
+        store.flush()
+
+def child_exit(server, worker):
+    """Keep a reaped worker's counters in the totals served by /metrics"""
+    from utils.metrics import mark_process_dead
+    mark_process_dead(os.environ['METRICS_MULTIPROC_DIR'], worker.pid)
+
+def on_exit(server):
+    """Remove the shared metrics files"""
+    from utils.metrics import clear_multiproc_dir
+    clear_multiproc_dir(os.environ['METRICS_MULTIPROC_DIR'])
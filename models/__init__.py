@@ -1,5 +1,6 @@
 from .user import User
 from .publication import Publication
 from .author import Author
+from .favorite import Favorite
 
-__all__ = ['User', 'Publication', 'Author']
+__all__ = ['User', 'Publication', 'Author', 'Favorite']
@@ -1,5 +1,6 @@
 from datetime import datetime
 from bson.objectid import ObjectId
+from utils.signals import author_changed
 
 class Author:
     """Author model"""
@@ -18,6 +19,7 @@ class Author:
             'updated_at': datetime.utcnow()
         }
         result = db.authors.insert_one(author)
+        author_changed.send(Author, op='create', id=str(result.inserted_id))
         return result.inserted_id
     
     @staticmethod
@@ -28,11 +30,14 @@ class Author:
             {'_id': ObjectId(author_id)},
             {'$set': kwargs}
         )
+        author_changed.send(Author, op='update', id=str(author_id))
     
     @staticmethod
     def delete(db, author_id):
         """Delete an author"""
-        return db.authors.delete_one({'_id': ObjectId(author_id)})
+        result = db.authors.delete_one({'_id': ObjectId(author_id)})
+        author_changed.send(Author, op='delete', id=str(author_id))
+        return result
     
     @staticmethod
     def get_by_id(db, author_id):
@@ -43,3 +48,12 @@ class Author:
     def get_by_name(db, name):
         """Get author by name"""
         return db.authors.find_one({'name': name})
+    
+    @staticmethod
+    def get_images_by_names(db, names):
+        """Get a {name: image} map for several authors in a single query"""
+        names = list(set(names))
+        if not names:
+            return {}
+        authors = db.authors.find({'name': {'$in': names}}, {'name': 1, 'image': 1})
+        return {author['name']: author['image'] for author in authors if author.get('image')}
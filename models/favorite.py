@@ -0,0 +1,96 @@
+from datetime import datetime
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from utils.signals import user_changed
+
+# Publication fields returned by favorites listings
+FAVORITE_LIST_PROJECTION = {
+    'title': 1,
+    'authors': 1,
+    'author': 1,
+    'category': 1,
+    'publish_date': 1,
+    'cover_filename': 1,
+}
+
+def _object_ids(ids):
+    """Convert ids to ObjectIds, skipping malformed ones"""
+    result = []
+    for value in ids:
+        try:
+            result.append(value if isinstance(value, ObjectId) else ObjectId(value))
+        except (InvalidId, TypeError):
+            continue
+    return result
+
+class Favorite:
+    """A user's favorite publication, stored one document per (user, publication) pair
+
+    Backed by the ``favorites`` collection with a unique
+    (user_id, publication_id) index, so lookups never load the user document
+    and a user's favorites can grow without bound.
+    """
+
+    @staticmethod
+    def add(db, user_id, publication_id):
+        """Add a publication to a user's favorites (no-op if already there)"""
+        user_id, publication_id = ObjectId(user_id), ObjectId(publication_id)
+        db.favorites.update_one(
+            {'user_id': user_id, 'publication_id': publication_id},
+            {'$setOnInsert': {'created_at': datetime.utcnow()}},
+            upsert=True
+        )
+        user_changed.send(Favorite, op='update', id=str(user_id))
+
+    @staticmethod
+    def remove(db, user_id, publication_id):
+        """Remove a publication from a user's favorites"""
+        db.favorites.delete_one({'user_id': ObjectId(user_id), 'publication_id': ObjectId(publication_id)})
+        user_changed.send(Favorite, op='update', id=str(user_id))
+
+    @staticmethod
+    def remove_publication(db, publication_id):
+        """Drop a deleted publication from everyone's favorites"""
+        return db.favorites.delete_many({'publication_id': ObjectId(publication_id)})
+
+    @staticmethod
+    def count(db, user_id):
+        """Number of publications a user has favorited"""
+        return db.favorites.count_documents({'user_id': ObjectId(user_id)})
+
+    @staticmethod
+    def list_for_user(db, user_id, page=1, per_page=20, projection=FAVORITE_LIST_PROJECTION):
+        """Get one page of a user's favorite publications, most recently added first
+
+        Returns ``(publications, total)``. Only ``projection`` fields of each
+        publication are loaded; each one carries ``favorited_at``.
+        """
+        query = {'user_id': ObjectId(user_id)}
+        entries = list(db.favorites.find(query, {'publication_id': 1, 'created_at': 1, '_id': 0})
+                       .sort('created_at', -1).skip((page - 1) * per_page).limit(per_page))
+        total = db.favorites.count_documents(query)
+        if not entries:
+            return [], total
+
+        ids = [entry['publication_id'] for entry in entries]
+        found = {pub['_id']: pub for pub in db.publications.find({'_id': {'$in': ids}}, projection)}
+        publications = []
+        for entry in entries:
+            pub = found.get(entry['publication_id'])
+            if pub is not None:
+                pub['favorited_at'] = entry['created_at']
+                publications.append(pub)
+        return publications, total
+
+    @staticmethod
+    def favorited_ids(db, user_id, publication_ids):
+        """Which of ``publication_ids`` the user has favorited, as a set of id strings
+
+        One query, answered from the (user_id, publication_id) index alone.
+        """
+        ids = _object_ids(publication_ids)
+        if not ids:
+            return set()
+        cursor = db.favorites.find({'user_id': ObjectId(user_id), 'publication_id': {'$in': ids}},
+                                   {'publication_id': 1, '_id': 0})
+        return {str(entry['publication_id']) for entry in cursor}
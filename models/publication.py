@@ -1,5 +1,9 @@
 from datetime import datetime
 from bson.objectid import ObjectId
+from utils.signals import publication_changed
+from models.favorite import Favorite
+from utils.analytics import record_event
+from utils.query import publish_date_fields
 
 class Publication:
     """Publication model"""
@@ -25,7 +29,7 @@ class Publication:
             'title': title,
             'authors': authors,
             'category': category,
-            'publish_date': datetime.strptime(publish_date, '%Y-%m-%d').date().isoformat(),
+            **publish_date_fields(publish_date),
             'pdf_filename': pdf_filename,
             'cover_filename': cover_filename,
             'created_at': datetime.utcnow(),
@@ -34,6 +38,7 @@ class Publication:
             'view_count': 0
         }
         result = db.publications.insert_one(publication)
+        publication_changed.send(Publication, op='create', id=str(result.inserted_id))
         return result.inserted_id
     
     @staticmethod
@@ -41,6 +46,7 @@ class Publication:
         """Update publication fields
         
         If 'authors' is provided as a string, it will be converted to a list.
+        A 'publish_date' string ('YYYY-MM-DD') is stored as a date, with 'publish_year'.
         """
         # Ensure authors is a list if provided
         if 'authors' in kwargs:
@@ -49,16 +55,24 @@ class Publication:
             elif not isinstance(kwargs['authors'], list):
                 kwargs['authors'] = list(kwargs['authors']) if kwargs['authors'] else []
         
+        # Dates are stored as BSON dates with the year alongside
+        if kwargs.get('publish_date'):
+            kwargs.update(publish_date_fields(kwargs['publish_date']))
+        
         kwargs['updated_at'] = datetime.utcnow()
         db.publications.update_one(
             {'_id': ObjectId(publication_id)},
             {'$set': kwargs}
         )
+        publication_changed.send(Publication, op='update', id=str(publication_id))
     
     @staticmethod
     def delete(db, publication_id):
         """Delete a publication"""
-        return db.publications.delete_one({'_id': ObjectId(publication_id)})
+        result = db.publications.delete_one({'_id': ObjectId(publication_id)})
+        Favorite.remove_publication(db, publication_id)
+        publication_changed.send(Publication, op='delete', id=str(publication_id))
+        return result
     
     @staticmethod
     def get_by_id(db, publication_id):
@@ -67,19 +81,21 @@ class Publication:
     
     @staticmethod
     def increment_view_count(db, publication_id):
-        """Increment view count"""
+        """Increment view count (lifetime total and the current hourly analytics bucket)"""
         db.publications.update_one(
             {'_id': ObjectId(publication_id)},
             {'$inc': {'view_count': 1}}
         )
+        record_event(db, publication_id, 'views')
     
     @staticmethod
     def increment_download_count(db, publication_id):
-        """Increment download count"""
+        """Increment download count (lifetime total and the current hourly analytics bucket)"""
         db.publications.update_one(
             {'_id': ObjectId(publication_id)},
             {'$inc': {'download_count': 1}}
         )
+        record_event(db, publication_id, 'downloads')
     
     @staticmethod
     def get_authors_display(publication):
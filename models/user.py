@@ -1,6 +1,8 @@
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from bson.objectid import ObjectId
+from utils.signals import user_changed
+from models.favorite import Favorite
 
 class User:
     """User model for authentication and authorization"""
@@ -15,10 +17,11 @@ class User:
             'password_hash': password_hash,
             'role': role,
             'created_at': datetime.utcnow(),
-            'last_login': None,
-            'favorites': []
+            'updated_at': datetime.utcnow(),
+            'last_login': None
         }
         result = db.users.insert_one(user)
+        user_changed.send(User, op='create', id=str(result.inserted_id))
         return result.inserted_id
     
     @staticmethod
@@ -26,7 +29,7 @@ class User:
         """Authenticate user by username and password"""
         user = db.users.find_one({'username': username})
         if user and check_password_hash(user['password_hash'], password):
-            # Update last login
+            # Update last login (not updated_at: logins alone don't need backing up)
             db.users.update_one(
                 {'_id': user['_id']},
                 {'$set': {'last_login': datetime.utcnow()}}
@@ -55,32 +58,25 @@ class User:
         password_hash = generate_password_hash(new_password)
         db.users.update_one(
             {'_id': ObjectId(user_id)},
-            {'$set': {'password_hash': password_hash}}
+            {'$set': {'password_hash': password_hash, 'updated_at': datetime.utcnow()}}
         )
+        user_changed.send(User, op='update', id=str(user_id))
     
     @staticmethod
     def add_favorite(db, user_id, publication_id):
         """Add publication to user's favorites"""
-        db.users.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$addToSet': {'favorites': ObjectId(publication_id)}}
-        )
+        Favorite.add(db, user_id, publication_id)
     
     @staticmethod
     def remove_favorite(db, user_id, publication_id):
         """Remove publication from user's favorites"""
-        db.users.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$pull': {'favorites': ObjectId(publication_id)}}
-        )
+        Favorite.remove(db, user_id, publication_id)
     
     @staticmethod
-    def get_favorites(db, user_id):
-        """Get user's favorite publications"""
-        user = db.users.find_one({'_id': ObjectId(user_id)})
-        if user and 'favorites' in user:
-            return list(db.publications.find({'_id': {'$in': user['favorites']}}))
-        return []
+    def get_favorites(db, user_id, page=1, per_page=20):
+        """Get one page of user's favorite publications (see Favorite.list_for_user)"""
+        publications, _ = Favorite.list_for_user(db, user_id, page=page, per_page=per_page)
+        return publications
     
     @staticmethod
     def has_role(user, role):
@@ -1,7 +1,7 @@
-from flask import render_template, request, redirect, url_for, flash, session
+from flask import current_app, render_template, request, redirect, url_for, flash, session
 from werkzeug.utils import secure_filename
 from bson.objectid import ObjectId
-import os
+import io
 from . import admin_bp
 from models.publication import Publication
 from models.author import Author
@@ -10,6 +10,29 @@ from utils.auth import admin_required, editor_required, user_required, get_curre
 from utils.db import get_db
 from config import Config
 from utils.pdf_helper import generate_pdf_thumbnail
+from utils.metrics import UPLOAD_PROCESSING
+from utils.stats import get_snapshot, snapshot_settings
+from utils.storage import save_upload, delete_upload, temporary_copy
+
+def store_pdf(pdf, pdf_filename, generate_cover=False):
+    """Store an uploaded PDF; with generate_cover, also store its first page as the cover
+    
+    Returns the generated cover filename, or None if none was generated.
+    """
+    with temporary_copy(pdf, '.pdf') as pdf_path:
+        with UPLOAD_PROCESSING.time('pdf_save'):
+            with open(pdf_path, 'rb') as f:
+                save_upload('pdfs', pdf_filename, f, 'application/pdf')
+        if not generate_cover:
+            return None
+        
+        cover_filename = pdf_filename.rsplit('.', 1)[0] + "_cover.jpg"
+        thumbnail = io.BytesIO()
+        if not generate_pdf_thumbnail(pdf_path, thumbnail):
+            return None
+        thumbnail.seek(0)
+        save_upload('covers', cover_filename, thumbnail, 'image/jpeg')
+        return cover_filename
 
 @admin_bp.route('/')
 @admin_required
@@ -22,11 +45,13 @@ def admin_redirect():
 def dashboard():
     """Admin dashboard overview"""
     db = get_db()
+    snapshot = get_snapshot(db, None, *snapshot_settings(current_app.config))
     
     stats = {
-        'total_publications': db.publications.count_documents({}),
-        'total_authors': db.authors.count_documents({}),
-        'total_users': db.users.count_documents({}),
+        'total_publications': snapshot['total_publications'],
+        'total_authors': snapshot['total_authors'],
+        'total_users': snapshot['total_users'],
+        'as_of': snapshot['as_of'],
         'recent_publications': list(db.publications.find().sort('created_at', -1).limit(5)),
         'recent_authors': list(db.authors.find().sort('created_at', -1).limit(5))
     }
@@ -89,21 +114,16 @@ def add_publication():
 
     if pdf and allowed_file(pdf.filename):
         pdf_filename = secure_filename(pdf.filename)
-        os.makedirs(Config.PDF_FOLDER, exist_ok=True)
-        pdf_path = os.path.join(Config.PDF_FOLDER, pdf_filename)
-        pdf.save(pdf_path)
         
         # Handle cover image
         if cover and cover.filename != '' and allowed_file(cover.filename):
+            store_pdf(pdf, pdf_filename)
             cover_filename = secure_filename(cover.filename)
-            os.makedirs(Config.COVER_FOLDER, exist_ok=True)
-            cover.save(os.path.join(Config.COVER_FOLDER, cover_filename))
+            save_upload('covers', cover_filename, cover.stream, cover.mimetype)
         else:
             # Generate cover from PDF
-            cover_filename = pdf_filename.rsplit('.', 1)[0] + "_cover.jpg"
-            os.makedirs(Config.COVER_FOLDER, exist_ok=True)
-            cover_path = os.path.join(Config.COVER_FOLDER, cover_filename)
-            if generate_pdf_thumbnail(pdf_path, cover_path):
+            cover_filename = store_pdf(pdf, pdf_filename, generate_cover=True)
+            if cover_filename:
                 flash('Cover image automatically generated from PDF first page.')
             else:
                 cover_filename = "default_cover.jpg" # Fallback if generation fails
@@ -155,18 +175,11 @@ def edit_publication(publication_id):
             
             if allowed_file(pdf.filename):
                 pdf_filename = secure_filename(pdf.filename)
-                os.makedirs(Config.PDF_FOLDER, exist_ok=True)
-                pdf_path = os.path.join(Config.PDF_FOLDER, pdf_filename)
-                pdf.save(pdf_path)
-                update_data['pdf_filename'] = pdf_filename
-                
                 # If cover is not provided, regenerate it from the new PDF
-                if not (cover and cover.filename):
-                    cover_filename = pdf_filename.rsplit('.', 1)[0] + "_cover.jpg"
-                    os.makedirs(Config.COVER_FOLDER, exist_ok=True)
-                    cover_path = os.path.join(Config.COVER_FOLDER, cover_filename)
-                    if generate_pdf_thumbnail(pdf_path, cover_path):
-                        update_data['cover_filename'] = cover_filename
+                cover_filename = store_pdf(pdf, pdf_filename, generate_cover=not (cover and cover.filename))
+                update_data['pdf_filename'] = pdf_filename
+                if cover_filename:
+                    update_data['cover_filename'] = cover_filename
         
         if cover and cover.filename:
             def allowed_file(filename):
@@ -174,8 +187,7 @@ def edit_publication(publication_id):
             
             if allowed_file(cover.filename):
                 cover_filename = secure_filename(cover.filename)
-                os.makedirs(Config.COVER_FOLDER, exist_ok=True)
-                cover.save(os.path.join(Config.COVER_FOLDER, cover_filename))
+                save_upload('covers', cover_filename, cover.stream, cover.mimetype)
                 update_data['cover_filename'] = cover_filename
         
         Publication.update(db, publication_id, **update_data)
@@ -199,14 +211,10 @@ def delete_publication(publication_id):
     
     # Delete files
     try:
-        if 'pdf_filename' in publication:
-            pdf_path = os.path.join(Config.PDF_FOLDER, publication['pdf_filename'])
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-        if 'cover_filename' in publication:
-            cover_path = os.path.join(Config.COVER_FOLDER, publication['cover_filename'])
-            if os.path.exists(cover_path):
-                os.remove(cover_path)
+        if publication.get('pdf_filename'):
+            delete_upload('pdfs', publication['pdf_filename'])
+        if publication.get('cover_filename') and publication['cover_filename'] != 'default_cover.jpg':
+            delete_upload('covers', publication['cover_filename'])
     except Exception as e:
         flash(f'Error deleting files: {str(e)}')
     
@@ -248,8 +256,7 @@ def add_author():
 
     if author_picture and allowed_file(author_picture.filename):
         author_picture_filename = secure_filename(author_picture.filename)
-        os.makedirs(Config.AUTHOR_FOLDER, exist_ok=True)
-        author_picture.save(os.path.join(Config.AUTHOR_FOLDER, author_picture_filename))
+        save_upload('authors', author_picture_filename, author_picture.stream, author_picture.mimetype)
 
         Author.create(db, author_name, author_picture_filename, author_profile, 
                      author_education, author_experience, author_skills)
@@ -296,8 +303,7 @@ def edit_author(author_id):
             
             if allowed_file(author_picture.filename):
                 author_picture_filename = secure_filename(author_picture.filename)
-                os.makedirs(Config.AUTHOR_FOLDER, exist_ok=True)
-                author_picture.save(os.path.join(Config.AUTHOR_FOLDER, author_picture_filename))
+                save_upload('authors', author_picture_filename, author_picture.stream, author_picture.mimetype)
                 update_data['image'] = author_picture_filename
         
         Author.update(db, author_id, **update_data)
@@ -319,10 +325,8 @@ def delete_author(author_id):
     
     # Delete image file
     try:
-        if 'image' in author:
-            image_path = os.path.join(Config.AUTHOR_FOLDER, author['image'])
-            if os.path.exists(image_path):
-                os.remove(image_path)
+        if author.get('image') and author['image'] != 'default_author.jpg':
+            delete_upload('authors', author['image'])
     except Exception as e:
         flash(f'Error deleting image: {str(e)}')
     
@@ -1,12 +1,24 @@
-from flask import jsonify, request
+from flask import current_app, jsonify, request
 from functools import wraps
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
+from pymongo.errors import ExecutionTimeout, OperationFailure
 from . import api_bp
 from models.publication import Publication
 from models.author import Author
 from models.user import User
-from utils.db import get_db
+from models.favorite import Favorite
+from utils.db import get_db, get_catalog_db, query_budget
+from utils.indexes import CATALOG_COLLATION
+from utils.cache import get_cache
+from utils.query import (build_publication_query, compile_search, text_search_query, SEARCH_TIMEOUT_MESSAGE,
+                         serialize_document, pagination, LISTING_PROJECTION, API_SEARCH_FIELDS, HOMEPAGE_SEARCH_FIELDS,
+                         CATEGORY_COUNTS_PIPELINE)
+from utils.stats import get_snapshot, latest_snapshot, snapshot_settings, snapshot_validators, stats_payload
+from utils.versions import (collection_validators, conditional_response, document_projection, document_validators,
+                            is_conditional, with_validators)
+from utils.analytics import parse_window, trending_publications
+from utils.catalog import snapshot_find
 import jwt
 from datetime import datetime, timedelta
 from config import Config
@@ -38,86 +50,87 @@ def token_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
+def search_timeout():
+    """Response for a search that ran past its time budget"""
+    return jsonify({'status': 'error', 'message': SEARCH_TIMEOUT_MESSAGE}), 503
+
+@api_bp.after_request
+def add_validators(response):
+    """Give GET responses without their own validators an ETag from the body, and answer 304 on a match"""
+    if request.method != 'GET' or response.status_code != 200 or 'ETag' in response.headers:
+        return response
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache' if 'Authorization' in request.headers else 'no-cache'
+    return response.make_conditional(request)
+
 @api_bp.route('/publications', methods=['GET'])
 def get_publications():
     """Get list of publications"""
-    db = get_db()
+    db = get_catalog_db()
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 20))
     search = request.args.get('search')
     author = request.args.get('author')
     category = request.args.get('category')
     
-    query = {}
-    query_parts = []
-    
-    if search:
-        query_parts.append({
-            '$or': [
-                {'title': {'$regex': search, '$options': 'i'}},
-                {'authors': {'$regex': search, '$options': 'i'}},
-                {'author': {'$regex': search, '$options': 'i'}}  # Backward compatibility
-            ]
-        })
-    
-    if author:
-        # Support both old format (author string) and new format (authors array)
-        query_parts.append({
-            '$or': [
-                {'authors': {'$in': [author]}},
-                {'author': author}
-            ]
-        })
-    
-    if category:
-        query_parts.append({'category': category})
+    try:
+        query = build_publication_query(search, author, category, date_from=request.args.get('from'),
+                                        date_to=request.args.get('to'), search_fields=API_SEARCH_FIELDS)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     
-    # Combine all query parts
-    if len(query_parts) > 1:
-        query = {'$and': query_parts}
-    elif len(query_parts) == 1:
-        query = query_parts[0]
+    validators = collection_validators(db, 'publications', 'list', request.query_string.decode())
+    not_modified = conditional_response(*validators)
+    if not_modified:
+        return not_modified
     
+    budget = query_budget('search' if search else 'catalog')
     skip = (page - 1) * per_page
-    publications = list(db.publications.find(query).skip(skip).limit(per_page))
-    total = db.publications.count_documents(query)
-    
-    # Convert ObjectId to string
-    for pub in publications:
-        pub['_id'] = str(pub['_id'])
-        if 'created_at' in pub:
-            pub['created_at'] = pub['created_at'].isoformat() if isinstance(pub['created_at'], datetime) else str(pub['created_at'])
-        if 'updated_at' in pub:
-            pub['updated_at'] = pub['updated_at'].isoformat() if isinstance(pub['updated_at'], datetime) else str(pub['updated_at'])
+    # Matches, order and total from this worker's catalog snapshot when it has one; the
+    # full documents (extracted text, counters) are then read by _id for the page only
+    found = snapshot_find(search=search, author=author, category=category, date_from=request.args.get('from'),
+                          date_to=request.args.get('to'), search_fields=API_SEARCH_FIELDS, skip=skip, limit=per_page)
+    try:
+        if found is not None:
+            cards, total = found
+            docs = {doc['_id']: doc for doc in db.publications.find({'_id': {'$in': [card['_id'] for card in cards]}},
+                                                                     LISTING_PROJECTION)}
+            publications = [docs[card['_id']] for card in cards if card['_id'] in docs]
+        else:
+            publications = list(db.publications.find(query, LISTING_PROJECTION).collation(CATALOG_COLLATION).skip(skip)
+                                .limit(per_page).max_time_ms(budget))
+            total = db.publications.count_documents(query, collation=CATALOG_COLLATION, maxTimeMS=budget)
+    except ExecutionTimeout:
+        if not search:
+            raise
+        return search_timeout()
     
-    return jsonify({
+    return with_validators(jsonify({
         'status': 'success',
-        'data': publications,
-        'pagination': {
-            'page': page,
-            'per_page': per_page,
-            'total': total,
-            'pages': (total + per_page - 1) // per_page
-        }
-    })
+        'data': [serialize_document(pub) for pub in publications],
+        'pagination': pagination(page, per_page, total)
+    }), *validators)
 
 @api_bp.route('/publications/<publication_id>', methods=['GET'])
 def get_publication(publication_id):
     """Get single publication"""
     try:
-        db = get_db()
-        publication = Publication.get_by_id(db, publication_id)
+        db = get_catalog_db()
+        # A revalidating client costs one small projected read; other requests read the document once
+        if is_conditional(request.headers):
+            version = db.publications.find_one({'_id': ObjectId(publication_id)}, document_projection('publications'))
+            if not version:
+                return jsonify({'status': 'error', 'message': 'Publication not found'}), 404
+            not_modified = conditional_response(*document_validators(version, 'publications'))
+            if not_modified:
+                return not_modified
         
+        publication = Publication.get_by_id(db, publication_id)
         if not publication:
             return jsonify({'status': 'error', 'message': 'Publication not found'}), 404
         
-        publication['_id'] = str(publication['_id'])
-        if 'created_at' in publication:
-            publication['created_at'] = publication['created_at'].isoformat() if isinstance(publication['created_at'], datetime) else str(publication['created_at'])
-        if 'updated_at' in publication:
-            publication['updated_at'] = publication['updated_at'].isoformat() if isinstance(publication['updated_at'], datetime) else str(publication['updated_at'])
-        
-        return jsonify({'status': 'success', 'data': publication})
+        return with_validators(jsonify({'status': 'success', 'data': serialize_document(publication)}),
+                               *document_validators(publication, 'publications'))
     except InvalidId:
         return jsonify({'status': 'error', 'message': 'Invalid publication ID'}), 400
 
@@ -149,15 +162,18 @@ def create_publication(current_user):
         return jsonify({'status': 'error', 'message': 'At least one author is required'}), 400
     
     db = get_db()
-    publication_id = Publication.create(
-        db,
-        data['title'],
-        authors,
-        data['category'],
-        data['publish_date'],
-        data.get('pdf_filename', ''),
-        data.get('cover_filename', '')
-    )
+    try:
+        publication_id = Publication.create(
+            db,
+            data['title'],
+            authors,
+            data['category'],
+            data['publish_date'],
+            data.get('pdf_filename', ''),
+            data.get('cover_filename', '')
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     
     return jsonify({
         'status': 'success',
@@ -185,6 +201,8 @@ def update_publication(current_user, publication_id):
         return jsonify({'status': 'success', 'message': 'Publication updated'})
     except InvalidId:
         return jsonify({'status': 'error', 'message': 'Invalid publication ID'}), 400
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @api_bp.route('/publications/<publication_id>', methods=['DELETE'])
 @token_required
@@ -208,56 +226,59 @@ def delete_publication(current_user, publication_id):
 @api_bp.route('/authors', methods=['GET'])
 def get_authors():
     """Get list of authors"""
-    db = get_db()
-    authors = list(db.authors.find())
-    
-    for author in authors:
-        author['_id'] = str(author['_id'])
-        if 'created_at' in author:
-            author['created_at'] = author['created_at'].isoformat() if isinstance(author['created_at'], datetime) else str(author['created_at'])
-        if 'updated_at' in author:
-            author['updated_at'] = author['updated_at'].isoformat() if isinstance(author['updated_at'], datetime) else str(author['updated_at'])
-    
-    return jsonify({'status': 'success', 'data': authors})
+    db = get_catalog_db()
+    validators = collection_validators(db, 'authors')
+    not_modified = conditional_response(*validators)
+    if not_modified:
+        return not_modified
+    authors = [serialize_document(author) for author in db.authors.find().max_time_ms(query_budget('catalog'))]
+    return with_validators(jsonify({'status': 'success', 'data': authors}), *validators)
 
 @api_bp.route('/authors/<author_id>', methods=['GET'])
 def get_author(author_id):
     """Get single author"""
     try:
-        db = get_db()
-        author = Author.get_by_id(db, author_id)
+        db = get_catalog_db()
+        if is_conditional(request.headers):
+            version = db.authors.find_one({'_id': ObjectId(author_id)}, document_projection('authors'))
+            if not version:
+                return jsonify({'status': 'error', 'message': 'Author not found'}), 404
+            not_modified = conditional_response(*document_validators(version, 'authors'))
+            if not_modified:
+                return not_modified
         
+        author = Author.get_by_id(db, author_id)
         if not author:
             return jsonify({'status': 'error', 'message': 'Author not found'}), 404
         
-        author['_id'] = str(author['_id'])
-        if 'created_at' in author:
-            author['created_at'] = author['created_at'].isoformat() if isinstance(author['created_at'], datetime) else str(author['created_at'])
-        if 'updated_at' in author:
-            author['updated_at'] = author['updated_at'].isoformat() if isinstance(author['updated_at'], datetime) else str(author['updated_at'])
-        
-        return jsonify({'status': 'success', 'data': author})
+        return with_validators(jsonify({'status': 'success', 'data': serialize_document(author)}),
+                               *document_validators(author, 'authors'))
     except InvalidId:
         return jsonify({'status': 'error', 'message': 'Invalid author ID'}), 400
 
 @api_bp.route('/categories', methods=['GET'])
 def get_categories():
     """Get list of categories"""
-    db = get_db()
-    categories = list(db.publications.aggregate([
-        {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
-    ]))
+    db = get_catalog_db()
+    validators = collection_validators(db, 'publications', 'categories')
+    not_modified = conditional_response(*validators)
+    if not_modified:
+        return not_modified
+    categories = get_cache().get_or_set('facets:categories',
+                                        lambda: list(db.publications.aggregate(CATEGORY_COUNTS_PIPELINE,
+                                                                               maxTimeMS=query_budget('facets'))),
+                                        tags=['publications'])
     
-    return jsonify({
+    return with_validators(jsonify({
         'status': 'success',
         'data': [{'name': cat['_id'], 'count': cat['count']} for cat in categories]
-    })
+    }), *validators)
 
 @api_bp.route('/search', methods=['GET'])
 def search():
     """Search publications"""
-    db = get_db()
+    db = get_catalog_db()
+    budget = query_budget('search')
     query_text = request.args.get('q', '')
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 20))
@@ -265,58 +286,97 @@ def search():
     if not query_text:
         return jsonify({'status': 'error', 'message': 'Query parameter q is required'}), 400
     
-    # Use MongoDB text search if index exists, otherwise use regex
-    try:
-        query = {"$text": {"$search": query_text}}
-        publications = list(db.publications.find(query).skip((page - 1) * per_page).limit(per_page))
-        total = db.publications.count_documents(query)
-    except:
-        # Fallback to regex search
-        query = {
-            "$or": [
-                {"title": {"$regex": query_text, "$options": "i"}},
-                {"authors": {"$regex": query_text, "$options": "i"}},
-                {"author": {"$regex": query_text, "$options": "i"}},  # Backward compatibility
-                {"category": {"$regex": query_text, "$options": "i"}}
-            ]
-        }
-        publications = list(db.publications.find(query).skip((page - 1) * per_page).limit(per_page))
-        total = db.publications.count_documents(query)
+    validators = collection_validators(db, 'publications', 'search', request.query_string.decode())
+    not_modified = conditional_response(*validators)
+    if not_modified:
+        return not_modified
     
-    for pub in publications:
-        pub['_id'] = str(pub['_id'])
+    def find_page(query, collation=None):
+        cursor = db.publications.find(query, LISTING_PROJECTION).skip((page - 1) * per_page).limit(per_page).max_time_ms(budget)
+        if collation:
+            cursor = cursor.collation(collation)
+        options = {'collation': collation} if collation else {}
+        return list(cursor), db.publications.count_documents(query, maxTimeMS=budget, **options)
     
-    return jsonify({
+    # Use MongoDB text search if index exists, otherwise the compiled substring/prefix search
+    try:
+        try:
+            publications, total = find_page(text_search_query(query_text))
+        except ExecutionTimeout:
+            raise
+        except OperationFailure:
+            publications, total = find_page(compile_search(query_text, HOMEPAGE_SEARCH_FIELDS), CATALOG_COLLATION)
+    except ExecutionTimeout:
+        return search_timeout()
+    
+    return with_validators(jsonify({
         'status': 'success',
-        'data': publications,
-        'pagination': {
-            'page': page,
-            'per_page': per_page,
-            'total': total,
-            'pages': (total + per_page - 1) // per_page
-        }
-    })
+        'data': [serialize_document(pub) for pub in publications],
+        'pagination': pagination(page, per_page, total)
+    }), *validators)
 
 @api_bp.route('/stats', methods=['GET'])
 def get_stats():
-    """Get library statistics"""
+    """Get library statistics (latest snapshot; see utils/stats.py)"""
     db = get_db()
+    snapshot = get_snapshot(db, query_budget('stats'), *snapshot_settings(current_app.config), projection={'as_of': 1})
+    validators = snapshot_validators(snapshot)
+    not_modified = conditional_response(*validators)
+    if not_modified:
+        return not_modified
+    if 'total_publications' not in snapshot:
+        snapshot = latest_snapshot(db)
+        validators = snapshot_validators(snapshot)
+    return with_validators(jsonify({'status': 'success', 'data': stats_payload(snapshot)}), *validators)
+
+@api_bp.route('/trending', methods=['GET'])
+def get_trending():
+    """Most viewed/downloaded publications over ?window= (e.g. 24h, 7d; default 7d), from the analytics rollups"""
+    config = current_app.config
+    window_arg = request.args.get('window', '7d')
+    limit = min(int(request.args.get('limit', 10)), 50)
+    try:
+        window = parse_window(window_arg, max_hours=config['ANALYTICS_HOURLY_RETENTION_DAYS'] * 24,
+                              max_days=config['ANALYTICS_DAILY_RETENTION_DAYS'])
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     
-    stats = {
-        'total_publications': db.publications.count_documents({}),
-        'total_authors': db.authors.count_documents({}),
-        'total_users': db.users.count_documents({}),
-        'publications_by_year': list(db.publications.aggregate([
-            {"$group": {"_id": {"$year": {"$dateFromString": {"dateString": "$publish_date"}}}, "count": {"$sum": 1}}},
-            {"$sort": {"_id": 1}}
-        ])),
-        'publications_by_category': list(db.publications.aggregate([
-            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]))
-    }
+    db = get_catalog_db()
+    publications = get_cache().get_or_set(f"trending:{window_arg}:{limit}",
+                                          lambda: trending_publications(db, window, limit=limit,
+                                                                        budget=query_budget('stats'),
+                                                                        projection=LISTING_PROJECTION),
+                                          timeout=config['TRENDING_CACHE_SECONDS'],
+                                          tags=['publications'])
     
-    return jsonify({'status': 'success', 'data': stats})
+    return jsonify({
+        'status': 'success',
+        'window': window_arg,
+        'data': [serialize_document(pub) for pub in publications]
+    })
+
+@api_bp.route('/favorites', methods=['GET'])
+@token_required
+def get_favorites(current_user):
+    """Get the current user's favorite publications, newest first (paginated)"""
+    db = get_db()
+    page = max(1, int(request.args.get('page', 1)))
+    per_page = min(100, max(1, int(request.args.get('per_page', 20))))
+    publications, total = Favorite.list_for_user(db, current_user['_id'], page=page, per_page=per_page)
+    
+    return jsonify({
+        'status': 'success',
+        'data': [serialize_document(pub) for pub in publications],
+        'pagination': pagination(page, per_page, total)
+    })
+
+@api_bp.route('/favorites/status', methods=['GET'])
+@token_required
+def get_favorite_status(current_user):
+    """Check which of up to 100 publication ids (?ids=a,b,c) the current user has favorited"""
+    ids = [value for value in request.args.get('ids', '').split(',') if value][:100]
+    favorited = Favorite.favorited_ids(get_db(), current_user['_id'], ids)
+    return jsonify({'status': 'success', 'data': {value: value in favorited for value in ids}})
 
 @api_bp.route('/auth/login', methods=['POST'])
 def api_login():
@@ -0,0 +1,280 @@
+import asyncio
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, OperationFailure
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from config import Config
+from utils.db import mongo, get_async_db as _get_async_db, close_async_db, read_preference
+from utils.indexes import CATALOG_COLLATION
+from utils.invalidation import start_listener
+from utils.query import (build_publication_query, compile_search, text_search_query, SEARCH_TIMEOUT_MESSAGE,
+                         serialize_document, pagination, LISTING_PROJECTION, API_SEARCH_FIELDS, HOMEPAGE_SEARCH_FIELDS,
+                         CATEGORY_COUNTS_PIPELINE)
+from utils.stats import (STATE_ID, needs_refresh, refresh_snapshot, start_background_refresh,
+                         snapshot_validators, stats_payload)
+from utils.versions import (document_projection, document_validators, is_conditional, not_modified,
+                            validator_headers, version_validators)
+from werkzeug.http import generate_etag
+
+# Async (Starlette + Motor) versions of the read-only /api/v1 endpoints.
+# They share the query builders and serialization in utils/query.py with the
+# Flask blueprint in routes/api.py and return the same JSON. Independent
+# queries (list + count, the stats counters) run concurrently. Writes and
+# login stay on the Flask blueprint, mounted behind these routes by
+# create_asgi_app().
+
+API_PREFIX = '/api/v1'
+
+def get_async_db():
+    # Every endpoint here is an anonymous catalog read
+    return _get_async_db().with_options(read_preference=read_preference(
+        Config.CATALOG_READ_PREFERENCE, Config.CATALOG_MAX_STALENESS_SECONDS))
+
+def query_budget(query_class):
+    return Config.QUERY_TIME_BUDGETS_MS.get(query_class)
+
+def _error(message, status_code):
+    return JSONResponse({'status': 'error', 'message': message}, status_code=status_code)
+
+def _not_modified(request, validators):
+    if not_modified(request.headers, *validators):
+        return Response(status_code=304, headers=validator_headers(*validators))
+    return None
+
+def _success(request, payload, validators=None):
+    """JSON response with validators (an ETag of the body when none are given); 304 on a match"""
+    response = JSONResponse(payload)
+    if validators is None:
+        validators = (generate_etag(response.body), None)
+    not_modified_response = _not_modified(request, validators)
+    if not_modified_response:
+        return not_modified_response
+    response.headers.update(validator_headers(*validators))
+    return response
+
+async def get_publications(request):
+    """Get list of publications"""
+    db = get_async_db()
+    params = request.query_params
+    page = int(params.get('page', 1))
+    per_page = int(params.get('per_page', 20))
+    try:
+        query = build_publication_query(params.get('search'), params.get('author'), params.get('category'),
+                                        date_from=params.get('from'), date_to=params.get('to'),
+                                        search_fields=API_SEARCH_FIELDS)
+    except ValueError as e:
+        return _error(str(e), 400)
+    validators = version_validators('publications', await db.collection_versions.find_one({'_id': 'publications'}),
+                                    'list', request.url.query)
+    not_modified_response = _not_modified(request, validators)
+    if not_modified_response:
+        return not_modified_response
+    budget = query_budget('search' if params.get('search') else 'catalog')
+
+    skip = (page - 1) * per_page
+    cursor = db.publications.find(query, LISTING_PROJECTION).collation(CATALOG_COLLATION).skip(skip).limit(per_page).max_time_ms(budget)
+    try:
+        publications, total = await asyncio.gather(
+            cursor.to_list(length=per_page),
+            db.publications.count_documents(query, collation=CATALOG_COLLATION, maxTimeMS=budget)
+        )
+    except ExecutionTimeout:
+        if not params.get('search'):
+            raise
+        return _error(SEARCH_TIMEOUT_MESSAGE, 503)
+
+    return _success(request, {
+        'status': 'success',
+        'data': [serialize_document(pub) for pub in publications],
+        'pagination': pagination(page, per_page, total)
+    }, validators)
+
+async def get_publication(request):
+    """Get single publication"""
+    try:
+        publication_id = ObjectId(request.path_params['publication_id'])
+    except InvalidId:
+        return _error('Invalid publication ID', 400)
+
+    db = get_async_db()
+    # A revalidating client costs one small projected read; other requests read the document once
+    if is_conditional(request.headers):
+        version = await db.publications.find_one({'_id': publication_id}, document_projection('publications'))
+        if not version:
+            return _error('Publication not found', 404)
+        not_modified_response = _not_modified(request, document_validators(version, 'publications'))
+        if not_modified_response:
+            return not_modified_response
+
+    publication = await db.publications.find_one({'_id': publication_id})
+    if not publication:
+        return _error('Publication not found', 404)
+    return _success(request, {'status': 'success', 'data': serialize_document(publication)},
+                    document_validators(publication, 'publications'))
+
+async def get_authors(request):
+    """Get list of authors"""
+    db = get_async_db()
+    validators = version_validators('authors', await db.collection_versions.find_one({'_id': 'authors'}))
+    not_modified_response = _not_modified(request, validators)
+    if not_modified_response:
+        return not_modified_response
+    authors = await db.authors.find().max_time_ms(query_budget('catalog')).to_list(length=None)
+    return _success(request, {'status': 'success', 'data': [serialize_document(author) for author in authors]},
+                    validators)
+
+async def get_author(request):
+    """Get single author"""
+    try:
+        author_id = ObjectId(request.path_params['author_id'])
+    except InvalidId:
+        return _error('Invalid author ID', 400)
+
+    db = get_async_db()
+    if is_conditional(request.headers):
+        version = await db.authors.find_one({'_id': author_id}, document_projection('authors'))
+        if not version:
+            return _error('Author not found', 404)
+        not_modified_response = _not_modified(request, document_validators(version, 'authors'))
+        if not_modified_response:
+            return not_modified_response
+
+    author = await db.authors.find_one({'_id': author_id})
+    if not author:
+        return _error('Author not found', 404)
+    return _success(request, {'status': 'success', 'data': serialize_document(author)},
+                    document_validators(author, 'authors'))
+
+async def get_categories(request):
+    """Get list of categories
+
+    Shares the 'facets:categories' entry with the Flask app's cache service
+    (request.app.state.cache), so writes made through Flask invalidate it.
+    """
+    db = get_async_db()
+    validators = version_validators('publications', await db.collection_versions.find_one({'_id': 'publications'}),
+                                    'categories')
+    not_modified_response = _not_modified(request, validators)
+    if not_modified_response:
+        return not_modified_response
+
+    cache = request.app.state.cache
+    categories = cache.get('facets:categories', tags=['publications'])
+    if categories is None:
+        categories = await db.publications.aggregate(
+            CATEGORY_COUNTS_PIPELINE, maxTimeMS=query_budget('facets')).to_list(length=None)
+        cache.set('facets:categories', categories, tags=['publications'])
+
+    return _success(request, {
+        'status': 'success',
+        'data': [{'name': cat['_id'], 'count': cat['count']} for cat in categories]
+    }, validators)
+
+async def _find_page(db, query, skip, limit, collation=None):
+    budget = query_budget('search')
+    cursor = db.publications.find(query, LISTING_PROJECTION).skip(skip).limit(limit).max_time_ms(budget)
+    options = {}
+    if collation:
+        cursor = cursor.collation(collation)
+        options['collation'] = collation
+    return await asyncio.gather(
+        cursor.to_list(length=limit),
+        db.publications.count_documents(query, maxTimeMS=budget, **options)
+    )
+
+async def search(request):
+    """Search publications"""
+    db = get_async_db()
+    query_text = request.query_params.get('q', '')
+    page = int(request.query_params.get('page', 1))
+    per_page = int(request.query_params.get('per_page', 20))
+
+    if not query_text:
+        return _error('Query parameter q is required', 400)
+    validators = version_validators('publications', await db.collection_versions.find_one({'_id': 'publications'}),
+                                    'search', request.url.query)
+    not_modified_response = _not_modified(request, validators)
+    if not_modified_response:
+        return not_modified_response
+
+    skip = (page - 1) * per_page
+    try:
+        try:
+            publications, total = await _find_page(db, text_search_query(query_text), skip, per_page)
+        except ExecutionTimeout:
+            raise
+        except OperationFailure:
+            # No text index: fall back to the compiled substring/prefix search
+            publications, total = await _find_page(db, compile_search(query_text, HOMEPAGE_SEARCH_FIELDS),
+                                                   skip, per_page, CATALOG_COLLATION)
+    except ExecutionTimeout:
+        return _error(SEARCH_TIMEOUT_MESSAGE, 503)
+
+    return _success(request, {
+        'status': 'success',
+        'data': [serialize_document(pub) for pub in publications],
+        'pagination': pagination(page, per_page, total)
+    }, validators)
+
+async def get_stats(request):
+    """Get library statistics (latest snapshot; see utils/stats.py)
+
+    Reads the snapshot with Motor; computing a new one is left to the sync
+    helpers on the Flask app's client, in a background thread.
+    """
+    db = _get_async_db()
+    snapshot, state = await asyncio.gather(
+        db.stats_snapshots.find_one({}, {'as_of': 1}, sort=[('as_of', -1)]),
+        db.stats_state.find_one({'_id': STATE_ID})
+    )
+    sync_db = mongo.db
+    budget = query_budget('stats')
+    if snapshot is None:
+        snapshot = await asyncio.to_thread(refresh_snapshot, sync_db, budget)
+    elif needs_refresh(snapshot, state, Config.STATS_SNAPSHOT_MAX_AGE_SECONDS, Config.STATS_SNAPSHOT_MIN_INTERVAL_SECONDS):
+        start_background_refresh(sync_db, budget)
+
+    not_modified_response = _not_modified(request, snapshot_validators(snapshot))
+    if not_modified_response:
+        return not_modified_response
+    if 'total_publications' not in snapshot:
+        snapshot = await db.stats_snapshots.find_one({}, sort=[('as_of', -1)])
+    return _success(request, {'status': 'success', 'data': stats_payload(snapshot)}, snapshot_validators(snapshot))
+
+routes = [
+    Route(f'{API_PREFIX}/publications', get_publications, methods=['GET']),
+    Route(f'{API_PREFIX}/publications/{{publication_id}}', get_publication, methods=['GET']),
+    Route(f'{API_PREFIX}/authors', get_authors, methods=['GET']),
+    Route(f'{API_PREFIX}/authors/{{author_id}}', get_author, methods=['GET']),
+    Route(f'{API_PREFIX}/categories', get_categories, methods=['GET']),
+    Route(f'{API_PREFIX}/search', search, methods=['GET']),
+    Route(f'{API_PREFIX}/stats', get_stats, methods=['GET']),
+]
+
+@asynccontextmanager
+async def _lifespan(app):
+    # The async routes share the Flask app's cache, so they need its invalidation listener too
+    start_listener(app.state.flask_app)
+    yield
+    close_async_db()
+
+async def _database_unavailable(request, exc):
+    print(f"Database unavailable on {request.url.path}: {exc.__class__.__name__}: {exc}")
+    response = _error('The library is busy right now, please try again shortly.', 503)
+    response.headers['Retry-After'] = '5'
+    return response
+
+def create_asgi_app(flask_app):
+    """Serve the async API routes and fall through to ``flask_app`` for everything else"""
+    application = Starlette(
+        routes=routes + [Mount('/', app=WSGIMiddleware(flask_app))],
+        exception_handlers={ExecutionTimeout: _database_unavailable, ConnectionFailure: _database_unavailable},
+        lifespan=_lifespan
+    )
+    application.state.flask_app = flask_app
+    application.state.cache = flask_app.extensions['wrdc_cache']
+    return application
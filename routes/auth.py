@@ -1,6 +1,7 @@
 from flask import render_template, request, redirect, url_for, flash, session
 from . import auth_bp
 from models.user import User
+from models.favorite import Favorite
 from utils.db import get_db
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
@@ -87,8 +88,6 @@ def profile():
         flash('User not found')
         return redirect(url_for('auth.login'))
     
-    favorites = User.get_favorites(db, user['_id'])
-    
     # For now, redirect to index - will create profile template later
     flash(f'Profile: {user["username"]} ({user["role"]})')
     return redirect(url_for('main.index'))
@@ -105,17 +104,24 @@ def favorites():
     
     if request.method == 'POST':
         publication_id = request.form.get('publication_id')
-        if publication_id:
-            User.add_favorite(db, user['_id'], publication_id)
+        if publication_id and request.form.get('action') == 'remove':
+            Favorite.remove(db, user['_id'], publication_id)
+            flash('Removed from favorites')
+        elif publication_id:
+            Favorite.add(db, user['_id'], publication_id)
             flash('Added to favorites')
+        # Back to the page the heart was clicked on (same site only)
+        referrer = request.referrer
+        if referrer and referrer.startswith(request.host_url):
+            return redirect(referrer)
+        return redirect(url_for('main.index'))
     
     elif request.method == 'DELETE':
         publication_id = request.json.get('publication_id')
         if publication_id:
-            User.remove_favorite(db, user['_id'], publication_id)
+            Favorite.remove(db, user['_id'], publication_id)
             return {'status': 'success', 'message': 'Removed from favorites'}
     
-    favorites = User.get_favorites(db, user['_id'])
     # For now, redirect to index - will create favorites template later
-    flash(f'You have {len(favorites)} favorite publications')
+    flash(f'You have {Favorite.count(db, user["_id"])} favorite publications')
     return redirect(url_for('main.index'))
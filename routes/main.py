@@ -1,170 +1,174 @@
-from flask import render_template, request, redirect, url_for, flash, current_app
+from urllib.parse import urlencode
+from flask import current_app, render_template, request, redirect, url_for, flash, session
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import ExecutionTimeout
 from . import main_bp
 from models.publication import Publication
 from models.author import Author
-from utils.db import get_db
+from models.favorite import Favorite
+from utils.db import get_catalog_db, query_budget
+from utils.indexes import CATALOG_COLLATION
+from utils.cache import get_cache
+from utils.analytics import trending_publications
+from utils.storage import upload_url
+from utils.spelling import get_suggestions
+from utils.catalog import snapshot_facets, snapshot_find
+from utils.query import (build_publication_query, author_filter, clean_search, keep_selected, LISTING_PROJECTION, AUTHOR_COUNTS_PIPELINE,
+                         CATEGORY_COUNTS_PIPELINE, PUBLICATIONS_BY_YEAR_PIPELINE, SEARCH_TIMEOUT_MESSAGE)
+
+# Publication fields shown by the trending strip
+TRENDING_PROJECTION = {'title': 1, 'cover_filename': 1, 'category': 1}
+
+# Facet -> (filters it ignores, counting pipeline); see CatalogSnapshot.facets()
+FACET_PIPELINES = {
+    'authors': (('author',), AUTHOR_COUNTS_PIPELINE),
+    'categories': (('category',), CATEGORY_COUNTS_PIPELINE),
+    'years': (('publish_date', 'date_from', 'date_to'), PUBLICATIONS_BY_YEAR_PIPELINE),
+}
+
+def catalog_facets(db, cache, search, filters):
+    """Author, category and year counts from MongoDB, each within the filters other than its own
+
+    The same counts as CatalogSnapshot.facets(), cached per filter combination
+    until a publication changes.
+    """
+    budget = query_budget('facets')
+    facets = {}
+    for name, (ignored, pipeline) in FACET_PIPELINES.items():
+        others = {key: None if key in ignored else value for key, value in filters.items()}
+        query = build_publication_query(search, **others)
+        stages = ([{'$match': query}] if query else []) + pipeline
+        key = 'facets:' + name + ':' + urlencode(sorted((k, v) for k, v in dict(others, search=search).items() if v))
+        try:
+            counts = cache.get_or_set(key, lambda: list(db.publications.aggregate(stages, collation=CATALOG_COLLATION,
+                                                                                  maxTimeMS=budget)),
+                                      tags=['publications'])
+        except ExecutionTimeout:
+            # A broad search already got its timeout message; leave the facet empty
+            if not search:
+                raise
+            counts = []
+        facets[name] = counts
+    facets['authors'] = keep_selected(facets['authors'], filters.get('author'))
+    facets['categories'] = keep_selected(facets['categories'], filters.get('category'))
+    return facets
 
 @main_bp.route('/')
 def index():
     """Homepage with publication grid, search, filters, pagination"""
-    db = get_db()
-    search = request.args.get('search')
+    db = get_catalog_db()
+    search = clean_search(request.args.get('search'))
     author = request.args.get('author')
     category = request.args.get('category')
     publish_date = request.args.get('publish_date')
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
     sort = request.args.get('sort', 'title')
     page = int(request.args.get('page', 1))
     per_page = 9
     
     # Handle sort field - if sorting by author, use authors array (MongoDB sorts by first element)
     # For backward compatibility, also check author field
+    mongo_sort = sort
     if sort == 'author':
         # MongoDB will sort by first element of array, or fallback to author field
-        sort = [('authors', 1), ('author', 1)]
+        mongo_sort = [('authors', 1), ('author', 1)]
     
-    query = {}
-    query_parts = []
+    # Reject malformed dates up front; both the snapshot and MongoDB paths below use these filters
+    try:
+        build_publication_query(search, author, category, publish_date, date_from, date_to)
+    except ValueError as e:
+        flash(str(e))
+        publish_date = date_from = date_to = None
+    filters = {'author': author, 'category': category, 'publish_date': publish_date,
+               'date_from': date_from, 'date_to': date_to}
+    budget = query_budget('search' if search else 'catalog')
     
-    # Enhanced search: Use regex for now (text search requires proper setup)
-    if search:
-        search_query = {
-            '$or': [
-                {'title': {'$regex': search, '$options': 'i'}},
-                {'authors': {'$regex': search, '$options': 'i'}},  # Search in authors array
-                {'author': {'$regex': search, '$options': 'i'}},  # Backward compatibility
-                {'category': {'$regex': search, '$options': 'i'}}
-            ]
-        }
-        query_parts.append(search_query)
+    def find_page(search):
+        """One page of publications matching ``search`` and the filters, and the total"""
+        # This worker's catalog snapshot answers without a query when it is available
+        found = snapshot_find(search=search, sort=sort, skip=(page - 1) * per_page, limit=per_page, **filters)
+        if found is not None:
+            return found
+        # Catalog collation lets the compound indexes serve both the filters and the sort
+        query = build_publication_query(search, **filters)
+        publications = list(db.publications.find(query, LISTING_PROJECTION).sort(mongo_sort).collation(CATALOG_COLLATION)
+                            .skip((page - 1) * per_page).limit(per_page).max_time_ms(budget))
+        if not publications and page == 1:
+            return publications, 0
+        return publications, db.publications.count_documents(query, collation=CATALOG_COLLATION, maxTimeMS=budget)
     
-    if author:
-        # Support both old format (author string) and new format (authors array)
-        author_query = {
-            '$or': [
-                {'authors': {'$in': [author]}},  # New format: author in array
-                {'author': author}  # Old format: exact match
-            ]
-        }
-        query_parts.append(author_query)
+    corrected_search = None
+    suggestions = []
+    search_timed_out = False
+    try:
+        publications, total_publications = find_page(search)
+        
+        # A search without hits is rerun once with the best spelling correction (unless ?exact=1)
+        if search and not publications:
+            suggestions = get_suggestions(db, search)
+            if suggestions and not request.args.get('exact'):
+                corrected, corrected_total = find_page(suggestions[0])
+                if corrected:
+                    corrected_search = suggestions.pop(0)
+                    publications, total_publications = corrected, corrected_total
+    except ExecutionTimeout:
+        # An overly broad search gets a message instead of the 503 page
+        if not search:
+            raise
+        search_timed_out = True
+        publications, total_publications = [], 0
+    total_pages = (total_publications + per_page - 1) // per_page
     
-    # Add simple filters
-    if category:
-        query_parts.append({'category': category})
+    for pub in publications:
+        # Get authors list (handle both old and new format)
+        pub['authors_list'] = Publication.get_authors_display(pub)
     
-    if publish_date:
-        query_parts.append({'publish_date': publish_date})
+    # Get author images for every author on the page in one query
+    images = Author.get_images_by_names(db, [name for pub in publications for name in pub['authors_list']])
+    for pub in publications:
+        pub['author_images'] = {name: images[name] for name in pub['authors_list'] if name in images}
     
-    # Combine all query parts
-    if len(query_parts) > 1:
-        query = {'$and': query_parts}
-    elif len(query_parts) == 1:
-        query = query_parts[0]
+    # Heart state for the whole grid in one query
+    favorited = set()
+    if 'user_id' in session:
+        favorited = Favorite.favorited_ids(db, session['user_id'], [pub['_id'] for pub in publications])
     
-    publications_cursor = db.publications.find(query).sort(sort).skip((page - 1) * per_page).limit(per_page)
-    publications = []
-    for pub in publications_cursor:
-        # Get authors list (handle both old and new format)
-        authors_list = Publication.get_authors_display(pub)
-        pub['authors_list'] = authors_list
-        
-        # Get author images for all authors
-        author_images = {}
-        for author_name in authors_list:
-            author_info = Author.get_by_name(db, author_name)
-            if author_info and author_info.get('image'):
-                author_images[author_name] = author_info['image']
-        pub['author_images'] = author_images
-        publications.append(pub)
+    # Sidebar counts, each within the other active filters: from the snapshot, or aggregated and cached
+    cache = get_cache()
+    facets = snapshot_facets(search=corrected_search or search, **filters)
+    if facets is None:
+        facets = catalog_facets(db, cache, corrected_search or search, filters)
+    authors, categories, publish_date_counts = facets['authors'], facets['categories'], facets['years']
     
-    total_publications = db.publications.count_documents(query)
-    total_pages = (total_publications + per_page - 1) // per_page
-
-    # Use cache for aggregation queries (cache is optional, works without it too)
-    try:
-        cache = current_app.cache
-        authors = cache.get('authors_list')
-        if authors is None:
-            # Unwind authors array to get individual authors, handle both old and new format
-            authors = list(db.publications.aggregate([
-                {"$project": {
-                    "author": 1,
-                    "authors": 1,
-                    "all_authors": {
-                        "$cond": {
-                            "if": {"$isArray": "$authors"},
-                            "then": "$authors",
-                            "else": {"$cond": {
-                                "if": {"$ne": ["$author", None]},
-                                "then": ["$author"],
-                                "else": []
-                            }}
-                        }
-                    }
-                }},
-                {"$unwind": "$all_authors"},
-                {"$group": {"_id": "$all_authors", "count": {"$sum": 1}}},
-                {"$sort": {"_id": 1}}
-            ]))
-            cache.set('authors_list', authors, timeout=300)
-        
-        categories = cache.get('categories_list')
-        if categories is None:
-            categories = list(db.publications.aggregate([
-                {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-                {"$sort": {"_id": 1}}
-            ]))
-            cache.set('categories_list', categories, timeout=300)
-        
-        publish_date_counts = cache.get('publish_date_counts')
-        if publish_date_counts is None:
-            publish_date_counts = list(db.publications.aggregate([
-                {"$group": {"_id": {"$year": {"$dateFromString": {"dateString": "$publish_date"}}}, "count": {"$sum": 1}}},
-                {"$sort": {"_id": 1}}
-            ]))
-            cache.set('publish_date_counts', publish_date_counts, timeout=300)
-    except:
-        # Fallback if cache is not available
-        authors = list(db.publications.aggregate([
-            {"$project": {
-                "author": 1,
-                "authors": 1,
-                "all_authors": {
-                    "$cond": {
-                        "if": {"$isArray": "$authors"},
-                        "then": "$authors",
-                        "else": {"$cond": {
-                            "if": {"$ne": ["$author", None]},
-                            "then": ["$author"],
-                            "else": []
-                        }}
-                    }
-                }
-            }},
-            {"$unwind": "$all_authors"},
-            {"$group": {"_id": "$all_authors", "count": {"$sum": 1}}},
-            {"$sort": {"_id": 1}}
-        ]))
-        categories = list(db.publications.aggregate([
-            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-            {"$sort": {"_id": 1}}
-        ]))
-        publish_date_counts = list(db.publications.aggregate([
-            {"$group": {"_id": {"$year": {"$dateFromString": {"dateString": "$publish_date"}}}, "count": {"$sum": 1}}},
-            {"$sort": {"_id": 1}}
-        ]))
+    latest = snapshot_find(sort='publish_date', descending=True, limit=5)
+    if latest is not None:
+        latest_publications = latest[0]
+    else:
+        latest_publications = list(db.publications.find().sort("publish_date", -1).limit(5).max_time_ms(query_budget('catalog')))
     
-    publish_dates = list(db.publications.distinct("publish_date"))
-    latest_publications = list(db.publications.find().sort("publish_date", -1).limit(5))
+    # Most read this week, from the analytics rollups; refreshed every TRENDING_CACHE_SECONDS
+    trending = cache.get_or_set('trending:7d:home',
+                                lambda: trending_publications(db, {'days': 7}, limit=5, budget=query_budget('stats'),
+                                                              projection=TRENDING_PROJECTION),
+                                timeout=current_app.config['TRENDING_CACHE_SECONDS'],
+                                tags=['publications'])
     
     years = [str(pd['_id']) for pd in publish_date_counts]
     counts = [pd['count'] for pd in publish_date_counts]
 
     return render_template('index.html', 
                          publications=publications, 
+                         favorited=favorited, 
                          authors=authors, 
                          categories=categories, 
-                         publish_dates=publish_dates, 
                          latest_publications=latest_publications, 
+                         trending=trending, 
+                         corrected_search=corrected_search, 
+                         suggestions=suggestions, 
+                         search_timed_out=search_timed_out, 
+                         search_timeout_message=SEARCH_TIMEOUT_MESSAGE, 
                          years=years, 
                          counts=counts, 
                          page=page, 
@@ -173,37 +177,28 @@ def index():
 @main_bp.route('/authors')
 def authors():
     """List all authors"""
-    db = get_db()
-    authors = db.authors.find()
+    db = get_catalog_db()
+    authors = db.authors.find().max_time_ms(query_budget('catalog'))
     return render_template('author.html', authors=authors)
 
 @main_bp.route('/author/<author_id>')
 def author_info(author_id):
     """Individual author profile with publications and stats"""
-    db = get_db()
+    db = get_catalog_db()
+    budget = query_budget('catalog')
     author = Author.get_by_id(db, author_id)
     if not author:
         flash('Author not found')
         return redirect(url_for('main.authors'))
     
     # Find publications where author is in authors array or matches old author field
-    latest_publications = list(db.publications.find({
-        "$or": [
-            {"authors": {"$in": [author['name']]}},
-            {"author": author['name']}
-        ]
-    }).sort("publish_date", -1).limit(5))
+    latest_publications = list(db.publications.find(author_filter(author['name']))
+                               .sort("publish_date", -1).collation(CATALOG_COLLATION).limit(5)
+                               .max_time_ms(budget))
     
-    publish_date_counts = list(db.publications.aggregate([
-        {"$match": {
-            "$or": [
-                {"authors": {"$in": [author['name']]}},
-                {"author": author['name']}
-            ]
-        }},
-        {"$group": {"_id": {"$year": {"$dateFromString": {"dateString": "$publish_date"}}}, "count": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
-    ]))
+    publish_date_counts = list(db.publications.aggregate(
+        [{"$match": author_filter(author['name'])}] + PUBLICATIONS_BY_YEAR_PIPELINE,
+        collation=CATALOG_COLLATION, maxTimeMS=budget))
     
     years = [str(pd['_id']) for pd in publish_date_counts]
     counts = [pd['count'] for pd in publish_date_counts]
@@ -219,7 +214,7 @@ def view_pdf(publication_id):
     """PDF viewer with publication metadata"""
     from flask import url_for
     from bson.objectid import ObjectId
-    db = get_db()
+    db = get_catalog_db()
     try:
         publication = Publication.get_by_id(db, publication_id)
     except:
@@ -240,16 +235,26 @@ def view_pdf(publication_id):
     publication['authors_list'] = authors_list
     
     # Get author images for all authors
-    author_images = {}
-    for author_name in authors_list:
-        author_info = Author.get_by_name(db, author_name)
-        if author_info and author_info.get('image'):
-            author_images[author_name] = author_info['image']
-    publication['author_images'] = author_images
+    publication['author_images'] = Author.get_images_by_names(db, authors_list)
 
-    pdf_url = url_for('static', filename='uploads/pdfs/' + publication['pdf_filename'])
+    pdf_url = upload_url('pdfs', publication['pdf_filename'])
     return render_template('view_pdf.html', publication=publication, pdf_url=pdf_url)
 
+@main_bp.route('/download/<publication_id>')
+def download_pdf(publication_id):
+    """Count a download, then send the client to the PDF in the storage backend"""
+    db = get_catalog_db()
+    try:
+        publication = db.publications.find_one({'_id': ObjectId(publication_id)}, {'pdf_filename': 1})
+    except InvalidId:
+        publication = None
+    if not publication or not publication.get('pdf_filename'):
+        flash('PDF file not found for this publication')
+        return redirect(url_for('main.index'))
+
+    Publication.increment_download_count(db, publication_id)
+    return redirect(upload_url('pdfs', publication['pdf_filename']))
+
 @main_bp.route('/guideline')
 def guideline():
     """Author submission guidelines"""
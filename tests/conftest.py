@@ -0,0 +1,47 @@
+import os
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from config import Config
+
+# A throwaway database; it is dropped before and after the test session
+TEST_MONGO_URI = os.environ.get('TEST_MONGO_URI') or 'mongodb://localhost:27017/wrdc_test'
+
+class QueryBudgetConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    MONGO_URI = TEST_MONGO_URI
+    # Exercise the MongoDB paths, not the in-process snapshot or background threads
+    CATALOG_SNAPSHOT_ENABLED = False
+    INVALIDATION_LISTENER_ENABLED = False
+    METRICS_ENABLED = False
+    CACHE_TYPE = 'lru'
+
+@pytest.fixture(scope='session')
+def db():
+    """The seeded test database; tests are skipped when no mongod is reachable"""
+    from bench.seed import seed
+    from utils.indexes import ensure_indexes
+    client = MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        client.close()
+        pytest.skip(f"no mongod at {TEST_MONGO_URI}")
+    db = client.get_default_database()
+    client.drop_database(db.name)
+    seed(db, publications=300, authors=40, users=5, log=lambda message: None)
+    ensure_indexes(db, log=lambda message: None)
+    yield db
+    client.drop_database(db.name)
+    client.close()
+
+@pytest.fixture
+def app(db):
+    """A fresh app per test, so every request starts with a cold cache"""
+    from app import create_app
+    return create_app(QueryBudgetConfig)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
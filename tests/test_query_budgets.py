@@ -0,0 +1,31 @@
+"""MongoDB command budgets per route
+
+Counts come from the query profiler's command listener on a cold cache. A
+route that goes over its budget (an N+1 loop, a lost projection turned into
+per-row lookups) fails here with the repeated query shapes listed. Lower a
+budget when a route gets cheaper; raise one only with a reason in the commit.
+"""
+from utils.profiler import assert_max_queries
+
+def test_homepage(client):
+    assert_max_queries(client, '/', 10)
+
+def test_homepage_filtered_and_sorted(client, db):
+    category = db.publications.find_one()['category']
+    assert_max_queries(client, '/', 10, query_string={'category': category, 'sort': 'publish_date', 'page': 2})
+
+def test_author_info(client, db):
+    author = db.authors.find_one()
+    assert_max_queries(client, f"/author/{author['_id']}", 4)
+
+def test_view_pdf(client, db):
+    publication = db.publications.find_one()
+    assert_max_queries(client, f"/view_pdf/{publication['_id']}", 5)
+
+def test_api_publications(client):
+    response = assert_max_queries(client, '/api/v1/publications', 4)
+    assert response.status_code == 200
+
+def test_api_publications_filtered(client, db):
+    category = db.publications.find_one()['category']
+    assert_max_queries(client, '/api/v1/publications', 4, query_string={'category': category, 'page': 2})
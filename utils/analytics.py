@@ -0,0 +1,141 @@
+import re
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+# View and download analytics, stored pre-aggregated. Every event is one
+# upsert that increments the publication's bucket for the current hour in
+# `analytics_hourly`; no raw events are kept. `flask wrdc analytics` (cron,
+# e.g. hourly) downsamples finished days into `analytics_daily` and applies
+# retention. Trending queries read whole days from the daily buckets and the
+# not-yet-rolled-up remainder from the hourly ones.
+#
+# Plain bucketed collections rather than MongoDB time-series collections:
+# time-series collections don't support the $inc upserts that keep one
+# document per publication and hour.
+
+# Event kinds and their weight in the trending score
+EVENT_WEIGHTS = {'views': 1, 'downloads': 3}
+
+# `analytics_state` document recording the last downsampled day
+ROLLUP_STATE_ID = 'rollup'
+
+# Trending windows accepted by the API: number + 'h' (hours) or 'd' (days)
+_WINDOW_RE = re.compile(r'^(\d{1,3})([hd])$')
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def day_bucket(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def record_event(db, publication_id, kind, now=None):
+    """Count one view or download in the publication's current hourly bucket"""
+    if kind not in EVENT_WEIGHTS:
+        raise ValueError(f"Unknown analytics event: {kind}")
+    db.analytics_hourly.update_one(
+        {'hour': hour_bucket(now or datetime.utcnow()), 'publication_id': ObjectId(publication_id)},
+        {'$inc': {kind: 1}},
+        upsert=True
+    )
+
+def parse_window(window, max_hours, max_days):
+    """Turn '24h' / '7d' into ``{'hours': 24}`` / ``{'days': 7}`` (trending() keywords), or raise ValueError"""
+    match = _WINDOW_RE.match(window or '')
+    if not match:
+        raise ValueError("window must look like '24h' or '7d'")
+    amount, unit = int(match.group(1)), match.group(2)
+    if amount < 1 or (unit == 'h' and amount > max_hours) or (unit == 'd' and amount > max_days):
+        raise ValueError(f"window must be between 1h and {max_hours}h, or 1d and {max_days}d")
+    return {'hours': amount} if unit == 'h' else {'days': amount}
+
+def _rolled_up_through(db):
+    """Start of the first day that has not been downsampled yet (None before the first rollup)"""
+    state = db.analytics_state.find_one({'_id': ROLLUP_STATE_ID})
+    return state['through'] if state else None
+
+def _score_stages(limit):
+    score = {'$add': [{'$multiply': [{'$ifNull': [f'${kind}', 0]}, weight]}
+                      for kind, weight in EVENT_WEIGHTS.items()]}
+    group = {'_id': '$publication_id', 'score': {'$sum': score}}
+    group.update({kind: {'$sum': {'$ifNull': [f'${kind}', 0]}} for kind in EVENT_WEIGHTS})
+    return [{'$group': group}, {'$sort': {'score': -1, '_id': 1}}, {'$limit': limit}]
+
+def trending(db, days=None, hours=None, limit=10, budget=None, now=None):
+    """Top publications by weighted views and downloads over the last ``days`` or ``hours``
+
+    Returns ``[{'_id': publication_id, 'score': ..., 'views': ..., 'downloads': ...}]``.
+    Day windows count whole days (today included) and read downsampled days
+    from the daily buckets; hour windows read hourly buckets only.
+    """
+    now = now or datetime.utcnow()
+    options = {'maxTimeMS': budget} if budget else {}
+    fields = {'publication_id': 1, **{kind: 1 for kind in EVENT_WEIGHTS}}
+
+    if hours:
+        start = hourly_start = hour_bucket(now) - timedelta(hours=hours - 1)
+    else:
+        start = day_bucket(now) - timedelta(days=(days or 7) - 1)
+        through = _rolled_up_through(db)
+        hourly_start = max(start, through) if through else start
+
+    pipeline = [{'$match': {'hour': {'$gte': hourly_start}}}, {'$project': fields}]
+    if hourly_start > start:
+        pipeline.append({'$unionWith': {'coll': 'analytics_daily', 'pipeline': [
+            {'$match': {'day': {'$gte': start, '$lt': hourly_start}}},
+            {'$project': fields},
+        ]}})
+    return list(db.analytics_hourly.aggregate(pipeline + _score_stages(limit), **options))
+
+def trending_publications(db, window, limit=10, budget=None, projection=None):
+    """``trending(**window)`` joined with the publications (deleted ones are skipped)"""
+    ranked = trending(db, limit=limit, budget=budget, **window)
+    if not ranked:
+        return []
+    ids = [entry['_id'] for entry in ranked]
+    found = {pub['_id']: pub for pub in db.publications.find({'_id': {'$in': ids}}, projection)}
+    publications = []
+    for entry in ranked:
+        pub = found.get(entry['_id'])
+        if pub is not None:
+            pub['trending'] = {key: entry[key] for key in ('score', *EVENT_WEIGHTS)}
+            publications.append(pub)
+    return publications
+
+def rollup(db, hourly_retention_days=7, daily_retention_days=400, now=None, log=print):
+    """Downsample finished days into daily buckets and drop expired buckets
+
+    Daily buckets are written with $set from the day's hourly buckets, so a
+    rerun (or a crash halfway) recomputes the same totals.
+    """
+    now = now or datetime.utcnow()
+    today = day_bucket(now)
+    through = _rolled_up_through(db)
+    if through is None:
+        first = db.analytics_hourly.find_one({}, {'hour': 1}, sort=[('hour', 1)])
+        through = day_bucket(first['hour']) if first else today
+
+    days = 0
+    while through < today:
+        end = through + timedelta(days=1)
+        totals = db.analytics_hourly.aggregate([
+            {'$match': {'hour': {'$gte': through, '$lt': end}}},
+            {'$group': {'_id': '$publication_id',
+                        **{kind: {'$sum': {'$ifNull': [f'${kind}', 0]}} for kind in EVENT_WEIGHTS}}},
+        ])
+        operations = [UpdateOne({'day': through, 'publication_id': entry['_id']},
+                                {'$set': {kind: entry[kind] for kind in EVENT_WEIGHTS}}, upsert=True)
+                      for entry in totals]
+        for offset in range(0, len(operations), 500):
+            db.analytics_daily.bulk_write(operations[offset:offset + 500], ordered=False)
+        through = end
+        db.analytics_state.update_one({'_id': ROLLUP_STATE_ID}, {'$set': {'through': through}}, upsert=True)
+        days += 1
+
+    # Hourly buckets are only dropped once their day is downsampled
+    hourly_cutoff = min(through, today - timedelta(days=hourly_retention_days))
+    hourly_deleted = db.analytics_hourly.delete_many({'hour': {'$lt': hourly_cutoff}}).deleted_count
+    daily_deleted = db.analytics_daily.delete_many(
+        {'day': {'$lt': today - timedelta(days=daily_retention_days)}}).deleted_count
+    log(f"Analytics: {days} day(s) downsampled, {hourly_deleted} hourly and {daily_deleted} daily bucket(s) expired")
+    return days
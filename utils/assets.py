@@ -0,0 +1,232 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only .gz variants are built
+    brotli = None
+
+# Self-hosted third-party assets. `flask wrdc assets` downloads the libraries
+# below into static/vendor/ (together with the fonts their stylesheets
+# reference), then writes content-hashed copies to static/dist/ with .gz and
+# .br siblings and a manifest.json mapping each logical name to its hashed
+# file. Templates call asset_url('<logical name>'), which returns the hashed
+# URL once a build exists and the original CDN URL until then.
+#
+# Hashed files never change, so /assets/ serves them with one-year immutable
+# caching, picking the precompressed variant the client accepts.
+
+# Logical name (path under static/vendor/) -> upstream URL
+VENDOR_ASSETS = {
+    'bootstrap/bootstrap.min.css': 'https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css',
+    'bootstrap/bootstrap.min.js': 'https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/js/bootstrap.min.js',
+    'jquery/jquery.min.js': 'https://code.jquery.com/jquery-3.5.1.min.js',
+    'popper/popper.min.js': 'https://cdn.jsdelivr.net/npm/popper.js@1.16.1/dist/umd/popper.min.js',
+    'fontawesome/css/all.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.3/css/all.min.css',
+    'inter/inter.css': 'https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap',
+    'chartjs/chart.umd.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js',
+    'pdfjs/pdf.min.js': 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.min.js',
+    'pdfjs/pdf.worker.min.js': 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.worker.min.js',
+}
+
+# Google Fonts picks the font format from the User-Agent; ask for woff2
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+# Files worth precompressing (fonts other than svg/ttf/eot are already compressed)
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.map', '.txt', '.ttf', '.eot'}
+
+ONE_YEAR = 31536000
+
+# Not in every platform's mime.types
+mimetypes.add_type('font/woff2', '.woff2')
+mimetypes.add_type('font/woff', '.woff')
+
+_CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_SOURCE_MAP_RE = re.compile(r'\n?/[/*]# sourceMappingURL=[^\n]*?(\*/)?\s*$')
+
+def _fetch(url, timeout=30):
+    req = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return response.read()
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def _split_reference(reference):
+    """Split a CSS url() reference into (path, '?query#fragment' suffix)"""
+    match = re.search(r'[?#]', reference)
+    if match:
+        return reference[:match.start()], reference[match.start():]
+    return reference, ''
+
+def _css_references(css):
+    """Local (non-data, non-fragment) url() references in a stylesheet"""
+    for match in _CSS_URL_RE.finditer(css):
+        reference = match.group(2).strip()
+        if not reference.startswith(('data:', '#')):
+            yield match, reference
+
+def vendor_assets(vendor_dir, assets=VENDOR_ASSETS, log=print):
+    """Download ``assets`` and the files their stylesheets reference into ``vendor_dir``
+
+    Absolute references (e.g. fonts.gstatic.com) are rewritten to paths
+    next to the stylesheet; source map comments are dropped.
+    """
+    for name, url in assets.items():
+        data = _fetch(url)
+        if name.endswith(('.css', '.js')):
+            data = _SOURCE_MAP_RE.sub('', data.decode('utf-8')).encode('utf-8')
+
+        if name.endswith('.css'):
+            css = data.decode('utf-8')
+            base = posixpath.dirname(name)
+            replacements = {}
+            for match, reference in _css_references(css):
+                path, suffix = _split_reference(reference)
+                if urlsplit(path).scheme or path.startswith('//'):
+                    local = posixpath.basename(urlsplit(path).path)
+                else:
+                    local = posixpath.normpath(path)
+                target = posixpath.normpath(posixpath.join(base, local))
+                if not os.path.exists(os.path.join(vendor_dir, target)):
+                    _write(os.path.join(vendor_dir, target), _fetch(urljoin(url, path)))
+                replacements[match.group(0)] = f"url({local}{suffix})"
+            for old, new in replacements.items():
+                css = css.replace(old, new)
+            data = css.encode('utf-8')
+
+        _write(os.path.join(vendor_dir, name), data)
+        log(f"Vendored {name} ({len(data) // 1024} KiB)")
+
+def _hashed_name(name, data, length=10):
+    digest = hashlib.sha256(data).hexdigest()[:length]
+    stem, ext = posixpath.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+def _compress(path, data):
+    """Write .gz (and .br when brotli is installed) siblings of ``path``"""
+    with open(path + '.gz', 'wb') as raw:
+        # mtime=0 keeps the output reproducible
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=9, mtime=0) as f:
+            f.write(data)
+    if brotli is not None:
+        _write(path + '.br', brotli.compress(data, quality=11))
+
+def _rewrite_css(name, css, manifest):
+    """Point a stylesheet's local url() references at their hashed files"""
+    base = posixpath.dirname(name)
+
+    def replace(match):
+        reference = match.group(2).strip()
+        if reference.startswith(('data:', '#')) or urlsplit(reference).scheme or reference.startswith('//'):
+            return match.group(0)
+        path, suffix = _split_reference(reference)
+        target = posixpath.normpath(posixpath.join(base, path))
+        if target not in manifest:
+            return match.group(0)
+        return f"url({posixpath.relpath(manifest[target], base or '.')}{suffix})"
+
+    return _CSS_URL_RE.sub(replace, css)
+
+def build_assets(vendor_dir, dist_dir, clean=False, log=print):
+    """Fingerprint everything under ``vendor_dir`` into ``dist_dir``
+
+    Stylesheets are hashed after their url() references are rewritten, so a
+    font change also changes the hash of the stylesheet that uses it.
+    Files from earlier builds are kept (workers still running the old
+    manifest keep serving them) unless ``clean`` is set.
+    Returns the manifest (logical name -> hashed name).
+    """
+    names = []
+    for root, _, files in os.walk(vendor_dir):
+        for filename in files:
+            names.append(os.path.relpath(os.path.join(root, filename), vendor_dir).replace(os.sep, '/'))
+    # Stylesheets last: their references must already be in the manifest
+    names.sort(key=lambda name: (name.endswith('.css'), name))
+
+    if clean and os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    manifest = {}
+    for name in names:
+        with open(os.path.join(vendor_dir, name), 'rb') as f:
+            data = f.read()
+        if name.endswith('.css'):
+            data = _rewrite_css(name, data.decode('utf-8'), manifest).encode('utf-8')
+        hashed = _hashed_name(name, data)
+        path = os.path.join(dist_dir, hashed)
+        _write(path, data)
+        if posixpath.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+            _compress(path, data)
+        manifest[name] = hashed
+
+    _write(os.path.join(dist_dir, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    log(f"Built {len(manifest)} asset(s) into {dist_dir}" + ('' if brotli else ' (brotli not installed: .gz only)'))
+    return manifest
+
+def load_manifest(dist_dir):
+    """Read manifest.json from ``dist_dir``; empty if no build exists yet"""
+    try:
+        with open(os.path.join(dist_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _accepted_encodings():
+    """Content codings the client accepts (q > 0)"""
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        try:
+            quality = float(params.strip()[2:]) if params.strip().startswith('q=') else 1.0
+        except ValueError:
+            quality = 1.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def init_assets(app):
+    """Register the asset_url() template helper and the /assets/ route"""
+    dist_dir = os.path.join(app.root_path, app.config['ASSETS_DIST_FOLDER'])
+    manifest = load_manifest(dist_dir)
+    url_path = app.config['ASSETS_URL_PATH'].rstrip('/')
+    if not manifest:
+        print(f"No asset build in {dist_dir}; serving third-party assets from their CDNs (run `flask wrdc assets`)")
+
+    @app.template_global()
+    def asset_url(name):
+        """Fingerprinted URL of a vendored asset, or its CDN URL before the first build"""
+        if name in manifest:
+            return url_for('assets', filename=manifest[name])
+        return VENDOR_ASSETS[name]
+
+    def serve_asset(filename):
+        """Serve a hashed asset, precompressed when the client accepts it"""
+        if filename == 'manifest.json' or filename.endswith(('.gz', '.br')):
+            abort(404)
+        accepted = _accepted_encodings()
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in accepted and os.path.exists(os.path.join(dist_dir, filename + suffix)):
+                break
+        else:
+            encoding, suffix = None, ''
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(dist_dir, filename + suffix, mimetype=mimetype, max_age=ONE_YEAR)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.add_url_rule(f"{url_path}/<path:filename>", 'assets', serve_asset)
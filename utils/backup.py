@@ -0,0 +1,341 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson import json_util
+from utils.indexes import ensure_indexes
+from utils.signals import SIGNALS_BY_COLLECTION
+from utils.storage import CHUNK_SIZE, UPLOAD_KINDS
+
+# Incremental backups of the catalog (publications, authors, users and their
+# favorites) together with the uploaded files. `flask wrdc backup` writes one
+# snapshot directory per run under BACKUP_FOLDER:
+#
+#   <id>/manifest.json           what the snapshot holds, with checksums
+#   <id>/<collection>.jsonl.gz   documents written since the previous snapshot
+#                                (every document in a full snapshot), extended JSON
+#   <id>/<collection>.ids.gz     every _id present when the snapshot was taken,
+#                                so a restore leaves out deleted documents
+#   <id>/files.tar.gz            upload contents not stored by an earlier
+#                                snapshot of the chain, one member per sha256
+#
+# The first snapshot (or one taken with --full) starts a chain; later ones
+# only hold what changed. The manifest lists every stored file with its hash
+# and the snapshot whose archive holds it, so an unchanged PDF is copied once
+# per chain. A snapshot is written to <id>.partial, verified, and only then
+# renamed, so an interrupted run never leaves a half-written snapshot behind.
+
+# Collection -> field that moves forward on every write
+BACKUP_COLLECTIONS = {
+    'publications': 'updated_at',
+    'authors': 'updated_at',
+    'users': 'updated_at',
+    # Favorites are only ever inserted or deleted
+    'favorites': 'created_at',
+}
+
+MANIFEST = 'manifest.json'
+FILES_ARCHIVE = 'files.tar.gz'
+
+# Incremental dumps start this long before the previous snapshot, covering
+# writes in flight at the time and clock differences between hosts
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+RESTORE_BATCH_SIZE = 1000
+
+def list_snapshots(backup_dir):
+    """Ids of the complete snapshots in ``backup_dir``, oldest first"""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(name for name in os.listdir(backup_dir)
+                  if os.path.exists(os.path.join(backup_dir, name, MANIFEST)))
+
+def load_manifest(backup_dir, snapshot_id):
+    with open(os.path.join(backup_dir, snapshot_id, MANIFEST)) as f:
+        return json.load(f)
+
+def snapshot_chain(backup_dir, snapshot_id):
+    """Manifests from the full snapshot that ``snapshot_id`` builds on up to ``snapshot_id`` itself"""
+    chain = [load_manifest(backup_dir, snapshot_id)]
+    while chain[0]['base']:
+        chain.insert(0, load_manifest(backup_dir, chain[0]['base']))
+    return chain
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _dump_lines(path, lines):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        count = 0
+        for line in lines:
+            f.write(line + '\n')
+            count += 1
+    return count
+
+def _read_lines(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json_util.loads(line)
+
+def _dump_collection(db, name, field, since, directory):
+    """Write the ids and the documents changed since ``since`` of one collection"""
+    collection = db[name]
+    ids_name, docs_name = f"{name}.ids.gz", f"{name}.jsonl.gz"
+    total = _dump_lines(os.path.join(directory, ids_name),
+                        (json_util.dumps(doc['_id']) for doc in collection.find({}, {'_id': 1}).sort('_id', 1)))
+    query = {field: {'$gte': since}} if since else {}
+    documents = _dump_lines(os.path.join(directory, docs_name),
+                            (json_util.dumps(doc, json_options=json_util.CANONICAL_JSON_OPTIONS)
+                             for doc in collection.find(query)))
+    return {
+        'since': since.isoformat() if since else None,
+        'documents': documents,
+        'total': total,
+        'archive': docs_name,
+        'sha256': _sha256_file(os.path.join(directory, docs_name)),
+        'ids': ids_name,
+        'ids_sha256': _sha256_file(os.path.join(directory, ids_name)),
+    }
+
+def _backup_files(storage, snapshot_id, directory, previous):
+    """Archive the uploads that no earlier snapshot of the chain holds
+
+    ``previous`` is the file list of the previous snapshot ({} for a full
+    one). Files listed there with an unchanged size keep their hash without
+    being read again; everything else is read once to hash it, and only
+    contents with a new hash are added to this snapshot's archive.
+    """
+    entries = {}
+    stored = {entry['sha256']: entry['snapshot'] for entry in previous.values()}
+    added = added_bytes = 0
+    archive_path = os.path.join(directory, FILES_ARCHIVE)
+    with tarfile.open(archive_path, 'w:gz') as archive:
+        for kind in UPLOAD_KINDS:
+            for key, size in storage.list(kind + '/'):
+                known = previous.get(key)
+                if known and known['size'] == size:
+                    entries[key] = known
+                    continue
+                with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as buffer:
+                    digest = hashlib.sha256()
+                    for chunk in storage.open_range(key):
+                        digest.update(chunk)
+                        buffer.write(chunk)
+                    sha256 = digest.hexdigest()
+                    if sha256 not in stored:
+                        info = tarfile.TarInfo(sha256)
+                        info.size = buffer.tell()
+                        buffer.seek(0)
+                        archive.addfile(info, buffer)
+                        stored[sha256] = snapshot_id
+                        added += 1
+                        added_bytes += info.size
+                entries[key] = {'sha256': sha256, 'size': size, 'snapshot': stored[sha256]}
+    return {
+        'archive': FILES_ARCHIVE,
+        'sha256': _sha256_file(archive_path),
+        'added': added,
+        'added_bytes': added_bytes,
+        'entries': entries,
+    }
+
+def verify_snapshot(backup_dir, snapshot_id, directory=None, log=print):
+    """Check a snapshot's archives against its manifest; returns a list of problems"""
+    directory = directory or os.path.join(backup_dir, snapshot_id)
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    problems = []
+
+    for name, info in manifest['collections'].items():
+        for archive, sha256, expected in ((info['archive'], info['sha256'], info['documents']),
+                                          (info['ids'], info['ids_sha256'], info['total'])):
+            path = os.path.join(directory, archive)
+            if _sha256_file(path) != sha256:
+                problems.append(f"{archive}: checksum mismatch")
+                continue
+            count = sum(1 for _ in _read_lines(path))
+            if count != expected:
+                problems.append(f"{archive}: {count} record(s), manifest says {expected}")
+
+    files = manifest['files']
+    path = os.path.join(directory, files['archive'])
+    if _sha256_file(path) != files['sha256']:
+        problems.append(f"{files['archive']}: checksum mismatch")
+    else:
+        members = 0
+        with tarfile.open(path, 'r|gz') as archive:
+            for member in archive:
+                digest = hashlib.sha256()
+                source = archive.extractfile(member)
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                if digest.hexdigest() != member.name:
+                    problems.append(f"{files['archive']}: {member.name} is corrupt")
+                members += 1
+        if members != files['added']:
+            problems.append(f"{files['archive']}: {members} file(s), manifest says {files['added']}")
+    for snapshot in {entry['snapshot'] for entry in files['entries'].values()} - {snapshot_id}:
+        if not os.path.exists(os.path.join(backup_dir, snapshot, MANIFEST)):
+            problems.append(f"files archived in snapshot {snapshot}, which is missing")
+
+    for problem in problems:
+        log(f"⚠️  {snapshot_id}: {problem}")
+    return problems
+
+def backup(db, storage, backup_dir, full=False, workers=4, log=print):
+    """Take a snapshot of the catalog and the uploads; returns its manifest
+
+    Builds on the latest snapshot unless ``full`` is set or there is none yet.
+    """
+    existing = list_snapshots(backup_dir)
+    previous = None if full or not existing else load_manifest(backup_dir, existing[-1])
+    started = datetime.utcnow()
+    snapshot_id = started.strftime('%Y%m%dT%H%M%SZ')
+    if existing and snapshot_id <= existing[-1]:
+        raise RuntimeError(f"Snapshot {existing[-1]} is not older than {snapshot_id}; check the clock")
+
+    directory = os.path.join(backup_dir, snapshot_id + '.partial')
+    os.makedirs(directory)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            dumps = {}
+            for name, field in BACKUP_COLLECTIONS.items():
+                since = None
+                if previous and name in previous['collections']:
+                    since = datetime.fromisoformat(previous['collections'][name]['watermark']) - WATERMARK_OVERLAP
+                dumps[name] = executor.submit(_dump_collection, db, name, field, since, directory)
+            files = executor.submit(_backup_files, storage, snapshot_id, directory,
+                                    previous['files']['entries'] if previous else {})
+
+            collections = {}
+            for name, future in dumps.items():
+                collections[name] = future.result()
+                collections[name]['watermark'] = started.isoformat()
+                log(f"{name}: {collections[name]['documents']} of {collections[name]['total']} document(s) written")
+            manifest = {
+                'id': snapshot_id,
+                'created_at': started.isoformat(),
+                'base': previous['id'] if previous else None,
+                'collections': collections,
+                'files': files.result(),
+            }
+        log(f"files: {len(manifest['files']['entries'])} stored, {manifest['files']['added']} new "
+            f"({manifest['files']['added_bytes'] // 1024} KiB archived)")
+        with open(os.path.join(directory, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+        if verify_snapshot(backup_dir, snapshot_id, directory=directory, log=log):
+            raise RuntimeError(f"Snapshot {snapshot_id} failed verification")
+        os.rename(directory, os.path.join(backup_dir, snapshot_id))
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+    kind = 'incremental on ' + previous['id'] if previous else 'full'
+    log(f"Snapshot {snapshot_id} written ({kind}) in {(datetime.utcnow() - started).total_seconds():.1f}s")
+    return manifest
+
+def _restore_collection(db, backup_dir, chain, name):
+    """Recreate one collection as of the last snapshot in ``chain``
+
+    Reads the dumps newest first and keeps the first version seen of every
+    _id that existed at that snapshot. Returns ``(restored, missing)``;
+    missing documents were created while the snapshot was being taken and
+    are in the next one.
+    """
+    target = chain[-1]
+    wanted = set(_read_lines(os.path.join(backup_dir, target['id'], target['collections'][name]['ids'])))
+    collection = db[name]
+    collection.drop()
+    restored = 0
+    batch = []
+    for manifest in reversed(chain):
+        info = manifest['collections'].get(name)
+        if info is None:
+            continue
+        for doc in _read_lines(os.path.join(backup_dir, manifest['id'], info['archive'])):
+            if doc['_id'] in wanted:
+                wanted.discard(doc['_id'])
+                batch.append(doc)
+                if len(batch) >= RESTORE_BATCH_SIZE:
+                    collection.insert_many(batch, ordered=False)
+                    restored += len(batch)
+                    batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        restored += len(batch)
+    return restored, len(wanted)
+
+def _restore_archive(storage, backup_dir, snapshot_id, keys_by_hash):
+    """Put the files held by one snapshot's archive back into ``storage``"""
+    restored = 0
+    with tarfile.open(os.path.join(backup_dir, snapshot_id, FILES_ARCHIVE), 'r|gz') as archive:
+        for member in archive:
+            keys = keys_by_hash.get(member.name)
+            if not keys:
+                continue
+            with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as buffer:
+                shutil.copyfileobj(archive.extractfile(member), buffer, CHUNK_SIZE)
+                for key in keys:
+                    buffer.seek(0)
+                    storage.put(key, buffer)
+                    restored += 1
+    return restored
+
+def restore(db, storage, backup_dir, snapshot_id=None, workers=4, log=print):
+    """Restore the catalog and uploads as of ``snapshot_id`` (default: the latest)
+
+    The backed-up collections are dropped and reloaded, then indexes are
+    rebuilt. Files already in storage with the recorded size are left alone.
+    Collections and file archives are restored in parallel.
+    """
+    if snapshot_id is None:
+        snapshots = list_snapshots(backup_dir)
+        if not snapshots:
+            raise RuntimeError(f"No snapshots in {backup_dir}")
+        snapshot_id = snapshots[-1]
+    chain = snapshot_chain(backup_dir, snapshot_id)
+
+    # Check every archive before touching the database
+    for manifest in chain:
+        if verify_snapshot(backup_dir, manifest['id'], log=log):
+            raise RuntimeError(f"Snapshot {manifest['id']} failed verification; nothing restored")
+    log(f"Restoring {snapshot_id} ({len(chain)} snapshot(s) from {chain[0]['id']})")
+
+    keys_by_archive = {}
+    skipped = 0
+    for key, entry in chain[-1]['files']['entries'].items():
+        if storage.size(key) == entry['size']:
+            skipped += 1
+            continue
+        keys_by_archive.setdefault(entry['snapshot'], {}).setdefault(entry['sha256'], []).append(key)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        collections = {name: executor.submit(_restore_collection, db, backup_dir, chain, name)
+                       for name in chain[-1]['collections']}
+        archives = [executor.submit(_restore_archive, storage, backup_dir, archive_id, keys_by_hash)
+                    for archive_id, keys_by_hash in keys_by_archive.items()]
+        for name, future in collections.items():
+            restored, missing = future.result()
+            log(f"{name}: {restored} document(s) restored")
+            if missing:
+                log(f"⚠️  {name}: {missing} document(s) listed without contents, skipped")
+        files = sum(future.result() for future in archives)
+    log(f"files: {files} restored, {skipped} already present")
+
+    ensure_indexes(db, log=log)
+    for name in chain[-1]['collections']:
+        signal = SIGNALS_BY_COLLECTION.get(name)
+        if signal is not None:
+            signal.send(restore, op='update', id=None)
+    log(f"Snapshot {snapshot_id} restored")
+    return chain[-1]
@@ -0,0 +1,461 @@
+import hashlib
+import math
+import os
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from utils.metrics import record_cache
+from utils.signals import publication_changed, author_changed, user_changed, catalog_invalidated, counters_only
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:  # redis is optional; FakeRedis never raises WatchError
+    WatchError = ()
+
+# Shared cache service with pluggable backends.
+#
+# Entries are stored as (value, expires_at, compute_seconds, tag_versions).
+# Tags are invalidated by bumping a per-tag version counter in the backend, so
+# an entry is served only while every tag it was stored under still has the
+# version it had at write time. That makes invalidation O(number of tags)
+# and works the same on every backend.
+#
+# Concurrent misses for one key are coalesced: threads in a process share a
+# lock, processes share a short-lived backend lock, and only the holder
+# recomputes while the others wait for its result. Entries are refreshed
+# early with probability rising towards expiry (XFetch), so hot keys are
+# recomputed by one caller before they expire instead of by all callers after.
+
+class LRUBackend:
+    """In-process LRU cache (per worker)"""
+
+    # Which processes see the same entries: 'process', 'host' or 'cluster'
+    scope = 'process'
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        results = []
+        with self._lock:
+            for key in keys:
+                if key in self._counters:
+                    results.append(self._counters[key])
+                    continue
+                item = self._data.get(key)
+                if item is None or (item[1] is not None and item[1] <= now):
+                    results.append(None)
+                    continue
+                self._data.move_to_end(key)
+                results.append(item[0])
+        return results
+
+    def _store(self, key, value, ttl):
+        # Caller holds self._lock
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and (item[1] is None or item[1] > time.time()):
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        # Counters (tag versions) live outside the LRU so they are never evicted
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+class FileSystemBackend:
+    """Cache stored as pickle files in a directory shared by all workers on a host"""
+
+    scope = 'host'
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, suffix='.cache'):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + suffix)
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                value, expires_at = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return value
+
+    def get_many(self, keys):
+        return [self._read(self._path(key)) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            pickle.dump((value, time.time() + ttl if ttl else None), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    def add(self, key, value, ttl=None):
+        # O_EXCL file creation is atomic across processes; stale lock files are expired by mtime
+        path = self._path(key, '.lock')
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if ttl and os.path.getmtime(path) + ttl < time.time():
+                    os.remove(path)
+                    return self.add(key, value, ttl)
+            except OSError:
+                pass
+            return False
+        os.close(fd)
+        return True
+
+    def delete(self, key):
+        for suffix in ('.cache', '.lock'):
+            try:
+                os.remove(self._path(key, suffix))
+            except OSError:
+                pass
+
+    def incr(self, key):
+        # A lost increment would leave a tag version stale, so never proceed
+        # unlocked; a crashed holder's lock expires after 5 s, well inside the deadline
+        lock_key = key + ':incr'
+        deadline = time.time() + 10
+        while not self.add(lock_key, 1, ttl=5):
+            if time.time() >= deadline:
+                raise TimeoutError(f"Could not lock cache counter {key!r} in {self.directory}")
+            time.sleep(0.005)
+        try:
+            value = (self._read(self._path(key)) or 0) + 1
+            self.set(key, value)
+            return value
+        finally:
+            self.delete(lock_key)
+
+class RedisBackend:
+    """Cache shared by every worker and node through Redis"""
+
+    def __init__(self, client):
+        self.client = client
+        self.scope = 'process' if isinstance(client, FakeRedis) else 'cluster'
+
+    def get_many(self, keys):
+        return [pickle.loads(raw) if raw is not None else None for raw in self.client.mget(keys)]
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                        px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                                    nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        # Stored pickled so get_many can read tag versions like any other value
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    value = (pickle.loads(raw) if raw is not None else 0) + 1
+                    pipe.multi()
+                    pipe.set(key, pickle.dumps(value))
+                    pipe.execute()
+                    return value
+                except WatchError:
+                    continue
+
+class FakeRedis:
+    """In-memory stand-in for the subset of redis-py used by RedisBackend
+
+    Lets the Redis code path run in development and tests without a server
+    (CACHE_TYPE='fakeredis').
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def _alive(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.time():
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._alive(key)
+            return item[0] if item else None
+
+    def mget(self, keys):
+        with self._lock:
+            return [self.get(key) for key in keys]
+
+    def set(self, key, value, nx=False, px=None):
+        with self._lock:
+            if nx and self._alive(key) is not None:
+                return None
+            self._data[key] = (value, time.time() + px / 1000.0 if px else None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def pipeline(self):
+        return _FakePipeline(self)
+
+class _FakePipeline:
+    """Optimistic-transaction pipeline for FakeRedis (no concurrent writers to detect)"""
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+
+    def __enter__(self):
+        self.client._lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.client._lock.release()
+
+    def watch(self, key):
+        pass
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def multi(self):
+        self._commands = []
+
+    def set(self, key, value, **kwargs):
+        self._commands.append((key, value, kwargs))
+
+    def execute(self):
+        results = [self.client.set(key, value, **kwargs) for key, value, kwargs in self._commands]
+        self._commands = []
+        return results
+
+class CacheService:
+    """Cache front end with single-flight misses, early refresh and tag invalidation"""
+
+    def __init__(self, backend, default_timeout=300, key_prefix='wrdc:', lock_timeout=10, beta=1.0):
+        self.backend = backend
+        self.default_timeout = default_timeout
+        self.key_prefix = key_prefix
+        self.lock_timeout = lock_timeout
+        self.beta = beta
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    # -- keys -------------------------------------------------------------
+
+    def _key(self, key):
+        return self.key_prefix + key
+
+    def _tag_key(self, tag):
+        return self.key_prefix + 'tag:' + tag
+
+    @staticmethod
+    def _region(key):
+        # Metrics are reported per key namespace ('facets:authors' -> 'facets')
+        return key.split(':', 1)[0]
+
+    # -- basic operations -------------------------------------------------
+
+    def _load(self, key, tags):
+        """Fetch an entry and the current versions of its tags in one round trip"""
+        tags = list(tags)
+        values = self.backend.get_many([self._key(key)] + [self._tag_key(tag) for tag in tags])
+        entry = values[0]
+        if entry is None:
+            return None
+        current_versions = {tag: version or 0 for tag, version in zip(tags, values[1:])}
+        if entry[3] != current_versions:
+            return None
+        return entry
+
+    def _tag_versions(self, tags):
+        tags = list(tags)
+        if not tags:
+            return {}
+        versions = self.backend.get_many([self._tag_key(tag) for tag in tags])
+        return {tag: version or 0 for tag, version in zip(tags, versions)}
+
+    def get(self, key, tags=()):
+        entry = self._load(key, tags)
+        record_cache(self._region(key), entry is not None)
+        return entry[0] if entry is not None else None
+
+    def set(self, key, value, timeout=None, tags=(), compute_seconds=0.0, tag_versions=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        if tag_versions is None:
+            tag_versions = self._tag_versions(tags)
+        entry = (value, time.time() + timeout, compute_seconds, tag_versions)
+        self.backend.set(self._key(key), entry, timeout)
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    def invalidate_tags(self, *tags):
+        """Make every entry stored under any of ``tags`` stale"""
+        for tag in tags:
+            self.backend.incr(self._tag_key(tag))
+
+    # -- read-through -----------------------------------------------------
+
+    def _should_refresh_early(self, entry):
+        # XFetch: refresh when now - compute_time * beta * ln(rand) >= expiry
+        _, expires_at, compute_seconds, _ = entry
+        if not compute_seconds or not self.beta:
+            return False
+        return time.time() - compute_seconds * self.beta * math.log(random.random() or 1e-12) >= expires_at
+
+    def _compute_and_store(self, key, compute, timeout, tags):
+        tag_versions = self._tag_versions(tags)  # read before computing so racing invalidations win
+        start = time.perf_counter()
+        value = compute()
+        self.set(key, value, timeout, tags, time.perf_counter() - start, tag_versions)
+        return value
+
+    def _local_lock(self, key):
+        with self._locks_guard:
+            slot = self._locks.get(key)
+            if slot is None:
+                slot = self._locks[key] = [threading.Lock(), 0]
+            slot[1] += 1
+            return slot
+
+    def _release_local_lock(self, key, slot):
+        with self._locks_guard:
+            slot[1] -= 1
+            if slot[1] == 0:
+                self._locks.pop(key, None)
+
+    def get_or_set(self, key, compute, timeout=None, tags=()):
+        """Return the cached value for ``key``, computing and storing it on a miss"""
+        entry = self._load(key, tags)
+        if entry is not None:
+            record_cache(self._region(key), True)
+            if self._should_refresh_early(entry):
+                lock_key = self._key(key) + ':lock'
+                # Only one caller refreshes; everyone else keeps serving the current value
+                if self.backend.add(lock_key, 1, self.lock_timeout):
+                    try:
+                        return self._compute_and_store(key, compute, timeout, tags)
+                    finally:
+                        self.backend.delete(lock_key)
+            return entry[0]
+
+        record_cache(self._region(key), False)
+        slot = self._local_lock(key)
+        try:
+            with slot[0]:
+                entry = self._load(key, tags)
+                if entry is not None:
+                    return entry[0]
+                lock_key = self._key(key) + ':lock'
+                if self.backend.add(lock_key, 1, self.lock_timeout):
+                    try:
+                        return self._compute_and_store(key, compute, timeout, tags)
+                    finally:
+                        self.backend.delete(lock_key)
+                # Another process is computing this key; wait for its result
+                deadline = time.time() + self.lock_timeout
+                while time.time() < deadline:
+                    time.sleep(0.02)
+                    entry = self._load(key, tags)
+                    if entry is not None:
+                        return entry[0]
+                return self._compute_and_store(key, compute, timeout, tags)
+        finally:
+            self._release_local_lock(key, slot)
+
+def create_backend(config):
+    """Build the backend named by CACHE_TYPE"""
+    cache_type = (config.get('CACHE_TYPE') or 'lru').lower()
+    if cache_type in ('lru', 'simple'):
+        return LRUBackend(config.get('CACHE_MAX_ENTRIES', 1024))
+    if cache_type == 'filesystem':
+        return FileSystemBackend(config['CACHE_DIR'])
+    if cache_type == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_TYPE='redis' requires the redis package (pip install redis)")
+        return RedisBackend(redis.Redis.from_url(config['CACHE_REDIS_URL']))
+    if cache_type == 'fakeredis':
+        return RedisBackend(FakeRedis())
+    raise ValueError(f"Unknown CACHE_TYPE: {cache_type}")
+
+def init_cache(app):
+    """Create the cache service, store it in app.extensions and wire write invalidation"""
+    service = CacheService(
+        create_backend(app.config),
+        default_timeout=app.config.get('CACHE_DEFAULT_TIMEOUT', 300),
+        key_prefix=app.config.get('CACHE_KEY_PREFIX', 'wrdc:'),
+        lock_timeout=app.config.get('CACHE_LOCK_TIMEOUT', 10),
+        beta=app.config.get('CACHE_EARLY_REFRESH_BETA', 1.0),
+    )
+    app.extensions['wrdc_cache'] = service
+
+    def on_publication_changed(sender, op=None, id=None, **extra):
+        service.invalidate_tags('publications', *([f"publication:{id}"] if id else []))
+
+    def on_author_changed(sender, op=None, id=None, **extra):
+        service.invalidate_tags('authors', *([f"author:{id}"] if id else []))
+
+    def on_user_changed(sender, op=None, id=None, **extra):
+        if id:
+            service.invalidate_tags(f"user:{id}")
+
+    publication_changed.connect(on_publication_changed, weak=False)
+    author_changed.connect(on_author_changed, weak=False)
+    user_changed.connect(on_user_changed, weak=False)
+
+    # Writes made by other processes; a Redis cache already sees their tag bumps
+    if service.backend.scope != 'cluster':
+        receivers = {'publications': on_publication_changed, 'authors': on_author_changed, 'users': on_user_changed}
+
+        def on_invalidated(sender, collection=None, op=None, id=None, fields=None, **extra):
+            # View and download counters don't show in any cached result
+            if collection in receivers and not counters_only(op, fields):
+                receivers[collection](sender, op=op, id=id)
+
+        catalog_invalidated.connect(on_invalidated, weak=False)
+    return service
+
+def get_cache():
+    """Get the cache service for the current app"""
+    return current_app.extensions['wrdc_cache']
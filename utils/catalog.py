@@ -0,0 +1,617 @@
+import os
+import threading
+from bisect import insort
+import time
+from array import array
+from datetime import date, datetime
+from bson.objectid import ObjectId
+from flask import current_app
+from pymongo.errors import PyMongoError
+from models.publication import Publication
+from utils.indexes import CATALOG_COLLATION
+from utils.query import HOMEPAGE_SEARCH_FIELDS, date_bound, keep_selected, parse_search
+from utils.signals import publication_changed, catalog_invalidated
+
+# Read-optimised copy of the publication catalog held by each worker, so the
+# homepage grid, its filter sidebar and /api/v1/publications can answer list,
+# count and facet requests without a MongoDB round trip.
+#
+# A snapshot is column-oriented: row N of every column (titles, authors,
+# categories, dates, covers) describes the same publication, and rows follow
+# _id order. Each author, category and publication year has a bitmap with bit
+# N set when row N carries that value. The bitmaps are Python ints, so AND/OR
+# and bit_count() run in C over the whole catalog at once: a filter
+# combination is a handful of big-integer operations, and a facet count is
+# one AND and one popcount per value. Searches scan a lowercased text column
+# of the rows left by the other filters.
+#
+# The other sort orders are copied from MongoDB (an _id-only query sorted with
+# CATALOG_COLLATION) when the snapshot is built, so pages come out in the
+# order the server would produce. Rows added or changed later are inserted
+# with bisect, using a key that follows the collation (case-insensitive) and
+# MongoDB's ordering of missing values and arrays.
+#
+# The snapshot is built in a background thread when the worker starts and
+# patched on writes: publication signals from this process and
+# `catalog_invalidated` from the others (see utils/invalidation.py) queue the
+# changed ids, and the next read fetches those documents with one $in query.
+# That fetch runs outside the snapshot lock; requests arriving while it is in
+# flight query MongoDB rather than wait for it or miss the change. Bulk
+# changes (id=None) rebuild it. Until a snapshot is available every caller
+# falls back to querying MongoDB.
+
+# Fields a snapshot row holds (everything a catalog card shows)
+SNAPSHOT_PROJECTION = {'title': 1, 'authors': 1, 'author': 1, 'category': 1, 'publish_date': 1, 'cover_filename': 1}
+
+# Updates touching none of these (view and download counters, related lists, ...) leave the snapshot as it is
+SNAPSHOT_FIELDS = frozenset(SNAPSHOT_PROJECTION)
+
+# Sort options served from the snapshot -> the MongoDB sort whose order they copy
+SNAPSHOT_SORTS = {
+    'title': [('title', 1)],
+    'author': [('authors', 1), ('author', 1)],
+    'publish_date': [('publish_date', 1)],
+}
+
+def _fold(value):
+    """Comparison key matching CATALOG_COLLATION's case-insensitive equality"""
+    return value.lower() if isinstance(value, str) else value
+
+def _bitmap(rows, size):
+    """Bitmap with the bits of ``rows`` set"""
+    data = bytearray((size + 7) // 8)
+    for row in rows:
+        data[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(data, 'little')
+
+def _members(bitmap):
+    """Rows set in ``bitmap``, ascending"""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield index * 8 + low.bit_length() - 1
+            byte ^= low
+
+def _sort_value(value):
+    """Sort key of one scalar: MongoDB puts missing/null before strings, strings before dates"""
+    if value is None:
+        return (1, '')
+    if isinstance(value, str):
+        return (3, value.lower())
+    if isinstance(value, datetime):
+        return (9, value)
+    return (2, value)
+
+def _row_names(doc):
+    """Author names a publication matches: the authors array plus a legacy author field"""
+    names = list(Publication.get_authors_display(doc))
+    if isinstance(doc.get('author'), str) and doc['author'] not in names:
+        names.append(doc['author'])
+    return tuple(name for name in names if isinstance(name, str))
+
+class CatalogSnapshot:
+    """Columns and facet bitmaps for every publication (not thread-safe; see SnapshotService)"""
+
+    def __init__(self):
+        self.ids = []
+        self.rows = {}
+        self.titles = []
+        self.authors = []
+        # Whether the row has an authors array (else only the legacy author field)
+        self.has_authors = []
+        self.names = []
+        self.categories = []
+        self.dates = []
+        self.covers = []
+        # Day ordinal of publish_date, 0 when it is not a date
+        self.days = array('l')
+        self.live = 0
+        self.dead = 0
+        # Value -> bitmap, and folded value -> the values it covers
+        self.by_author = {}
+        self.by_category = {}
+        self.by_year = {}
+        self.author_keys = {}
+        self.category_keys = {}
+        # Sort name -> rows in that order
+        self.orders = {}
+        # Search fields -> lowercased text per row
+        self.haystacks = {}
+
+    @classmethod
+    def load(cls, db):
+        """Build a snapshot from the whole collection"""
+        snapshot = cls()
+        members = {'author': {}, 'category': {}, 'year': {}}
+        for doc in db.publications.find({}, SNAPSHOT_PROJECTION).sort('_id', 1).batch_size(1000):
+            row = snapshot._append(doc)
+            for name in snapshot.names[row]:
+                members['author'].setdefault(name, []).append(row)
+            if isinstance(snapshot.categories[row], str):
+                members['category'].setdefault(snapshot.categories[row], []).append(row)
+            if snapshot.days[row]:
+                members['year'].setdefault(snapshot.dates[row].year, []).append(row)
+        size = len(snapshot.ids)
+        snapshot.live = (1 << size) - 1
+        snapshot.by_author = {name: _bitmap(rows, size) for name, rows in members['author'].items()}
+        snapshot.by_category = {value: _bitmap(rows, size) for value, rows in members['category'].items()}
+        snapshot.by_year = {year: _bitmap(rows, size) for year, rows in members['year'].items()}
+        for name in snapshot.by_author:
+            snapshot.author_keys.setdefault(_fold(name), set()).add(name)
+        for value in snapshot.by_category:
+            snapshot.category_keys.setdefault(_fold(value), set()).add(value)
+        for sort, spec in SNAPSHOT_SORTS.items():
+            snapshot.set_order(sort, [doc['_id'] for doc in db.publications.find({}, {'_id': 1})
+                                      .sort(spec).collation(CATALOG_COLLATION)])
+        return snapshot
+
+    # -- rows -----------------------------------------------------------------
+
+    def _append(self, doc):
+        row = len(self.ids)
+        self.ids.append(doc['_id'])
+        self.rows[doc['_id']] = row
+        for column in (self.titles, self.authors, self.has_authors, self.names, self.categories, self.dates,
+                       self.covers):
+            column.append(None)
+        self.days.append(0)
+        for haystack in self.haystacks.values():
+            haystack.append('')
+        self._set_columns(row, doc)
+        return row
+
+    def _set_columns(self, row, doc):
+        self.titles[row] = doc.get('title')
+        self.authors[row] = tuple(Publication.get_authors_display(doc))
+        self.has_authors[row] = isinstance(doc.get('authors'), list)
+        self.names[row] = _row_names(doc)
+        self.categories[row] = doc.get('category')
+        self.dates[row] = doc.get('publish_date')
+        self.covers[row] = doc.get('cover_filename')
+        # Range filters on publish_date only match BSON dates (not strings left by old imports)
+        self.days[row] = self.dates[row].toordinal() if isinstance(self.dates[row], datetime) else 0
+        for fields, haystack in self.haystacks.items():
+            haystack[row] = self._haystack(row, fields)
+
+    def _index(self, row, add):
+        """Set (or clear) the row's bits in the facet bitmaps"""
+        bit = 1 << row
+        entries = [(self.by_author, self.author_keys, name) for name in self.names[row]]
+        if isinstance(self.categories[row], str):
+            entries.append((self.by_category, self.category_keys, self.categories[row]))
+        if self.days[row]:
+            entries.append((self.by_year, None, self.dates[row].year))
+        for index, keys, value in entries:
+            if add:
+                if value not in index and keys is not None:
+                    keys.setdefault(_fold(value), set()).add(value)
+                index[value] = index.get(value, 0) | bit
+            elif value in index:
+                index[value] &= ~bit
+                if not index[value]:
+                    del index[value]
+                    if keys is not None:
+                        keys[_fold(value)].discard(value)
+                        if not keys[_fold(value)]:
+                            del keys[_fold(value)]
+
+    def put(self, doc):
+        """Add or replace one publication"""
+        row = self.rows.get(doc['_id'])
+        if row is None:
+            row = self._append(doc)
+            moved = list(self.orders)
+        else:
+            before = {sort: self._sort_key(sort, row) for sort in self.orders}
+            self._index(row, False)
+            self._set_columns(row, doc)
+            moved = [sort for sort in self.orders if self._sort_key(sort, row) != before[sort]]
+            for sort in moved:
+                if row in self.orders[sort]:
+                    self.orders[sort].remove(row)
+        for sort in moved:
+            insort(self.orders[sort], row, key=lambda other: self._sort_key(sort, other))
+        self._index(row, True)
+        self.live |= 1 << row
+
+    def _sort_key(self, sort, row):
+        """Where a row goes in a copied order (an approximation of CATALOG_COLLATION)"""
+        if sort == 'title':
+            return _sort_value(self.titles[row])
+        if sort == 'publish_date':
+            return _sort_value(self.dates[row])
+        # Ascending sorts compare an array by its smallest element, and an empty array first
+        if not self.has_authors[row]:
+            return (1, ''), _sort_value(self.authors[row][0] if self.authors[row] else None)
+        if not self.authors[row]:
+            return (0, ''), (1, '')
+        return min(_sort_value(name) for name in self.authors[row]), (1, '')
+
+    def remove(self, publication_id):
+        """Drop one publication; its row stays allocated until the next rebuild"""
+        row = self.rows.pop(publication_id, None)
+        if row is None:
+            return
+        self._index(row, False)
+        self.live &= ~(1 << row)
+        self.dead += 1
+        for order in self.orders.values():
+            if row in order:
+                order.remove(row)
+
+    def set_order(self, sort, ids):
+        """Record a sort order as the list of _ids MongoDB returned"""
+        self.orders[sort] = [self.rows[publication_id] for publication_id in ids if publication_id in self.rows]
+
+    # -- filters --------------------------------------------------------------
+
+    def _any(self, index, keys, value):
+        """Rows carrying ``value`` under the catalog collation"""
+        bitmap = 0
+        for exact in keys.get(_fold(value), ()):
+            bitmap |= index[exact]
+        return bitmap
+
+    def _date_mask(self, date_from, date_to):
+        """Rows with publish_date inside the inclusive range (see utils.query.publish_date_filter)"""
+        low = date_bound(date_from).toordinal() if date_from else None
+        high = date_bound(date_to, end=True).toordinal() if date_to else None
+        bitmap = 0
+        partial = []
+        for year, rows in self.by_year.items():
+            first, last = date(year, 1, 1).toordinal(), date(year + 1, 1, 1).toordinal()
+            if (low is not None and last <= low) or (high is not None and first >= high):
+                continue
+            if (low is None or first >= low) and (high is None or last <= high):
+                # The whole year is inside the range
+                bitmap |= rows
+            else:
+                partial.extend(row for row in _members(rows)
+                               if (low is None or self.days[row] >= low) and (high is None or self.days[row] < high))
+        return bitmap | _bitmap(partial, len(self.ids))
+
+    def _haystack(self, row, fields):
+        values = []
+        if 'title' in fields:
+            values.append(self.titles[row])
+        if 'authors' in fields or 'author' in fields:
+            values.extend(self.names[row])
+        if 'category' in fields:
+            values.append(self.categories[row])
+        # NUL-separated, so a substring cannot span two fields and a prefix is '\0' + prefix
+        return '\0' + '\0'.join(value.lower() for value in values if isinstance(value, str)) + '\0'
+
+    def _search(self, mask, search, fields):
+        """Rows of ``mask`` matching a search box value (see utils.query.compile_search)"""
+        parsed = parse_search(search)
+        if parsed is None:
+            return mask
+        mode, term = parsed
+        term = term.lower().replace('\0', '')
+        if mode == 'prefix':
+            term = '\0' + term
+        fields = tuple(fields)
+        if fields not in self.haystacks:
+            self.haystacks[fields] = [self._haystack(row, fields) for row in range(len(self.ids))]
+        haystack = self.haystacks[fields]
+        return _bitmap([row for row in _members(mask) if term in haystack[row]], len(self.ids))
+
+    def _filter_masks(self, author=None, category=None, publish_date=None, date_from=None, date_to=None):
+        masks = {}
+        if author:
+            masks['author'] = self._any(self.by_author, self.author_keys, author)
+        if category:
+            masks['category'] = self._any(self.by_category, self.category_keys, category)
+        if publish_date:
+            date_from = date_to = publish_date
+        if date_from or date_to:
+            masks['date'] = self._date_mask(date_from, date_to)
+        return masks
+
+    def select(self, search=None, author=None, category=None, publish_date=None, date_from=None, date_to=None,
+               search_fields=HOMEPAGE_SEARCH_FIELDS):
+        """Bitmap of the publications matching the filters of build_publication_query()
+
+        Raises ValueError on a malformed date, like build_publication_query().
+        """
+        mask = self.live
+        for bitmap in self._filter_masks(author, category, publish_date, date_from, date_to).values():
+            mask &= bitmap
+        if search:
+            mask = self._search(mask, search, search_fields)
+        return mask
+
+    # -- results --------------------------------------------------------------
+
+    def page(self, mask, sort=None, skip=0, limit=20, descending=False):
+        """Rows of ``mask`` number ``skip`` to ``skip + limit`` in ``sort`` order (_id order for None)"""
+        if mask == self.live and sort is not None and not descending:
+            return self.orders[sort][skip:skip + limit]
+        order = self.orders[sort] if sort is not None else range(len(self.ids))
+        if descending:
+            order = reversed(order)
+        data = mask.to_bytes((len(self.ids) + 7) // 8, 'little')
+        rows = []
+        for row in order:
+            if data[row >> 3] >> (row & 7) & 1:
+                if skip:
+                    skip -= 1
+                    continue
+                rows.append(row)
+                if len(rows) >= limit:
+                    break
+        return rows
+
+    def card(self, row):
+        """The projected document of one row (a new dict, safe to modify)"""
+        return {
+            '_id': self.ids[row],
+            'title': self.titles[row],
+            'authors': list(self.authors[row]),
+            'category': self.categories[row],
+            'publish_date': self.dates[row],
+            'cover_filename': self.covers[row],
+        }
+
+    def _counts(self, index, mask, selected=None):
+        """``[{'_id': value, 'count': n}]`` of the values used by rows of ``mask`` (and ``selected``), sorted by value"""
+        if mask == self.live:
+            counts = {value: bitmap.bit_count() for value, bitmap in index.items()}
+        else:
+            counts = {value: (bitmap & mask).bit_count() for value, bitmap in index.items()}
+        return keep_selected([{'_id': value, 'count': counts[value]} for value in sorted(counts) if counts[value]],
+                             selected)
+
+    def facets(self, search=None, author=None, category=None, publish_date=None, date_from=None, date_to=None,
+               search_fields=HOMEPAGE_SEARCH_FIELDS):
+        """Author, category and year counts for a filter combination
+
+        Each facet counts the publications matching every filter except its
+        own, so the other values of a facet stay selectable.
+        """
+        masks = self._filter_masks(author, category, publish_date, date_from, date_to)
+        if search:
+            masks['search'] = self._search(self.live, search, search_fields)
+
+        def others(excluded):
+            mask = self.live
+            for name, bitmap in masks.items():
+                if name != excluded:
+                    mask &= bitmap
+            return mask
+
+        return {
+            'authors': self._counts(self.by_author, others('author'), author),
+            'categories': self._counts(self.by_category, others('category'), category),
+            'years': self._counts(self.by_year, others('date')),
+        }
+
+class SnapshotService:
+    """Keeps this process's CatalogSnapshot current and serialises access to it
+
+    The query methods return None while no snapshot is usable (not built yet,
+    rebuilding, too large, or MongoDB unreachable); callers then query
+    MongoDB as usual.
+    """
+
+    def __init__(self, db, max_documents=200000, max_pending=500):
+        self.db = db
+        self.max_documents = max_documents
+        self.max_pending = max_pending
+        self.snapshot = None
+        # Changed _id -> sequence number of its latest change
+        self.pending = {}
+        self.sequence = 0
+        self.generation = 0
+        self.building = False
+        self.pid = None
+        # Guards the snapshot and pending; never held during a MongoDB query
+        self.lock = threading.RLock()
+        # Held by the one thread fetching pending changes
+        self.refresh_lock = threading.Lock()
+
+    # -- lifecycle ------------------------------------------------------------
+
+    def start(self):
+        """Build the snapshot once per process (safe to call on every request)"""
+        if self.pid == os.getpid():
+            return False
+        with self.lock:
+            if self.pid == os.getpid():
+                return False
+            # State inherited through fork() belongs to the parent
+            self.building = False
+            self.pid = os.getpid()
+            self.rebuild()
+            return True
+
+    def rebuild(self):
+        """Drop the snapshot and build a new one in the background"""
+        with self.lock:
+            self.snapshot = None
+            self.pending = {}
+            self.generation += 1
+            if self.building:
+                # The running build sees the new generation and starts over
+                return
+            self.building = True
+        threading.Thread(target=self._build, name='catalog-snapshot', daemon=True).start()
+
+    def _build(self):
+        try:
+            self._build_until_current()
+        except Exception:
+            with self.lock:
+                self.building = False
+            raise
+
+    def _build_until_current(self):
+        delay = 1
+        while True:
+            with self.lock:
+                generation = self.generation
+            snapshot = None
+            try:
+                total = self.db.publications.estimated_document_count()
+                if total > self.max_documents:
+                    print(f"Catalog snapshot disabled: {total} publications (CATALOG_SNAPSHOT_MAX_DOCUMENTS is "
+                          f"{self.max_documents})")
+                else:
+                    started = time.monotonic()
+                    snapshot = CatalogSnapshot.load(self.db)
+                    print(f"Catalog snapshot: {len(snapshot.ids)} publications in {time.monotonic() - started:.2f}s")
+            except PyMongoError as e:
+                print(f"Could not build the catalog snapshot: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+                continue
+            with self.lock:
+                if generation == self.generation:
+                    self.snapshot = snapshot
+                    self.building = False
+                    return
+
+    def mark(self, publication_id):
+        """Queue one changed publication; applied by the next read"""
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.sequence += 1
+            self.pending[ObjectId(publication_id)] = self.sequence
+            if self.snapshot is not None and len(self.pending) > self.max_pending:
+                self.rebuild()
+
+    # -- reads ----------------------------------------------------------------
+
+    def _current(self):
+        """The snapshot with queued changes applied, or None
+
+        Only one thread fetches queued changes; the others get None (and
+        query MongoDB) until it is done, rather than block on the fetch or
+        serve a snapshot missing a write they may have just made.
+        """
+        with self.lock:
+            snapshot = self.snapshot
+            if snapshot is None or not self.pending:
+                return snapshot
+        if not self.refresh_lock.acquire(blocking=False):
+            return None
+        try:
+            with self.lock:
+                taken = dict(self.pending)
+            try:
+                docs = list(self.db.publications.find({'_id': {'$in': list(taken)}}, SNAPSHOT_PROJECTION))
+            except PyMongoError as e:
+                print(f"Could not update the catalog snapshot: {e}")
+                return None
+            with self.lock:
+                if self.snapshot is not snapshot:
+                    # Rebuilt meanwhile
+                    return None
+                for publication_id, sequence in taken.items():
+                    # Changed again during the fetch: keep it queued for the next read
+                    if self.pending.get(publication_id) == sequence:
+                        del self.pending[publication_id]
+                for doc in docs:
+                    snapshot.put(doc)
+                found = {doc['_id'] for doc in docs}
+                for publication_id in taken:
+                    if publication_id not in found:
+                        snapshot.remove(publication_id)
+                # Deleted rows are only reclaimed by a rebuild
+                if snapshot.dead > max(1000, len(snapshot.rows)):
+                    self.rebuild()
+                    return None
+            return snapshot
+        finally:
+            self.refresh_lock.release()
+
+    def find(self, sort=None, skip=0, limit=20, descending=False, **filters):
+        """``(cards, total)`` for one page of a listing, or None
+
+        ``filters`` are those of CatalogSnapshot.select(); ``sort`` is None
+        (_id order) or a key of SNAPSHOT_SORTS.
+        """
+        if sort is not None and sort not in SNAPSHOT_SORTS:
+            return None
+        snapshot = self._current()
+        if snapshot is None:
+            return None
+        with self.lock:
+            if self.snapshot is not snapshot:
+                return None
+            mask = snapshot.select(**filters)
+            rows = snapshot.page(mask, sort, skip, limit, descending)
+            return [snapshot.card(row) for row in rows], mask.bit_count()
+
+    def facets(self, **filters):
+        """CatalogSnapshot.facets() for ``filters``, or None"""
+        snapshot = self._current()
+        if snapshot is None:
+            return None
+        with self.lock:
+            if self.snapshot is not snapshot:
+                return None
+            return snapshot.facets(**filters)
+
+def get_snapshot_service():
+    """This process's snapshot service, or None when the snapshot is disabled"""
+    return current_app.extensions.get('wrdc_catalog_snapshot')
+
+def snapshot_find(**kwargs):
+    """SnapshotService.find() on the app's snapshot; None means query MongoDB"""
+    service = get_snapshot_service()
+    return service.find(**kwargs) if service is not None else None
+
+def snapshot_facets(**filters):
+    """SnapshotService.facets() on the app's snapshot; None means query MongoDB"""
+    service = get_snapshot_service()
+    return service.facets(**filters) if service is not None else None
+
+def start_snapshot(app):
+    """Start building the app's snapshot in the current process, if it is enabled"""
+    service = app.extensions.get('wrdc_catalog_snapshot')
+    if service is not None:
+        service.start()
+
+def init_catalog_snapshot(app):
+    """Create the snapshot service (app.extensions['wrdc_catalog_snapshot']) and patch it on catalog writes
+
+    The snapshot is built when the worker starts (gunicorn's post_worker_init
+    hook) or at the first request.
+    """
+    if not app.config['CATALOG_SNAPSHOT_ENABLED']:
+        return
+    if not app.config['INVALIDATION_LISTENER_ENABLED']:
+        # Without it, writes made by other workers would never reach this snapshot
+        print("Catalog snapshot disabled: it requires INVALIDATION_LISTENER_ENABLED")
+        return
+    from utils.db import mongo
+    service = SnapshotService(
+        mongo.db,
+        max_documents=app.config['CATALOG_SNAPSHOT_MAX_DOCUMENTS'],
+        max_pending=app.config['CATALOG_SNAPSHOT_MAX_PENDING'],
+    )
+    app.extensions['wrdc_catalog_snapshot'] = service
+
+    def on_changed(sender, op=None, id=None, **extra):
+        if id is None:
+            service.rebuild()
+        else:
+            service.mark(id)
+
+    publication_changed.connect(on_changed, weak=False)
+
+    def on_invalidated(sender, collection=None, op=None, id=None, fields=None, **extra):
+        if collection != 'publications':
+            return
+        if op == 'update' and fields is not None and SNAPSHOT_FIELDS.isdisjoint(fields):
+            return
+        on_changed(sender, op=op, id=id)
+
+    catalog_invalidated.connect(on_invalidated, weak=False)
+
+    @app.before_request
+    def start_catalog_snapshot():
+        start_snapshot(app)
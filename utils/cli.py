@@ -0,0 +1,252 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from utils.db import get_db
+
+wrdc_cli = AppGroup('wrdc', help='WRDC library maintenance commands.')
+
+@wrdc_cli.command('migrate')
+@click.option('--batch-size', type=int, default=None,
+              help='Documents per bulk write (defaults to MIGRATION_BATCH_SIZE).')
+@click.option('--dry-run', is_flag=True, help='Report affected document counts without writing.')
+@click.option('--status', is_flag=True, help='List migrations and whether they have been applied.')
+def migrate(batch_size, dry_run, status):
+    """Apply pending data migrations"""
+    from utils.migrations import MIGRATIONS, get_applied, run_migrations
+    db = get_db()
+
+    if status:
+        applied = get_applied(db)
+        for m in MIGRATIONS:
+            state = applied.get(m.version, {}).get('status', 'pending')
+            click.echo(f"{m.version:>4}  {state:<8}  {m.description}")
+        return
+
+    batch_size = batch_size or current_app.config['MIGRATION_BATCH_SIZE']
+    results = run_migrations(db, batch_size=batch_size, dry_run=dry_run, log=click.echo)
+    if not results:
+        click.echo('No pending migrations')
+
+@wrdc_cli.command('indexes')
+@click.option('--check', is_flag=True, help='Only report missing or changed indexes; exit 1 if any.')
+def indexes(check):
+    """Create missing indexes and rebuild changed ones"""
+    from utils.indexes import ensure_indexes, verify_indexes
+    db = get_db()
+
+    if check:
+        differences = verify_indexes(db, log=click.echo)
+        if differences:
+            raise SystemExit(1)
+        click.echo('All indexes are up to date')
+        return
+
+    differences = ensure_indexes(db, log=click.echo)
+    if not differences:
+        click.echo('All indexes are up to date')
+
+@wrdc_cli.command('explain')
+@click.option('--verbose', '-v', is_flag=True, help='Print the plan stages of every query shape.')
+@click.option('--publications', type=int, default=5000, show_default=True,
+              help='Publications seeded into the scratch database; 0 checks the app database as it is.')
+def explain(verbose, publications):
+    """Explain every catalog query shape; exit 1 on COLLSCAN or in-memory SORT
+
+    By default a scratch database (<database>_explain) on the same server is
+    seeded with bench.seed and given INDEX_SPECS, so the planner chooses
+    between indexes on realistic data; it is dropped afterwards.
+    """
+    from utils.indexes import ensure_indexes
+    from utils.query_plans import check_query_plans
+    db = get_db()
+    scratch = None
+    if publications:
+        from bench.seed import seed
+        scratch = db.client[db.name + '_explain']
+        scratch.client.drop_database(scratch.name)
+        seed(scratch, publications=publications, authors=max(publications // 10, 1), users=20, log=click.echo)
+        ensure_indexes(scratch, log=click.echo)
+        db = scratch
+    try:
+        failures = 0
+        for shape, bad, stages in check_query_plans(db):
+            if bad:
+                failures += 1
+                click.echo(f"FAIL  {shape.name}: {' > '.join(stages)}")
+            elif verbose:
+                click.echo(f"ok    {shape.name}: {' > '.join(stages)}")
+        if failures:
+            click.echo(f"{failures} query shape(s) are not index-backed")
+            raise SystemExit(1)
+        click.echo('All query shapes are index-backed')
+    finally:
+        if scratch is not None:
+            scratch.client.drop_database(scratch.name)
+
+@wrdc_cli.command('db-status')
+def db_status():
+    """Show the replica set topology, pool settings and where catalog reads are routed"""
+    from utils.db import mongo, mongo_client_options, read_preference
+    db = get_db()
+    config = current_app.config
+
+    hello = db.command('hello')
+    click.echo(f"Replica set: {hello.get('setName', '(standalone)')}  primary: {hello.get('primary', hello.get('me', '-'))}")
+    for server in mongo.cx.topology_description.server_descriptions().values():
+        rtt = server.round_trip_time
+        rtt = f"{rtt * 1000:.1f} ms" if rtt is not None else '-'
+        click.echo(f"  {server.address[0]}:{server.address[1]:<6} {server.server_type_name:<16} rtt {rtt}")
+
+    click.echo('Client options:')
+    for key, value in mongo_client_options(config).items():
+        click.echo(f"  {key} = {value}")
+    for query_class, budget in config['QUERY_TIME_BUDGETS_MS'].items():
+        click.echo(f"  maxTimeMS[{query_class}] = {budget}")
+
+    preference = read_preference(config['CATALOG_READ_PREFERENCE'], config['CATALOG_MAX_STALENESS_SECONDS'])
+    served_by = db.command('hello', read_preference=preference).get('me', '-')
+    click.echo(f"Anonymous catalog reads: {config['CATALOG_READ_PREFERENCE']} -> served by {served_by}")
+
+@wrdc_cli.command('related')
+@click.option('--full', is_flag=True, help='Recompute every related list instead of only queued changes.')
+@click.option('--extract-text', is_flag=True, help='Extract text from PDFs that have none stored first.')
+@click.option('-k', 'k', type=int, default=None, help='Neighbors per publication (defaults to RELATED_PUBLICATIONS_K).')
+def related(full, extract_text, k):
+    """Refresh the precomputed related-publications lists"""
+    from utils.recommender import extract_texts, process_queue
+    db = get_db()
+    config = current_app.config
+    k = k or config['RELATED_PUBLICATIONS_K']
+
+    if extract_text:
+        extract_texts(db, current_app.extensions['wrdc_storage'], max_pages=config['RELATED_TEXT_PAGES'], log=click.echo)
+    process_queue(db, k, config['RELATED_MIN_SCORE'], full=full, log=click.echo)
+
+@wrdc_cli.command('stats')
+def stats():
+    """Recompute the stats snapshot served by the dashboard and /api/v1/stats (run from cron)"""
+    from utils.db import query_budget
+    from utils.stats import refresh_snapshot
+    snapshot = refresh_snapshot(get_db(), query_budget('stats'))
+    click.echo(f"Stats snapshot as of {snapshot['as_of']:%Y-%m-%d %H:%M:%S} UTC: "
+               f"{snapshot['total_publications']} publications, {snapshot['total_authors']} authors, "
+               f"{snapshot['total_users']} users ({snapshot['duration_ms']} ms)")
+
+@wrdc_cli.command('analytics')
+def analytics():
+    """Downsample hourly view/download buckets into daily ones and expire old buckets (run hourly from cron)"""
+    from utils.analytics import rollup
+    config = current_app.config
+    rollup(get_db(), hourly_retention_days=config['ANALYTICS_HOURLY_RETENTION_DAYS'],
+           daily_retention_days=config['ANALYTICS_DAILY_RETENTION_DAYS'], log=click.echo)
+
+@wrdc_cli.command('storage-migrate')
+@click.option('--from', 'source', type=click.Choice(['local', 'gridfs', 's3']), required=True,
+              help='Backend to copy uploads from.')
+@click.option('--to', 'target', type=click.Choice(['local', 'gridfs', 's3']), required=True,
+              help='Backend to copy uploads to.')
+@click.option('--delete-source', is_flag=True, help='Delete each file from the source once it is copied.')
+@click.option('--dry-run', is_flag=True, help='List the files that would be copied.')
+def storage_migrate(source, target, delete_source, dry_run):
+    """Copy uploaded files between storage backends (resumable)
+
+    Both backends are configured from the STORAGE_* settings. Switch
+    STORAGE_BACKEND to the target once the copy has finished.
+    """
+    from utils.storage import create_storage, migrate_storage
+    if source == target:
+        raise click.BadParameter('--from and --to must differ')
+    db = get_db()
+    migrate_storage(create_storage(current_app.config, db, backend=source),
+                    create_storage(current_app.config, db, backend=target),
+                    delete_source=delete_source, dry_run=dry_run, log=click.echo)
+
+@wrdc_cli.command('backup')
+@click.option('--full', is_flag=True, help='Start a new chain: dump every document and archive every file.')
+@click.option('--verify', 'verify_id', metavar='SNAPSHOT', help='Only verify an existing snapshot.')
+@click.option('--list', 'list_only', is_flag=True, help='List the snapshots in BACKUP_FOLDER.')
+def backup(full, verify_id, list_only):
+    """Take an incremental snapshot of the catalog and uploads (run nightly from cron)"""
+    from utils.backup import backup as take_backup, list_snapshots, load_manifest, verify_snapshot
+    config = current_app.config
+    backup_dir = config['BACKUP_FOLDER']
+
+    if list_only:
+        for snapshot_id in list_snapshots(backup_dir):
+            manifest = load_manifest(backup_dir, snapshot_id)
+            documents = sum(info['documents'] for info in manifest['collections'].values())
+            base = f"on {manifest['base']}" if manifest['base'] else 'full'
+            click.echo(f"{snapshot_id}  {base:<20}  {documents} document(s), {manifest['files']['added']} file(s)")
+        return
+    if verify_id:
+        if verify_snapshot(backup_dir, verify_id, log=click.echo):
+            raise SystemExit(1)
+        click.echo(f"Snapshot {verify_id} is intact")
+        return
+    take_backup(get_db(), current_app.extensions['wrdc_storage'], backup_dir, full=full,
+                workers=config['BACKUP_WORKERS'], log=click.echo)
+
+@wrdc_cli.command('restore')
+@click.argument('snapshot', required=False)
+@click.option('--workers', type=int, default=None, help='Parallel restore jobs (defaults to BACKUP_WORKERS).')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def restore(snapshot, workers, yes):
+    """Restore the catalog and uploads from a snapshot (default: the latest)
+
+    Replaces the publications, authors, users and favorites collections,
+    then rebuilds their indexes.
+    """
+    from utils.backup import restore as restore_snapshot
+    config = current_app.config
+    if not yes:
+        click.confirm('This replaces the catalog collections in the database. Continue?', abort=True)
+    restore_snapshot(get_db(), current_app.extensions['wrdc_storage'], config['BACKUP_FOLDER'], snapshot,
+                     workers=workers or config['BACKUP_WORKERS'], log=click.echo)
+
+@wrdc_cli.command('gc')
+@click.option('--dry-run', is_flag=True, help='List the files that would be deleted without deleting them.')
+@click.option('--grace-hours', type=int, default=None,
+              help='Keep unreferenced files newer than this (defaults to GC_GRACE_HOURS).')
+def gc(dry_run, grace_hours):
+    """Delete uploaded PDFs, covers and author pictures nothing refers to"""
+    from utils.orphans import collect_orphans
+    config = current_app.config
+    collect_orphans(get_db(), current_app.extensions['wrdc_storage'],
+                    grace_hours=config['GC_GRACE_HOURS'] if grace_hours is None else grace_hours,
+                    deletes_per_second=config['GC_DELETES_PER_SECOND'], dry_run=dry_run, log=click.echo)
+
+@wrdc_cli.command('feeds')
+@click.option('--full', is_flag=True, help='Regenerate every file instead of only those with queued changes.')
+def feeds(full):
+    """Update sitemap.xml and the Atom feeds in FEEDS_FOLDER (cron, every few minutes)"""
+    from utils.feeds import build_feeds, feeds_folder, site_url_builder
+    config = current_app.config
+    build_feeds(get_db(), feeds_folder(current_app), site_url_builder(current_app), full=full,
+                max_entries=config['FEEDS_MAX_ENTRIES'], log=click.echo)
+
+@wrdc_cli.command('spelling')
+def spelling():
+    """Rebuild the search spelling vocabulary from titles, author names and categories
+
+    Writes keep it current afterwards; rerun after bulk imports or restores.
+    """
+    from utils.spelling import rebuild_vocabulary
+    rebuild_vocabulary(get_db(), log=click.echo)
+
+@wrdc_cli.command('assets')
+@click.option('--offline', is_flag=True, help='Skip downloading; fingerprint what is already in static/vendor.')
+@click.option('--clean', is_flag=True, help='Remove files from earlier builds first.')
+def assets(offline, clean):
+    """Vendor CDN libraries into static/ and build fingerprinted, precompressed copies
+
+    Restart the app afterwards so it picks up the new manifest.
+    """
+    import os
+    from utils.assets import build_assets, vendor_assets
+    config = current_app.config
+    vendor_dir = os.path.join(current_app.root_path, config['ASSETS_VENDOR_FOLDER'])
+    dist_dir = os.path.join(current_app.root_path, config['ASSETS_DIST_FOLDER'])
+
+    if not offline:
+        vendor_assets(vendor_dir, log=click.echo)
+    build_assets(vendor_dir, dist_dir, clean=clean, log=click.echo)
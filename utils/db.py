@@ -1,45 +1,121 @@
-from flask import current_app, g
+from flask import current_app, g, jsonify, request, session
 from flask_pymongo import PyMongo
+from pymongo.errors import ConnectionFailure, ExecutionTimeout
+from pymongo.read_preferences import (Primary, PrimaryPreferred, Secondary,
+                                      SecondaryPreferred, Nearest)
 
 mongo = PyMongo()
 
+_READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+def _setting(config, name, default=None):
+    # Works with Flask's app.config (a dict) and with Config classes
+    if isinstance(config, dict):
+        return config.get(name, default)
+    return getattr(config, name, default)
+
+def mongo_client_options(config):
+    """MongoClient keyword arguments for the MONGO_* pool and timeout settings"""
+    options = {
+        'maxPoolSize': _setting(config, 'MONGO_MAX_POOL_SIZE'),
+        'minPoolSize': _setting(config, 'MONGO_MIN_POOL_SIZE'),
+        'maxIdleTimeMS': _setting(config, 'MONGO_MAX_IDLE_TIME_MS'),
+        'waitQueueTimeoutMS': _setting(config, 'MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+        'serverSelectionTimeoutMS': _setting(config, 'MONGO_SERVER_SELECTION_TIMEOUT_MS'),
+        'connectTimeoutMS': _setting(config, 'MONGO_CONNECT_TIMEOUT_MS'),
+        'socketTimeoutMS': _setting(config, 'MONGO_SOCKET_TIMEOUT_MS'),
+        'appname': _setting(config, 'MONGO_APP_NAME'),
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
+def read_preference(name, max_staleness=-1):
+    """Build a pymongo read preference from its connection-string name"""
+    if name not in _READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {name}")
+    if name == 'primary':
+        return Primary()
+    return _READ_PREFERENCES[name](max_staleness=max_staleness)
+
 def get_db():
     """Get MongoDB database instance"""
     if 'db' not in g:
         g.db = mongo.db
     return g.db
 
-def init_db(app):
-    """Initialize database connection"""
-    mongo.init_app(app)
-    
-    # Create indexes for better performance
-    db = mongo.db
-    
-    # Text index for full-text search (MongoDB allows only one text index per collection)
-    try:
-        # Drop existing text index if it exists
-        try:
-            db.publications.drop_index("title_text_category_text_author_text")
-        except:
-            pass
-        # Create new text index
-        db.publications.create_index([
-            ("title", "text"),
-            ("category", "text"),
-            ("author", "text")
-        ], name="title_text_category_text_author_text")
-    except Exception as e:
-        print(f"Note: Text index creation: {e}")
-    
-    # Regular indexes for performance
-    try:
-        db.publications.create_index("author")
-        db.publications.create_index("category")
-        db.publications.create_index("publish_date")
-        db.publications.create_index("created_at")
-        db.users.create_index("username", unique=True)
-        db.users.create_index("email", unique=True)
-        db.authors.create_index("name")
-    except Exception as e:
-        print(f"Note: Index creation: {e}")
+def get_catalog_db():
+    """Get the database handle for public catalog reads
+
+    Anonymous visitors read with CATALOG_READ_PREFERENCE (secondaryPreferred
+    by default) so catalog browsing is spread over the replica set; signed-in
+    users read from the primary so their own changes show up immediately.
+    Writes through this handle still go to the primary.
+    """
+    if 'catalog_db' not in g:
+        db = get_db()
+        if 'user_id' not in session:
+            db = db.with_options(read_preference=read_preference(
+                current_app.config.get('CATALOG_READ_PREFERENCE', 'primary'),
+                current_app.config.get('CATALOG_MAX_STALENESS_SECONDS', -1)))
+        g.catalog_db = db
+    return g.catalog_db
+
+def query_budget(query_class):
+    """maxTimeMS budget for a query class from QUERY_TIME_BUDGETS_MS (None means unlimited)"""
+    return current_app.config.get('QUERY_TIME_BUDGETS_MS', {}).get(query_class)
+
+def init_db(app, event_listeners=None):
+    """Initialize database connection
+
+    Only creates the client (connections are opened lazily). Index checks
+    run once per deployment in run_startup_tasks(), and building indexes is
+    left to `flask wrdc indexes`.
+    """
+    read_preference(app.config.get('CATALOG_READ_PREFERENCE', 'primary'))  # fail fast on a typo
+    mongo.init_app(app, event_listeners=event_listeners or [], **mongo_client_options(app.config))
+
+    @app.errorhandler(ExecutionTimeout)
+    @app.errorhandler(ConnectionFailure)
+    def database_unavailable(error):
+        """A query ran past its budget or no server could be reached in time"""
+        print(f"Database unavailable on {request.path}: {error.__class__.__name__}: {error}")
+        message = 'The library is busy right now, please try again shortly.'
+        if request.path.startswith('/api/'):
+            response = jsonify({'status': 'error', 'message': message})
+        else:
+            response = current_app.response_class(message, mimetype='text/plain')
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+# Motor client for the async API tier (asgi.py). Created lazily on first use
+# so it binds to the running event loop; motor is only needed when the ASGI
+# tier is deployed.
+_async_client = None
+_async_listeners = []
+
+def add_async_listener(listener):
+    """Register a pymongo command listener for the Motor client (before first use)"""
+    _async_listeners.append(listener)
+
+def get_async_db():
+    """Get the Motor (asyncio) database instance"""
+    global _async_client
+    if _async_client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from config import Config
+        _async_client = AsyncIOMotorClient(Config.MONGO_URI, event_listeners=list(_async_listeners),
+                                           **mongo_client_options(Config))
+    return _async_client.get_default_database()
+
+def close_async_db():
+    """Close the Motor client (ASGI shutdown hook)"""
+    global _async_client
+    if _async_client is not None:
+        _async_client.close()
+        _async_client = None
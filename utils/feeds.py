@@ -0,0 +1,367 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from bson.objectid import ObjectId
+from flask import abort, send_from_directory, url_for
+from pymongo import ReturnDocument, UpdateOne
+from utils.indexes import CATALOG_COLLATION
+from utils.query import author_filter
+from utils.signals import publication_changed, author_changed
+
+# sitemap.xml and Atom feeds for crawlers and feed readers, written as static
+# files to FEEDS_FOLDER and served from disk, so a crawler walking them never
+# reaches MongoDB (or the homepage's /?page=N listing).
+#
+# Files are generated per key:
+#
+#   pages                           sitemaps/pages.xml (homepage, author list)
+#   sitemap:publications:YYYY-MM    sitemaps/publications-YYYY-MM.xml
+#   sitemap:authors:YYYY-MM         sitemaps/authors-YYYY-MM.xml
+#   feed:recent                     feeds/recent.atom
+#   feed:category:<name>            feeds/category/<slug>.atom
+#   feed:author:<name>              feeds/author/<slug>.atom
+#
+# Sitemap shards are months of ObjectId creation time, so a document stays in
+# the same shard for life; sitemap.xml is the index of every shard. Writes
+# only record the keys they touch in `feed_queue` (each publication's keys are
+# kept in `feed_entries`, so moving it to another category or author dirties
+# the old feeds too). `flask wrdc feeds`, run from cron, regenerates the keys
+# queued since its previous run on this host. That run is recorded in the
+# folder's manifest.json, so every host serving its own copy can run it.
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+
+# Limit per sitemap file from the sitemaps.org protocol; bigger shards are split
+MAX_SITEMAP_URLS = 50000
+
+# Queue key requesting a full rebuild (bulk writes and migrations)
+FULL_REBUILD = '*'
+
+# Queued keys are read with this much overlap, covering clock differences between hosts
+QUEUE_OVERLAP = timedelta(minutes=5)
+
+# Queue entries expire after this long; a host whose last run is older rebuilds everything
+QUEUE_RETENTION = timedelta(days=30)
+
+MANIFEST = 'manifest.json'
+
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+
+def slugify(name):
+    """File name for a category or author feed (readable part plus a hash of the exact name)"""
+    readable = _SLUG_RE.sub('-', (name or '').lower()).strip('-')[:60]
+    digest = hashlib.sha1((name or '').encode('utf-8')).hexdigest()[:8]
+    return f"{readable}-{digest}" if readable else digest
+
+def month_of(object_id):
+    return object_id.generation_time.strftime('%Y-%m')
+
+def _month_range(month):
+    """``_id`` range of the ObjectIds created in 'YYYY-MM'"""
+    start = datetime.strptime(month, '%Y-%m')
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return {'$gte': ObjectId.from_datetime(start), '$lt': ObjectId.from_datetime(end)}
+
+def _authors_of(pub):
+    return pub.get('authors') or ([pub['author']] if pub.get('author') else [])
+
+def publication_keys(pub):
+    """Feed and sitemap keys a publication appears under"""
+    keys = {'feed:recent', f"sitemap:publications:{month_of(pub['_id'])}"}
+    if pub.get('category'):
+        keys.add(f"feed:category:{pub['category']}")
+    keys.update(f"feed:author:{name}" for name in _authors_of(pub))
+    return keys
+
+def key_files(key):
+    """Base file name (relative to FEEDS_FOLDER, without extension) for a key"""
+    if key == 'pages':
+        return 'sitemaps/pages'
+    kind, _, rest = key.partition(':')
+    if kind == 'sitemap':
+        collection, _, month = rest.partition(':')
+        return f"sitemaps/{collection}-{month}"
+    if rest == 'recent':
+        return 'feeds/recent'
+    feed_kind, _, name = rest.partition(':')
+    return f"feeds/{feed_kind}/{slugify(name)}"
+
+# -- dirty tracking (signal receivers) ------------------------------------------
+
+def mark_dirty(db, keys):
+    """Queue keys for the next `flask wrdc feeds` run"""
+    now = datetime.utcnow()
+    operations = [UpdateOne({'_id': key}, {'$set': {'changed_at': now}}, upsert=True) for key in keys]
+    if operations:
+        db.feed_queue.bulk_write(operations, ordered=False)
+
+def publication_dirty(db, publication_id):
+    """Queue the keys of one (possibly deleted) publication, before and after the change"""
+    object_id = ObjectId(publication_id)
+    pub = db.publications.find_one({'_id': object_id}, {'category': 1, 'authors': 1, 'author': 1})
+    keys = publication_keys(pub) if pub else set()
+    if keys:
+        previous = db.feed_entries.find_one_and_update({'_id': object_id}, {'$set': {'keys': sorted(keys)}},
+                                                       upsert=True, return_document=ReturnDocument.BEFORE)
+    else:
+        previous = db.feed_entries.find_one_and_delete({'_id': object_id})
+    old = set(previous['keys']) if previous else set()
+    mark_dirty(db, keys | old | {'feed:recent', f"sitemap:publications:{month_of(object_id)}"})
+
+def author_dirty(db, author_id):
+    """Queue the sitemap shard of an author profile"""
+    mark_dirty(db, {f"sitemap:authors:{month_of(ObjectId(author_id))}"})
+
+# -- XML ----------------------------------------------------------------------------
+
+def _iso(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _write_xml(folder, relpath, root):
+    """Write an XML document atomically; readers never see a partial file"""
+    path = os.path.join(folder, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            ET.ElementTree(root).write(f, encoding='utf-8', xml_declaration=True)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _remove(folder, relpath):
+    try:
+        os.remove(os.path.join(folder, relpath))
+    except FileNotFoundError:
+        pass
+
+def _urlset(entries):
+    root = ET.Element('urlset', xmlns=SITEMAP_NS)
+    for location, lastmod in entries:
+        url = ET.SubElement(root, 'url')
+        ET.SubElement(url, 'loc').text = location
+        if lastmod:
+            ET.SubElement(url, 'lastmod').text = _iso(lastmod)
+    return root
+
+def _atom(feed_id, title, alternate, publications, build_url, generated_at):
+    root = ET.Element('feed', xmlns=ATOM_NS)
+    ET.SubElement(root, 'id').text = feed_id
+    ET.SubElement(root, 'title').text = title
+    ET.SubElement(root, 'link', rel='self', type='application/atom+xml', href=feed_id)
+    ET.SubElement(root, 'link', rel='alternate', type='text/html', href=alternate)
+    updated = max((pub.get('updated_at') or pub.get('created_at') or generated_at for pub in publications),
+                  default=generated_at)
+    ET.SubElement(root, 'updated').text = _iso(updated)
+    for pub in publications:
+        link = build_url('main.view_pdf', publication_id=str(pub['_id']))
+        entry = ET.SubElement(root, 'entry')
+        ET.SubElement(entry, 'id').text = link
+        ET.SubElement(entry, 'title').text = pub.get('title') or 'Untitled'
+        ET.SubElement(entry, 'link', rel='alternate', type='text/html', href=link)
+        created = pub.get('created_at') or pub['_id'].generation_time.replace(tzinfo=None)
+        ET.SubElement(entry, 'published').text = _iso(created)
+        ET.SubElement(entry, 'updated').text = _iso(pub.get('updated_at') or created)
+        for name in _authors_of(pub):
+            ET.SubElement(ET.SubElement(entry, 'author'), 'name').text = name
+        if pub.get('category'):
+            ET.SubElement(entry, 'category', term=pub['category'])
+    return root
+
+# -- generation ---------------------------------------------------------------------
+
+FEED_PROJECTION = {'title': 1, 'authors': 1, 'author': 1, 'category': 1, 'created_at': 1, 'updated_at': 1}
+
+def _generate(db, folder, key, build_url, max_entries, generated_at):
+    """Write the file(s) for one key; returns their relative paths (empty once the key has no content)"""
+    base = key_files(key)
+    if key == 'pages':
+        _write_xml(folder, base + '.xml', _urlset([(build_url('main.index'), None), (build_url('main.authors'), None)]))
+        return [base + '.xml']
+
+    kind, _, rest = key.partition(':')
+    if kind == 'sitemap':
+        collection, _, month = rest.partition(':')
+        endpoint, argument = (('main.view_pdf', 'publication_id') if collection == 'publications'
+                              else ('main.author_info', 'author_id'))
+        cursor = db[collection].find({'_id': _month_range(month)}, {'updated_at': 1}).sort('_id', 1)
+        files, entries = [], []
+        for doc in cursor:
+            entries.append((build_url(endpoint, **{argument: str(doc['_id'])}), doc.get('updated_at')))
+            if len(entries) == MAX_SITEMAP_URLS:
+                files.append(f"{base}-{len(files) + 1}.xml" if files else base + '.xml')
+                _write_xml(folder, files[-1], _urlset(entries))
+                entries = []
+        if entries:
+            files.append(f"{base}-{len(files) + 1}.xml" if files else base + '.xml')
+            _write_xml(folder, files[-1], _urlset(entries))
+        return files
+
+    if rest == 'recent':
+        cursor = db.publications.find({}, FEED_PROJECTION)
+        title, alternate = 'WRDC Digital Library: new publications', build_url('main.index')
+    else:
+        feed_kind, _, name = rest.partition(':')
+        if feed_kind == 'category':
+            query = {'category': name}
+            title, alternate = f"WRDC Digital Library: {name}", build_url('main.index', category=name)
+        else:
+            query = author_filter(name)
+            title, alternate = f"WRDC Digital Library: publications by {name}", build_url('main.index', author=name)
+        cursor = db.publications.find(query, FEED_PROJECTION).collation(CATALOG_COLLATION)
+    publications = list(cursor.sort('created_at', -1).limit(max_entries))
+    if not publications:
+        return []
+    _write_xml(folder, base + '.atom',
+               _atom(build_url('feeds', filename=base.split('/', 1)[1] + '.atom'), title, alternate,
+                     publications, build_url, generated_at))
+    return [base + '.atom']
+
+def _all_keys(db):
+    """Every key with content, from the catalog; refreshes `feed_entries` on the way"""
+    keys = {'pages', 'feed:recent'}
+    operations = []
+    for pub in db.publications.find({}, {'category': 1, 'authors': 1, 'author': 1}):
+        pub_keys = publication_keys(pub)
+        keys |= pub_keys
+        operations.append(UpdateOne({'_id': pub['_id']}, {'$set': {'keys': sorted(pub_keys)}}, upsert=True))
+        if len(operations) >= 500:
+            db.feed_entries.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.feed_entries.bulk_write(operations, ordered=False)
+    for author in db.authors.find({}, {'_id': 1}):
+        keys.add(f"sitemap:authors:{month_of(author['_id'])}")
+    return keys
+
+def load_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST)
+    with open(path + '.part', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.part', path)
+
+def _write_index(folder, manifest, build_url):
+    root = ET.Element('sitemapindex', xmlns=SITEMAP_NS)
+    for key in sorted(manifest['keys']):
+        if key != 'pages' and not key.startswith('sitemap:'):
+            continue
+        for relpath in manifest['keys'][key]['files']:
+            sitemap = ET.SubElement(root, 'sitemap')
+            ET.SubElement(sitemap, 'loc').text = build_url('sitemaps', filename=relpath.split('/', 1)[1])
+            ET.SubElement(sitemap, 'lastmod').text = manifest['keys'][key]['generated_at']
+    _write_xml(folder, 'sitemap.xml', root)
+
+def build_feeds(db, folder, build_url, full=False, max_entries=50, log=print):
+    """Regenerate the sitemap and feed files whose content may have changed
+
+    ``build_url(endpoint, **values)`` must return absolute URLs (see
+    site_url_builder). Without ``full``, only keys queued since this
+    folder's previous run are rebuilt. Returns the number of keys rebuilt.
+    """
+    started = datetime.utcnow()
+    manifest = load_manifest(folder)
+    last_run = datetime.strptime(manifest['generated_at'], '%Y-%m-%dT%H:%M:%SZ') if manifest else None
+    if last_run is None or last_run < started - QUEUE_RETENTION:
+        full = True
+    if not full:
+        keys = {doc['_id'] for doc in db.feed_queue.find({'changed_at': {'$gte': last_run - QUEUE_OVERLAP}}, {'_id': 1})}
+        full = FULL_REBUILD in keys
+    if full:
+        keys = _all_keys(db)
+        # Keys that no longer have content (their files are removed below)
+        keys |= set((manifest or {}).get('keys', {}))
+    manifest = manifest or {'keys': {}}
+
+    generated = removed = 0
+    sitemaps_changed = full
+    for key in sorted(keys):
+        old_files = set(manifest['keys'].get(key, {}).get('files', []))
+        files = _generate(db, folder, key, build_url, max_entries, started)
+        for relpath in old_files - set(files):
+            _remove(folder, relpath)
+        if files:
+            manifest['keys'][key] = {'files': files, 'generated_at': _iso(started)}
+            generated += 1
+        elif manifest['keys'].pop(key, None) is not None:
+            removed += 1
+        sitemaps_changed = sitemaps_changed or key == 'pages' or key.startswith('sitemap:')
+
+    if sitemaps_changed:
+        _write_index(folder, manifest, build_url)
+    manifest['generated_at'] = _iso(started)
+    _save_manifest(folder, manifest)
+    log(f"Feeds: {'full rebuild, ' if full else ''}{generated} key(s) written, {removed} removed")
+    return generated + removed
+
+def site_url_builder(app):
+    """``url_for``-like function producing absolute URLs under SITE_URL, usable outside requests"""
+    site = urlsplit(app.config['SITE_URL'])
+    adapter = app.url_map.bind(site.netloc, script_name=site.path or '/', url_scheme=site.scheme or 'https')
+
+    def build(endpoint, **values):
+        return adapter.build(endpoint, {key: value for key, value in values.items() if value is not None},
+                             force_external=True)
+    return build
+
+def feeds_folder(app):
+    return os.path.join(app.root_path, app.config['FEEDS_FOLDER'])
+
+def feed_url(kind, name=None):
+    """URL of the Atom feed for 'recent', or for a 'category' or 'author' name"""
+    filename = 'recent.atom' if kind == 'recent' else f"{kind}/{slugify(name)}.atom"
+    return url_for('feeds', filename=filename)
+
+def init_feeds(app):
+    """Serve the generated files, register feed_url() and queue feed changes on catalog writes"""
+    from utils.db import mongo
+    folder = feeds_folder(app)
+    max_age = app.config['FEEDS_CACHE_SECONDS']
+
+    def send(relpath, mimetype):
+        # Conditional GETs are answered from the file's mtime (Last-Modified) and ETag
+        if relpath.endswith(('.part', MANIFEST)):
+            abort(404)
+        return send_from_directory(folder, relpath, mimetype=mimetype, max_age=max_age)
+
+    app.add_url_rule('/sitemap.xml', 'sitemap_index', lambda: send('sitemap.xml', 'application/xml'))
+    app.add_url_rule('/sitemaps/<path:filename>', 'sitemaps',
+                     lambda filename: send(f"sitemaps/{filename}", 'application/xml'))
+    app.add_url_rule('/feeds/<path:filename>', 'feeds',
+                     lambda filename: send(f"feeds/{filename}", 'application/atom+xml'))
+    app.add_template_global(feed_url)
+
+    def on_publication_changed(sender, op=None, id=None, **extra):
+        try:
+            if id is None:
+                mark_dirty(mongo.db, {FULL_REBUILD})
+            else:
+                publication_dirty(mongo.db, id)
+        except Exception as e:
+            print(f"Could not queue feed update for {id}: {e}")
+
+    def on_author_changed(sender, op=None, id=None, **extra):
+        try:
+            if id is None:
+                mark_dirty(mongo.db, {FULL_REBUILD})
+            else:
+                author_dirty(mongo.db, id)
+        except Exception as e:
+            print(f"Could not queue sitemap update for author {id}: {e}")
+
+    publication_changed.connect(on_publication_changed, weak=False)
+    author_changed.connect(on_author_changed, weak=False)
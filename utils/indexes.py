@@ -0,0 +1,190 @@
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+# Case-insensitive collation used by catalog queries (homepage, author pages, API
+# listing). String equality and sorts can only use an index built with the same
+# collation, so every catalog query must pass it.
+CATALOG_COLLATION = {'locale': 'en', 'strength': 2}
+
+class IndexSpec:
+    """Declarative description of one index on a collection"""
+
+    # Index options that are compared against list_indexes() output
+    OPTION_KEYS = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression', 'collation')
+
+    def __init__(self, collection, keys, name=None, **options):
+        if isinstance(keys, str):
+            keys = [(keys, ASCENDING)]
+        self.collection = collection
+        self.keys = list(keys)
+        self.name = name or '_'.join(f"{field}_{direction}" for field, direction in self.keys)
+        self.options = options
+
+    @property
+    def is_text(self):
+        return any(direction == TEXT for _, direction in self.keys)
+
+    def matches(self, existing):
+        """Check whether an index document from list_indexes() matches this spec"""
+        if self.is_text:
+            # Text indexes are stored as _fts/_ftsx keys; compare the indexed fields instead
+            expected_fields = {field for field, direction in self.keys if direction == TEXT}
+            if set(existing.get('weights', {})) != expected_fields:
+                return False
+        elif list(existing['key'].items()) != self.keys:
+            return False
+
+        for option in self.OPTION_KEYS:
+            expected = self.options.get(option)
+            actual = existing.get(option)
+            if option == 'collation' and expected and actual:
+                # The server fills in defaults for every collation field; compare only what we set
+                actual = {k: actual.get(k) for k in expected}
+            if option == 'unique':
+                expected, actual = bool(expected), bool(actual)
+            if expected != actual:
+                return False
+        return True
+
+    def create(self, db):
+        db[self.collection].create_index(self.keys, name=self.name, **self.options)
+
+    def __repr__(self):
+        return f"<IndexSpec {self.collection}.{self.name}>"
+
+# Every index the application relies on. Change this list (not init_db) to add,
+# alter or remove an index, then run `flask wrdc indexes` to apply the change.
+INDEX_SPECS = [
+    # Text index for full-text search (MongoDB allows only one text index per collection)
+    IndexSpec('publications', [('title', TEXT), ('category', TEXT), ('author', TEXT)],
+              name='title_text_category_text_author_text'),
+    IndexSpec('publications', 'author'),
+    IndexSpec('publications', 'category'),
+    IndexSpec('publications', 'publish_date'),
+    IndexSpec('publications', 'created_at'),
+    # Year histograms group on it without reading the documents
+    IndexSpec('publications', 'publish_year'),
+    
+    # Compound catalog indexes: equality fields first, then the sort field,
+    # then the publish_date range (checked on the index keys while scanning in
+    # title order). Designed from the query shapes listed in utils/query_plans.py.
+    IndexSpec('publications', [('title', ASCENDING), ('publish_date', ASCENDING)],
+              name='title_1_publish_date_1_ci', collation=CATALOG_COLLATION),
+    IndexSpec('publications', [('category', ASCENDING), ('title', ASCENDING), ('publish_date', ASCENDING)],
+              name='category_1_title_1_publish_date_1_ci', collation=CATALOG_COLLATION),
+    IndexSpec('publications', [('category', ASCENDING), ('publish_date', ASCENDING), ('title', ASCENDING)],
+              name='category_1_publish_date_1_title_1_ci', collation=CATALOG_COLLATION),
+    # Collated publish_date sorts cannot use the simple-collation publish_date_1
+    IndexSpec('publications', [('publish_date', ASCENDING), ('title', ASCENDING)],
+              name='publish_date_1_title_1_ci', collation=CATALOG_COLLATION),
+    IndexSpec('publications', [('authors', ASCENDING), ('title', ASCENDING)],
+              name='authors_1_title_1_ci', collation=CATALOG_COLLATION),
+    IndexSpec('publications', [('author', ASCENDING), ('title', ASCENDING)],
+              name='author_1_title_1_ci', collation=CATALOG_COLLATION),
+    IndexSpec('publications', [('authors', ASCENDING), ('publish_date', DESCENDING)],
+              name='authors_1_publish_date_-1_ci', collation=CATALOG_COLLATION),
+    IndexSpec('publications', [('author', ASCENDING), ('publish_date', DESCENDING)],
+              name='author_1_publish_date_-1_ci', collation=CATALOG_COLLATION),
+    
+    IndexSpec('users', 'username', unique=True),
+    IndexSpec('users', 'email', unique=True),
+    IndexSpec('authors', 'name'),
+    IndexSpec('authors', 'created_at'),
+    
+    # Incremental backups select documents written since the last snapshot
+    IndexSpec('publications', 'updated_at'),
+    IndexSpec('authors', 'updated_at'),
+    IndexSpec('users', 'updated_at'),
+    IndexSpec('favorites', 'created_at'),
+    
+    # One document per (user, publication): membership checks are covered by
+    # the unique index, listings page through user_id + created_at
+    IndexSpec('favorites', [('user_id', ASCENDING), ('publication_id', ASCENDING)], unique=True),
+    IndexSpec('favorites', [('user_id', ASCENDING), ('created_at', DESCENDING)]),
+    IndexSpec('favorites', 'publication_id'),
+    
+    # Analytics buckets: one document per (hour|day, publication); trending
+    # and rollups scan a time range, so the bucket time leads
+    IndexSpec('analytics_hourly', [('hour', ASCENDING), ('publication_id', ASCENDING)], unique=True),
+    IndexSpec('analytics_daily', [('day', ASCENDING), ('publication_id', ASCENDING)], unique=True),
+    
+    # Feed runs read the keys queued since their previous run; entries expire after 30 days
+    IndexSpec('feed_queue', 'changed_at', expireAfterSeconds=30 * 24 * 3600),
+    # Category feeds list a category's newest publications
+    IndexSpec('publications', [('category', ASCENDING), ('created_at', DESCENDING)],
+              name='category_1_created_at_-1_ci', collation=CATALOG_COLLATION),
+    
+    # Workers pull spelling vocabulary changes by time
+    IndexSpec('spelling_vocabulary', 'updated_at'),
+    
+    # Latest-snapshot lookups sort on as_of; snapshots expire after 7 days
+    IndexSpec('stats_snapshots', 'as_of', expireAfterSeconds=7 * 24 * 3600),
+]
+
+# Indexes superseded by entries of INDEX_SPECS; `flask wrdc indexes` drops them
+RETIRED_INDEXES = [
+    # Replaced by the title-first indexes that carry publish_date as a trailing key
+    IndexSpec('publications', [('title', ASCENDING)], name='title_1_ci', collation=CATALOG_COLLATION),
+    IndexSpec('publications', [('category', ASCENDING), ('title', ASCENDING)],
+              name='category_1_title_1_ci', collation=CATALOG_COLLATION),
+]
+
+def diff_indexes(db, specs=None):
+    """Compare index specs against the server
+
+    Returns a list of ``(spec, status)`` pairs where status is ``'missing'``,
+    ``'changed'`` or (without explicit ``specs``) ``'retired'`` for a
+    RETIRED_INDEXES entry still on the server. Indexes that already match
+    are left out.
+    """
+    retired = RETIRED_INDEXES if specs is None else []
+    specs = INDEX_SPECS if specs is None else specs
+    existing_by_collection = {}
+    differences = []
+    for spec in specs:
+        if spec.collection not in existing_by_collection:
+            existing_by_collection[spec.collection] = {
+                index['name']: index for index in db[spec.collection].list_indexes()
+            }
+        existing = existing_by_collection[spec.collection]
+
+        current = existing.get(spec.name)
+        if current is None and spec.is_text:
+            # Only one text index is allowed; a differently named one counts as changed
+            current = next((index for index in existing.values() if '_fts' in index['key']), None)
+
+        if current is None:
+            differences.append((spec, 'missing'))
+        elif not spec.matches(current):
+            differences.append((spec, 'changed'))
+    for spec in retired:
+        if any(index['name'] == spec.name for index in db[spec.collection].list_indexes()):
+            differences.append((spec, 'retired'))
+    return differences
+
+def ensure_indexes(db, specs=None, log=print):
+    """Create missing indexes, rebuild changed ones and drop retired ones; matching indexes are untouched"""
+    differences = diff_indexes(db, specs)
+    for spec, status in differences:
+        if status == 'retired':
+            log(f"Dropping retired index {spec.collection}.{spec.name}")
+            db[spec.collection].drop_index(spec.name)
+            continue
+        if status == 'changed':
+            log(f"Rebuilding changed index {spec.collection}.{spec.name}")
+            collection = db[spec.collection]
+            for index in collection.list_indexes():
+                same_text_slot = spec.is_text and '_fts' in index['key']
+                if index['name'] == spec.name or same_text_slot:
+                    collection.drop_index(index['name'])
+        else:
+            log(f"Creating index {spec.collection}.{spec.name}")
+        spec.create(db)
+    return differences
+
+def verify_indexes(db, specs=None, log=print):
+    """Report missing, changed or retired indexes without changing anything"""
+    differences = diff_indexes(db, specs)
+    for spec, status in differences:
+        action = 'drop' if status == 'retired' else 'build'
+        log(f"⚠️  Index {spec.collection}.{spec.name} is {status}; run 'flask wrdc indexes' to {action} it")
+    return differences
@@ -0,0 +1,245 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo.errors import OperationFailure, PyMongoError
+from utils.signals import SIGNALS_BY_COLLECTION, catalog_invalidated
+
+# Cross-process invalidation of in-process caches. The catalog signals only
+# reach receivers in the process that made the write, so per-worker caches
+# (the LRU cache backend, the spelling index, ...) in other gunicorn workers
+# and on other nodes would keep serving stale data until their TTL ran out.
+#
+# Each worker runs one ChangeListener thread that tails `publications`,
+# `authors` and `users` with a database change stream and sends
+# `catalog_invalidated` for every change, in every process. The resume token
+# is stored in `invalidation_state` (one document per host, see
+# INVALIDATION_LISTENER_ID), so a restarted worker first replays the changes
+# it missed; that matters for caches that outlive the process, like the
+# filesystem backend. When the token is too old to resume from, everything
+# is invalidated once.
+#
+# Change streams need a replica set or sharded cluster. Against a standalone
+# mongod the listener polls instead: one event per document whose
+# `updated_at` moved since the last poll. The collection's version counter in
+# `collection_versions` moves once per model write; a collection-wide event is
+# sent only when it moved more than those documents explain (deletes, writes
+# that don't touch `updated_at`), since receivers such as the catalog snapshot
+# treat one as a bulk change.
+
+WATCHED_COLLECTIONS = tuple(SIGNALS_BY_COLLECTION)
+
+_OPERATIONS = {'insert': 'create', 'update': 'update', 'replace': 'update', 'delete': 'delete'}
+
+# Server error codes meaning change streams are not available on this deployment
+_UNSUPPORTED_CODES = {40573, 40324}
+
+# The stored resume token is no longer in the oplog
+_HISTORY_LOST_CODES = {286, 280, 136}
+
+# Polls read `updated_at` with this much overlap, covering clock differences between hosts
+POLL_OVERLAP = timedelta(seconds=5)
+
+# The resume token is written back at most this often
+TOKEN_SAVE_SECONDS = 10
+
+def publish(collection, op=None, id=None, fields=None):
+    """Send `catalog_invalidated` to this process's receivers
+
+    ``fields`` lists the top-level fields an update touched, when known.
+    """
+    try:
+        catalog_invalidated.send(ChangeListener, collection=collection, op=op, id=id, fields=fields)
+    except Exception as e:
+        print(f"Cache invalidation for {collection} failed: {e}")
+
+def publish_all():
+    """Invalidate everything derived from the watched collections"""
+    for collection in WATCHED_COLLECTIONS:
+        publish(collection)
+
+class ChangeListener:
+    """Background thread turning catalog writes from any process into `catalog_invalidated` signals"""
+
+    def __init__(self, db, listener_id=None, poll_interval=5, max_await_ms=1000):
+        self.db = db
+        self.listener_id = listener_id or socket.gethostname()
+        self.poll_interval = poll_interval
+        self.max_await_ms = max_await_ms
+        self.mode = None
+        self.pid = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    # -- lifecycle ------------------------------------------------------------
+
+    def start(self):
+        """Start the thread once per process (safe to call on every request)"""
+        if self.pid == os.getpid():
+            return False
+        with self._lock:
+            if self.pid == os.getpid():
+                return False
+            # A listener inherited through fork() has no thread in this process
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='cache-invalidation', daemon=True)
+            self._thread.start()
+            self.pid = os.getpid()
+            return True
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                if self.mode == 'poll':
+                    self._poll()
+                else:
+                    self._watch()
+                delay = 1
+            except OperationFailure as e:
+                if e.code in _UNSUPPORTED_CODES and self.mode != 'poll':
+                    print(f"Change streams unavailable ({e}); polling every {self.poll_interval}s")
+                    self.mode = 'poll'
+                    continue
+                print(f"Cache invalidation listener error: {e}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 60)
+            except PyMongoError as e:
+                print(f"Cache invalidation listener error: {e}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 60)
+
+    # -- state ----------------------------------------------------------------
+
+    def _load_state(self):
+        return self.db.invalidation_state.find_one({'_id': self.listener_id}) or {}
+
+    def _save_state(self, **fields):
+        fields['updated_at'] = datetime.utcnow()
+        self.db.invalidation_state.update_one({'_id': self.listener_id}, {'$set': fields}, upsert=True)
+
+    # -- change streams -------------------------------------------------------
+
+    def _pipeline(self):
+        return [
+            {'$match': {'ns.coll': {'$in': list(WATCHED_COLLECTIONS)},
+                        'operationType': {'$in': list(_OPERATIONS) + ['drop', 'rename']}}},
+            # The document key and the names of updated fields, not their values
+            {'$project': {'operationType': 1, 'ns': 1, 'documentKey': 1, 'fields': {'$concatArrays': [
+                {'$map': {'input': {'$objectToArray': {'$ifNull': ['$updateDescription.updatedFields', {}]}},
+                          'in': '$$this.k'}},
+                {'$ifNull': ['$updateDescription.removedFields', []]},
+                {'$map': {'input': {'$ifNull': ['$updateDescription.truncatedArrays', []]}, 'in': '$$this.field'}},
+            ]}}},
+        ]
+
+    def _watch(self):
+        token = self._load_state().get('resume_token')
+        try:
+            self._tail(token)
+        except OperationFailure as e:
+            if token is None or e.code not in _HISTORY_LOST_CODES:
+                raise
+            print("Stored resume token expired; invalidating all cached catalog data")
+            self._reset()
+
+    def _reset(self):
+        publish_all()
+        self._save_state(resume_token=None)
+
+    def _tail(self, token):
+        with self.db.watch(self._pipeline(), resume_after=token, max_await_time_ms=self.max_await_ms) as stream:
+            self.mode = 'watch'
+            saved_at = time.monotonic()
+            while not self._stop.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None and change['operationType'] == 'invalidate':
+                    # The database was dropped or renamed; the stream cannot be resumed
+                    self._reset()
+                    return
+                if change is not None:
+                    self._publish_change(change)
+                # Advances while idle too (post-batch token), keeping it inside the oplog window
+                if stream.resume_token is not None and time.monotonic() - saved_at >= TOKEN_SAVE_SECONDS:
+                    self._save_state(resume_token=stream.resume_token)
+                    saved_at = time.monotonic()
+            if stream.resume_token is not None:
+                self._save_state(resume_token=stream.resume_token)
+
+    def _publish_change(self, change):
+        collection = change['ns']['coll']
+        operation = change['operationType']
+        if operation == 'update':
+            fields = change.get('fields')
+            if fields is not None:
+                fields = sorted({path.split('.', 1)[0] for path in fields})
+            publish(collection, 'update', str(change['documentKey']['_id']), fields)
+        elif operation in _OPERATIONS:
+            publish(collection, _OPERATIONS[operation], str(change['documentKey']['_id']))
+        else:
+            publish(collection)
+
+    # -- polling --------------------------------------------------------------
+
+    def _poll(self):
+        state = self._load_state()
+        since = state.get('polled_at') or datetime.utcnow()
+        versions = {doc['_id']: doc.get('version') for doc in
+                    self.db.collection_versions.find({'_id': {'$in': list(WATCHED_COLLECTIONS)}}, {'version': 1})}
+        # (collection, _id) -> updated_at already published, so the overlap doesn't repeat events
+        seen = {}
+        # Published documents whose version bump may only show up in the next poll
+        unmatched = {}
+        while not self._stop.is_set():
+            started = datetime.utcnow()
+            window = since - POLL_OVERLAP
+            published = {}
+            for collection in WATCHED_COLLECTIONS:
+                for doc in self.db[collection].find({'updated_at': {'$gte': window}}, {'updated_at': 1}):
+                    if seen.get((collection, doc['_id'])) != doc['updated_at']:
+                        seen[(collection, doc['_id'])] = doc['updated_at']
+                        published[collection] = published.get(collection, 0) + 1
+                        publish(collection, 'update', str(doc['_id']))
+            seen = {key: updated_at for key, updated_at in seen.items() if updated_at >= window}
+            for doc in self.db.collection_versions.find({'_id': {'$in': list(WATCHED_COLLECTIONS)}}, {'version': 1}):
+                collection, version = doc['_id'], doc.get('version') or 0
+                writes = version - (versions.get(collection) or 0)
+                versions[collection] = version
+                explained = published.get(collection, 0) + unmatched.get(collection, 0)
+                if writes > explained:
+                    publish(collection)
+                unmatched[collection] = max(0, published.get(collection, 0) - max(0, writes - unmatched.get(collection, 0)))
+            since = started
+            self._save_state(polled_at=since)
+            self._stop.wait(self.poll_interval)
+
+def start_listener(app):
+    """Start the app's listener in the current process, if it is enabled"""
+    listener = app.extensions.get('wrdc_invalidation')
+    if listener is not None:
+        listener.start()
+
+def init_invalidation(app):
+    """Create the listener (app.extensions['wrdc_invalidation']), started by the first request in each process
+
+    Starting lazily keeps CLI commands and the gunicorn master from running it.
+    """
+    if not app.config['INVALIDATION_LISTENER_ENABLED']:
+        return
+    from utils.db import mongo
+    app.extensions['wrdc_invalidation'] = ChangeListener(
+        mongo.db,
+        listener_id=app.config['INVALIDATION_LISTENER_ID'],
+        poll_interval=app.config['INVALIDATION_POLL_SECONDS'],
+    )
+
+    @app.before_request
+    def start_invalidation_listener():
+        start_listener(app)
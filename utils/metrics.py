@@ -0,0 +1,505 @@
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import Response, abort, g, request
+from pymongo import monitoring
+
+# Prometheus-style metrics kept in process memory. Every update is a dict
+# lookup plus a few additions under a lock, so recording stays in the low
+# microseconds per request. Exposed in text format at /metrics.
+#
+# Under gunicorn each worker has its own registry. With METRICS_MULTIPROC_DIR
+# set, workers flush their values to a file there every few seconds and
+# /metrics adds up the files of every worker, live or recycled (see
+# MultiprocessStore below).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+class Counter:
+    """Monotonic counter with optional labels"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def values(self):
+        """``(label_values, value)`` pairs"""
+        with self._lock:
+            return list(self._values.items())
+
+    def samples(self):
+        for label_values, value in self.values():
+            yield self.name + _format_labels(self.labels, label_values), value
+
+class Gauge(Counter):
+    """Value that can go up and down, or be computed at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), func=None):
+        super().__init__(name, help, labels)
+        self._func = func
+
+    def set(self, *label_values, value):
+        with self._lock:
+            self._values[label_values] = value
+
+    def values(self):
+        if self._func is not None:
+            return list(self._func())
+        return super().values()
+
+class Histogram:
+    """Histogram with fixed upper bounds, in the Prometheus exposition layout"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*label_values, value=time.perf_counter() - start)
+
+    def add(self, label_values, entry):
+        """Add another histogram's ``[bucket_counts, sum, count]`` for these labels"""
+        with self._lock:
+            current = self._values.get(label_values)
+            if current is None:
+                current = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            current[0] = [a + b for a, b in zip(current[0], entry[0])]
+            current[1] += entry[1]
+            current[2] += entry[2]
+
+    def values(self):
+        """``(label_values, [bucket_counts, sum, count])`` pairs"""
+        with self._lock:
+            return [(k, [list(v[0]), v[1], v[2]]) for k, v in self._values.items()]
+
+    def samples(self):
+        for label_values, (counts, total, count) in self.values():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield self.name + '_bucket' + _format_labels(self.labels, label_values, ('le', le)), cumulative
+            yield self.name + '_sum' + _format_labels(self.labels, label_values), total
+            yield self.name + '_count' + _format_labels(self.labels, label_values), count
+
+class Registry:
+    """Collection of metrics rendered together at /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def dump(self):
+        """Every metric's values, JSON-ready"""
+        return {metric.name: [[list(label_values), value] for label_values, value in metric.values()]
+                for metric in self._metrics}
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {value}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram(
+    'wrdc_http_request_duration_seconds', 'Request latency by endpoint',
+    labels=('endpoint', 'method'))
+REQUESTS = registry.counter(
+    'wrdc_http_requests_total', 'Requests by endpoint and status code',
+    labels=('endpoint', 'method', 'status'))
+RESPONSE_SIZE = registry.histogram(
+    'wrdc_http_response_size_bytes', 'Response body size by endpoint',
+    labels=('endpoint',), buckets=SIZE_BUCKETS)
+MONGO_COMMANDS = registry.histogram(
+    'wrdc_mongo_commands_per_request', 'MongoDB commands issued per request',
+    labels=('endpoint',), buckets=COUNT_BUCKETS)
+MONGO_SECONDS = registry.histogram(
+    'wrdc_mongo_seconds_per_request', 'Time spent in MongoDB commands per request',
+    labels=('endpoint',))
+MONGO_COMMANDS_BY_NAME = registry.counter(
+    'wrdc_mongo_commands_total', 'MongoDB commands by command name and outcome',
+    labels=('command', 'outcome'))
+UPLOAD_PROCESSING = registry.histogram(
+    'wrdc_upload_processing_seconds', 'Upload processing time by step',
+    labels=('step',))
+CACHE_REQUESTS = registry.counter(
+    'wrdc_cache_requests_total', 'Cache lookups by cache name and result',
+    labels=('cache', 'result'))
+
+def _cache_hit_ratios():
+    caches = {name for name, _ in CACHE_REQUESTS._values}
+    for name in sorted(caches):
+        hits = CACHE_REQUESTS.get(name, 'hit')
+        total = hits + CACHE_REQUESTS.get(name, 'miss')
+        yield (name,), (hits / total if total else 0.0)
+
+CACHE_HIT_RATIO = registry.gauge(
+    'wrdc_cache_hit_ratio', 'Cache hit ratio since process start',
+    labels=('cache',), func=_cache_hit_ratios)
+
+def record_cache(cache, hit):
+    """Record one cache lookup"""
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+# Per-thread accumulator for the request currently being served
+_current = threading.local()
+
+class RequestCommandListener(monitoring.CommandListener):
+    """Attributes MongoDB command count and time to the current request"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, 'ok')
+
+    def failed(self, event):
+        self._record(event, 'error')
+
+    def _record(self, event, outcome):
+        MONGO_COMMANDS_BY_NAME.inc(event.command_name, outcome)
+        stats = getattr(_current, 'stats', None)
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += event.duration_micros / 1e6
+
+command_listener = RequestCommandListener()
+
+MONGO_POOL_CHECKOUT_WAIT = registry.histogram(
+    'wrdc_mongo_pool_checkout_wait_seconds', 'Time spent waiting to check a connection out of the pool',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5))
+MONGO_POOL_CHECKOUT_FAILURES = registry.counter(
+    'wrdc_mongo_pool_checkout_failures_total', 'Failed connection checkouts by reason',
+    labels=('reason',))
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Tracks open and checked-out connections per server for pool utilization"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.pools = {}  # address -> {'max': int, 'open': int, 'checked_out': int}
+
+    def _pool(self, address):
+        return self.pools.setdefault(f"{address[0]}:{address[1]}",
+                                     {'max': 0, 'open': 0, 'checked_out': 0})
+
+    def _adjust(self, address, key, delta):
+        with self._lock:
+            pool = self._pool(address)
+            pool[key] = max(0, pool[key] + delta)
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)['max'] = event.options.get('maxPoolSize', 100)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self.pools.pop(f"{event.address[0]}:{event.address[1]}", None)
+
+    def connection_created(self, event):
+        self._adjust(event.address, 'open', 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._adjust(event.address, 'open', -1)
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_start = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._local.checkout_start = None
+        MONGO_POOL_CHECKOUT_FAILURES.inc(event.reason)
+
+    def connection_checked_out(self, event):
+        start = getattr(self._local, 'checkout_start', None)
+        if start is not None:
+            MONGO_POOL_CHECKOUT_WAIT.observe(value=time.perf_counter() - start)
+            self._local.checkout_start = None
+        self._adjust(event.address, 'checked_out', 1)
+
+    def connection_checked_in(self, event):
+        self._adjust(event.address, 'checked_out', -1)
+
+    def snapshot(self):
+        """Copy of the per-server pool counters"""
+        with self._lock:
+            return {address: dict(pool) for address, pool in self.pools.items()}
+
+pool_listener = PoolMetricsListener()
+
+def _pool_connections():
+    for address, pool in sorted(pool_listener.snapshot().items()):
+        yield (address, 'open'), pool['open']
+        yield (address, 'checked_out'), pool['checked_out']
+
+def _pool_utilization():
+    for address, pool in sorted(pool_listener.snapshot().items()):
+        yield (address,), (pool['checked_out'] / pool['max'] if pool['max'] else 0.0)
+
+MONGO_POOL_CONNECTIONS = registry.gauge(
+    'wrdc_mongo_pool_connections', 'Connections per server by state',
+    labels=('address', 'state'), func=_pool_connections)
+MONGO_POOL_UTILIZATION = registry.gauge(
+    'wrdc_mongo_pool_utilization', 'Checked-out connections as a fraction of maxPoolSize',
+    labels=('address',), func=_pool_utilization)
+
+def current_request_stats():
+    """Get ``[command_count, command_seconds]`` for the request on this thread"""
+    return getattr(_current, 'stats', None)
+
+def metrics_allowed(config, headers, remote_addr):
+    """Whether a scrape carries METRICS_TOKEN or comes from METRICS_ALLOWED_IPS"""
+    token = config.get('METRICS_TOKEN')
+    if token and hmac.compare_digest(headers.get('Authorization', ''), 'Bearer ' + token):
+        return True
+    try:
+        address = ipaddress.ip_address(remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in config.get('METRICS_ALLOWED_IPS', []))
+
+def merge_dumps(dumps):
+    """A registry holding the sum of the counters and histograms in ``dumps``
+
+    ``dumps`` is a list of ``(pid, Registry.dump())`` pairs. Gauges cannot be
+    added up, so they are kept per process with a ``pid`` label, and only for
+    pairs with a pid (live workers).
+    """
+    merged = Registry()
+    for metric in registry._metrics:
+        if metric.kind == 'histogram':
+            target = merged.histogram(metric.name, metric.help, metric.labels, buckets=metric.buckets)
+        elif metric.kind == 'gauge':
+            target = merged.gauge(metric.name, metric.help, metric.labels + ('pid',))
+        else:
+            target = merged.counter(metric.name, metric.help, metric.labels)
+        for pid, data in dumps:
+            for label_values, value in data.get(metric.name, []):
+                label_values = tuple(label_values)
+                if metric.kind == 'histogram':
+                    target.add(label_values, value)
+                elif metric.kind == 'gauge':
+                    if pid is not None:
+                        target.set(*label_values, str(pid), value=value)
+                else:
+                    target.inc(*label_values, amount=value)
+    return merged
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+# Totals of reaped workers, and the pids whose files they already include
+DEAD_FILE = 'dead.json'
+
+class MultiprocessStore:
+    """Shares the registry between gunicorn workers through files in ``directory``
+
+    Each worker rewrites ``worker-<pid>.json`` every ``flush_interval``
+    seconds, at scrape time and when it exits. When gunicorn reaps a worker,
+    mark_process_dead() folds its counters into ``dead.json`` so totals keep
+    growing across recycles. A worker killed without exiting cleanly loses
+    what it recorded since its last flush.
+    """
+
+    def __init__(self, directory, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start the flush thread once per process (safe to call on every request)"""
+        if self.pid == os.getpid():
+            return False
+        with self._lock:
+            if self.pid == os.getpid():
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            self._stop = threading.Event()
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+            self.pid = os.getpid()
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write this process's values to its file"""
+        try:
+            _write_json(_worker_path(self.directory, os.getpid()), registry.dump())
+        except OSError as e:
+            print(f"Metrics flush failed: {e}")
+
+    def collect(self):
+        """A registry merging every worker's file, this process's values flushed first"""
+        self.flush()
+        # dead.json first: the workers it lists are already in its totals
+        dead = _read_json(os.path.join(self.directory, DEAD_FILE)) or {'pids': [], 'metrics': {}}
+        dumps = [(None, dead['metrics'])]
+        for name in os.listdir(self.directory):
+            if not (name.startswith('worker-') and name.endswith('.json')):
+                continue
+            pid = int(name[len('worker-'):-len('.json')])
+            data = None if pid in dead['pids'] else _read_json(os.path.join(self.directory, name))
+            if data is not None:
+                dumps.append((pid, data))
+        return merge_dumps(dumps)
+
+def _worker_path(directory, pid):
+    return os.path.join(directory, f"worker-{pid}.json")
+
+def mark_process_dead(directory, pid):
+    """Fold a reaped worker's counters and histograms into dead.json (gunicorn's child_exit hook)
+
+    The worker's file stays until the next call, listed in dead.json so
+    scrapes skip it; removing it first would let a scrape read the old
+    dead.json without the file and see the counters drop.
+    """
+    data = _read_json(_worker_path(directory, pid))
+    if data is None:
+        return
+    dead_path = os.path.join(directory, DEAD_FILE)
+    dead = _read_json(dead_path) or {'pids': [], 'metrics': {}}
+    for folded in dead['pids']:
+        if os.path.exists(_worker_path(directory, folded)):
+            os.remove(_worker_path(directory, folded))
+    merged = merge_dumps([(None, dead['metrics']), (None, data)])
+    _write_json(dead_path, {'pids': [pid], 'metrics': merged.dump()})
+
+def clear_multiproc_dir(directory):
+    """Remove the files left by a previous run (gunicorn's on_starting and on_exit hooks)"""
+    if not directory or not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            os.remove(os.path.join(directory, name))
+
+def init_metrics(app):
+    """Install request timing hooks and the /metrics endpoint"""
+    store = None
+    if app.config.get('METRICS_MULTIPROC_DIR'):
+        store = app.extensions['wrdc_metrics_store'] = MultiprocessStore(
+            app.config['METRICS_MULTIPROC_DIR'], app.config['METRICS_FLUSH_SECONDS'])
+
+    @app.before_request
+    def _start_request_timer():
+        if store is not None:
+            # Started lazily, like the invalidation listener, so CLI commands don't run it
+            store.start()
+        g._metrics_start = time.perf_counter()
+        _current.stats = [0, 0.0]
+
+    @app.after_request
+    def _record_request_metrics(response):
+        start = g.pop('_metrics_start', None)
+        stats = getattr(_current, 'stats', None)
+        _current.stats = None
+        if start is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.observe(endpoint, request.method, value=time.perf_counter() - start)
+        REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        if response.content_length is not None:
+            RESPONSE_SIZE.observe(endpoint, value=response.content_length)
+        if stats is not None:
+            MONGO_COMMANDS.observe(endpoint, value=stats[0])
+            MONGO_SECONDS.observe(endpoint, value=stats[1])
+        return response
+
+    def metrics():
+        """Prometheus scrape endpoint"""
+        # Hidden from everyone else
+        if not metrics_allowed(app.config, request.headers, request.remote_addr):
+            abort(404)
+        merged = store.collect() if store is not None else registry
+        return Response(merged.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'), 'metrics', metrics)
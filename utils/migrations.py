@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from utils.query import publish_date_fields
+from utils.signals import SIGNALS_BY_COLLECTION
+
+# Registry of known migrations, ordered by version
+MIGRATIONS = []
+
+class Migration:
+    """A versioned data migration applied in batches to one collection
+
+    ``query`` selects the documents that still need migrating and
+    ``transform`` turns one of those documents into an update document
+    (or ``None`` to leave it untouched). With ``needs_db`` the transform is
+    called as ``transform(db, doc)`` so it can write to other collections;
+    such writes must be idempotent, since a batch may be replayed.
+    """
+
+    def __init__(self, version, description, collection, query, transform, needs_db=False):
+        self.version = version
+        self.description = description
+        self.collection = collection
+        self.query = query
+        self.transform = transform
+        self.needs_db = needs_db
+
+def migration(version, description, collection, query, needs_db=False):
+    """Decorator registering a transform function as a migration"""
+    def decorator(transform):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version: {version}")
+        MIGRATIONS.append(Migration(version, description, collection, query, transform, needs_db))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return transform
+    return decorator
+
+def get_applied(db):
+    """Get records of migrations that have been started or applied, keyed by version"""
+    return {record['_id']: record for record in db.migrations.find()}
+
+def get_pending(db):
+    """Get migrations that have not been fully applied"""
+    applied = get_applied(db)
+    return [m for m in MIGRATIONS
+            if applied.get(m.version, {}).get('status') != 'applied']
+
+def run_migration(db, migration, batch_size=500, log=print):
+    """Apply a single migration in batches, resuming from its last checkpoint"""
+    record = db.migrations.find_one({'_id': migration.version}) or {}
+    if record.get('status') == 'applied':
+        return 0
+
+    checkpoint = record.get('checkpoint')
+    processed = record.get('processed', 0)
+    if checkpoint is not None:
+        log(f"Resuming migration {migration.version} after _id {checkpoint}")
+
+    db.migrations.update_one(
+        {'_id': migration.version},
+        {
+            '$set': {'description': migration.description, 'status': 'running'},
+            '$setOnInsert': {'started_at': datetime.utcnow(), 'processed': 0}
+        },
+        upsert=True
+    )
+
+    collection = db[migration.collection]
+    while True:
+        query = dict(migration.query)
+        if checkpoint is not None:
+            query = {'$and': [migration.query, {'_id': {'$gt': checkpoint}}]}
+        batch = list(collection.find(query).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            update = migration.transform(db, doc) if migration.needs_db else migration.transform(doc)
+            if update:
+                operations.append(UpdateOne({'_id': doc['_id']}, update))
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+
+        # Checkpoint after every batch so a crashed run picks up where it stopped
+        checkpoint = batch[-1]['_id']
+        processed += len(operations)
+        db.migrations.update_one(
+            {'_id': migration.version},
+            {'$set': {'checkpoint': checkpoint, 'processed': processed}}
+        )
+
+    db.migrations.update_one(
+        {'_id': migration.version},
+        {
+            '$set': {'status': 'applied', 'applied_at': datetime.utcnow(), 'processed': processed},
+            '$unset': {'checkpoint': ''}
+        }
+    )
+    signal = SIGNALS_BY_COLLECTION.get(migration.collection)
+    if signal is not None and processed:
+        signal.send(migration, op='update', id=None)
+    return processed
+
+def run_migrations(db, batch_size=500, dry_run=False, log=print):
+    """Apply all pending migrations in version order
+
+    With ``dry_run`` nothing is written; the number of documents each
+    pending migration would touch is reported instead.
+    """
+    results = []
+    for pending in get_pending(db):
+        if dry_run:
+            count = db[pending.collection].count_documents(pending.query)
+            log(f"[dry-run] {pending.version}: {pending.description} - {count} document(s) affected")
+        else:
+            log(f"Applying migration {pending.version}: {pending.description}")
+            count = run_migration(db, pending, batch_size=batch_size, log=log)
+            log(f"✅ Migration {pending.version} applied to {count} document(s)")
+        results.append((pending.version, count))
+    return results
+
+# ---------------------------------------------------------------------------
+# Migrations
+# ---------------------------------------------------------------------------
+
+@migration(
+    version=1,
+    description='Convert single author field to authors array',
+    collection='publications',
+    query={'author': {'$exists': True}, 'authors': {'$exists': False}}
+)
+def authors_to_array(pub):
+    """Convert existing publications with single 'author' field to 'authors' array"""
+    if pub.get('author') and not pub.get('authors'):
+        return {'$set': {'authors': [pub['author']], 'updated_at': datetime.utcnow()}}
+    return None
+
+@migration(
+    version=2,
+    description='Move users.favorites arrays into the favorites collection',
+    collection='users',
+    query={'favorites': {'$exists': True}},
+    needs_db=True
+)
+def favorites_to_collection(db, user):
+    """Upsert one favorites document per array entry, then drop the array
+
+    $addToSet appended new favorites, so later array entries get later
+    created_at values and listings keep the newest-first order.
+    """
+    favorites = user.get('favorites') or []
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne({'user_id': user['_id'], 'publication_id': publication_id},
+                  {'$setOnInsert': {'created_at': now - timedelta(milliseconds=len(favorites) - position)}},
+                  upsert=True)
+        for position, publication_id in enumerate(favorites)
+    ]
+    if operations:
+        db.favorites.bulk_write(operations, ordered=False)
+    return {'$unset': {'favorites': ''}}
+
+@migration(
+    version=3,
+    description='Add updated_at to users (incremental backup watermark)',
+    collection='users',
+    query={'updated_at': {'$exists': False}}
+)
+def users_updated_at(user):
+    """Start a user's updated_at at its creation time"""
+    return {'$set': {'updated_at': user.get('created_at') or datetime.utcnow()}}
+
+@migration(
+    version=4,
+    description='Store publish_date as a BSON date and add publish_year',
+    collection='publications',
+    query={'$or': [{'publish_date': {'$type': 'string'}},
+                   {'publish_date': {'$type': 'date'}, 'publish_year': {'$exists': False}}]}
+)
+def publish_dates_to_bson(pub):
+    """Parse the ISO date string; dates that don't parse are left for manual repair"""
+    try:
+        fields = publish_date_fields(pub['publish_date'])
+    except ValueError:
+        return None
+    return {'$set': dict(fields, updated_at=datetime.utcnow())}
@@ -0,0 +1,96 @@
+import time
+from datetime import datetime, timedelta
+from utils.storage import UPLOAD_KINDS, upload_key
+
+# Garbage collection of uploaded files nothing refers to any more: PDFs and
+# covers replaced through the edit form, pictures of re-uploaded author
+# profiles, leftovers of failed or interrupted requests.
+#
+# Mark and sweep. The mark phase streams the filename fields of
+# `publications` and `authors` into a set of storage keys (one entry per
+# referenced file, whatever the size of the upload folders); the sweep then
+# walks each upload folder through storage.list(), which yields one file at a
+# time, and deletes the files that are not marked. Files written less than
+# the grace period ago are kept: an upload is stored before the document that
+# refers to it, so a fresh unreferenced file may belong to a request still in
+# progress (or to one that started after the mark phase).
+
+# Upload kind -> (collection, field holding the filename)
+UPLOAD_REFERENCES = {
+    'pdfs': ('publications', 'pdf_filename'),
+    'covers': ('publications', 'cover_filename'),
+    'authors': ('authors', 'image'),
+}
+
+# Fallback images that documents point to without owning them
+PROTECTED_KEYS = {upload_key('covers', 'default_cover.jpg'), upload_key('authors', 'default_author.jpg')}
+
+def referenced_keys(db):
+    """Storage keys of every file referenced by a publication or author"""
+    keys = set(PROTECTED_KEYS)
+    for kind, (collection, field) in UPLOAD_REFERENCES.items():
+        for doc in db[collection].find({field: {'$nin': [None, '']}}, {field: 1, '_id': 0}):
+            keys.add(upload_key(kind, doc[field]))
+    return keys
+
+class _RateLimiter:
+    """Spaces calls to wait() at least 1/``per_second`` seconds apart (no limit if falsy)"""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second else 0
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+
+def collect_orphans(db, storage, grace_hours=24, deletes_per_second=10, dry_run=False, now=None, log=print):
+    """Delete stored uploads that no publication or author refers to
+
+    Only files last written more than ``grace_hours`` ago are removed, at
+    most ``deletes_per_second`` per second. With ``dry_run`` nothing is
+    deleted and every file that would be is listed instead. Returns a dict of
+    counts: scanned, referenced, recent, deleted and bytes (freed).
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(hours=grace_hours)
+    marked = referenced_keys(db)
+    log(f"Marked {len(marked)} referenced file(s)")
+
+    limiter = _RateLimiter(None if dry_run else deletes_per_second)
+    stats = {'scanned': 0, 'referenced': 0, 'recent': 0, 'deleted': 0, 'bytes': 0}
+    for kind in UPLOAD_KINDS:
+        for key, size in storage.list(kind + '/'):
+            stats['scanned'] += 1
+            if key in marked:
+                stats['referenced'] += 1
+                continue
+            modified = storage.modified(key)
+            if modified is None:
+                # Removed while we were listing
+                continue
+            if modified > cutoff:
+                stats['recent'] += 1
+                continue
+            if dry_run:
+                log(f"would delete {key} ({size} bytes, written {modified:%Y-%m-%d %H:%M})")
+            else:
+                limiter.wait()
+                try:
+                    storage.delete(key)
+                except Exception as e:
+                    log(f"Could not delete {key}: {e}")
+                    continue
+            stats['deleted'] += 1
+            stats['bytes'] += size
+
+    verb = 'would be deleted' if dry_run else 'deleted'
+    log(f"Uploads: {stats['scanned']} scanned, {stats['referenced']} referenced, "
+        f"{stats['recent']} unreferenced but newer than {grace_hours}h, "
+        f"{stats['deleted']} {verb} ({stats['bytes']} bytes)")
+    return stats
@@ -0,0 +1,185 @@
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from flask import current_app, request
+from pymongo import monitoring
+
+# Development/staging query profiler. Counts MongoDB commands per request,
+# groups them by query shape (the filter with every literal replaced by '?')
+# and reports repeated shapes as likely N+1 lookups together with the route
+# and the application frame that issued them. Commands slower than
+# SLOW_QUERY_MS are logged with their shape.
+
+logger = logging.getLogger('wrdc.profiler')
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SKIP_FILES = (os.path.abspath(__file__),)
+
+# Keys holding the filter of each command we care about
+_FILTER_KEYS = {
+    'find': 'filter', 'count': 'query', 'distinct': 'query', 'findAndModify': 'query',
+    'aggregate': 'pipeline', 'update': 'updates', 'delete': 'deletes',
+}
+
+_local = threading.local()
+
+def query_shape(value):
+    """Replace every literal in a query document with '?'"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Keep every branch of $or/$and and pipeline stages; collapse literal lists
+        if any(isinstance(item, (dict, list, tuple)) for item in value):
+            return [query_shape(item) for item in value]
+        return ['?'] if value else []
+    return '?'
+
+def command_shape(event):
+    """Describe a command as a hashable (command, collection, filter shape) tuple"""
+    command = event.command
+    name = event.command_name
+    collection = command.get(name)
+    if not isinstance(collection, str):
+        collection = None
+    key = _FILTER_KEYS.get(name)
+    shape = None
+    if key == 'updates' or key == 'deletes':
+        statements = command.get(key) or []
+        shape = query_shape(statements[0].get('q', {})) if statements else None
+    elif key:
+        shape = query_shape(command.get(key, {}))
+    return name, collection, repr(shape)
+
+def _caller_frame():
+    """Find the innermost application frame outside the profiler and libraries"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (filename.startswith(_APP_ROOT) and filename not in _SKIP_FILES
+                and 'site-packages' not in filename):
+            return f"{os.path.relpath(filename, _APP_ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return 'unknown'
+
+class QueryRecord:
+    """A single MongoDB command seen by the profiler"""
+
+    __slots__ = ('shape', 'frame', 'duration')
+
+    def __init__(self, shape, frame):
+        self.shape = shape
+        self.frame = frame
+        self.duration = None
+
+class QueryProfilerListener(monitoring.CommandListener):
+    """Records commands for the active request profile and any open capture"""
+
+    def started(self, event):
+        profile = getattr(_local, 'profile', None)
+        captures = getattr(_local, 'captures', None)
+        if profile is None and not captures:
+            return
+        record = QueryRecord(command_shape(event), _caller_frame())
+        pending = getattr(_local, 'pending', None)
+        if pending is None:
+            pending = _local.pending = {}
+        pending[event.request_id] = record
+        if profile is not None:
+            profile.append(record)
+        for capture in captures or ():
+            capture.append(record)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        pending = getattr(_local, 'pending', None)
+        record = pending.pop(event.request_id, None) if pending else None
+        if record is None:
+            return
+        record.duration = event.duration_micros / 1000.0
+        threshold = getattr(_local, 'slow_query_ms', None)
+        if threshold is not None and record.duration >= threshold:
+            name, collection, shape = record.shape
+            logger.warning("Slow query (%.1f ms) %s on %s filter=%s at %s",
+                           record.duration, name, collection, shape, record.frame)
+
+command_listener = QueryProfilerListener()
+
+def group_by_shape(records):
+    """Group records by shape, returning ``{shape: [records]}`` in first-seen order"""
+    groups = {}
+    for record in records:
+        groups.setdefault(record.shape, []).append(record)
+    return groups
+
+def find_n_plus_one(records, threshold):
+    """Return ``(shape, count, frame)`` for shapes repeated at least ``threshold`` times"""
+    return [(shape, len(group), group[0].frame)
+            for shape, group in group_by_shape(records).items()
+            if len(group) >= threshold]
+
+@contextmanager
+def capture_queries():
+    """Collect every MongoDB command issued on this thread inside the block
+
+    Yields a list of QueryRecord objects that fills as commands run.
+    """
+    records = []
+    if getattr(_local, 'captures', None) is None:
+        _local.captures = []
+    _local.captures.append(records)
+    try:
+        yield records
+    finally:
+        _local.captures = [capture for capture in _local.captures if capture is not records]
+
+def assert_max_queries(client, url, max_queries, method='get', **kwargs):
+    """Pytest helper: request ``url`` and fail if it issues more than ``max_queries`` commands
+
+    Example::
+
+        def test_homepage_query_budget(client):
+            assert_max_queries(client, '/', 8)
+    """
+    with capture_queries() as records:
+        response = getattr(client, method)(url, **kwargs)
+    if len(records) > max_queries:
+        lines = [f"{url} issued {len(records)} MongoDB commands (max {max_queries}):"]
+        for (name, collection, shape), group in group_by_shape(records).items():
+            lines.append(f"  {len(group)}x {name} {collection} {shape} at {group[0].frame}")
+        raise AssertionError('\n'.join(lines))
+    return response
+
+def init_profiler(app):
+    """Enable per-request profiling when the app runs in debug mode or QUERY_PROFILER_ENABLED is set"""
+
+    @app.before_request
+    def _start_profile():
+        if current_app.debug or current_app.config.get('QUERY_PROFILER_ENABLED'):
+            _local.profile = []
+            _local.slow_query_ms = current_app.config.get('SLOW_QUERY_MS', 100)
+        else:
+            _local.profile = None
+            _local.slow_query_ms = None
+
+    @app.after_request
+    def _report_profile(response):
+        records = getattr(_local, 'profile', None)
+        _local.profile = None
+        _local.slow_query_ms = None
+        if records is None:
+            return response
+        route = f"{request.method} {request.path} ({request.endpoint})"
+        threshold = current_app.config.get('N_PLUS_ONE_THRESHOLD', 5)
+        for (name, collection, shape), count, frame in find_n_plus_one(records, threshold):
+            logger.warning("Possible N+1: %s ran %dx %s on %s filter=%s at %s",
+                           route, count, name, collection, shape, frame)
+        if current_app.debug:
+            response.headers['X-Query-Count'] = str(len(records))
+        return response
@@ -0,0 +1,239 @@
+import re
+from datetime import date, datetime, timedelta
+from bson.objectid import ObjectId
+
+# Query builders and serialization shared by the HTML routes, the JSON API
+# and the async API tier (routes/api_async.py), so every surface filters and
+# renders publications the same way.
+
+# Fields matched by the free-text search on each surface
+HOMEPAGE_SEARCH_FIELDS = ('title', 'authors', 'author', 'category')
+API_SEARCH_FIELDS = ('title', 'authors', 'author')
+
+# Searchable fields holding arrays (multikey indexes)
+ARRAY_FIELDS = ('authors',)
+
+def author_filter(author):
+    """Match an author in the authors array or the legacy single author field"""
+    return {'$or': [{'authors': {'$in': [author]}}, {'author': author}]}
+
+# Longer search strings are cut off before they reach the server
+MAX_SEARCH_LENGTH = 100
+
+# Shown (HTML) or returned (API) when a search runs past its maxTimeMS budget
+SEARCH_TIMEOUT_MESSAGE = 'Search took too long. Try more specific search terms.'
+
+def clean_search(search):
+    """Trim, collapse whitespace and cap the length of user search input"""
+    return ' '.join((search or '').split())[:MAX_SEARCH_LENGTH].strip()
+
+def regex_search_filter(search, fields=HOMEPAGE_SEARCH_FIELDS):
+    """Case-insensitive substring match on any of ``fields``
+
+    The input is escaped, so it is matched literally and cannot make the
+    server backtrack.
+    """
+    pattern = re.escape(clean_search(search))
+    return {'$or': [{field: {'$regex': pattern, '$options': 'i'}} for field in fields]}
+
+def prefix_search_filter(prefix, fields=HOMEPAGE_SEARCH_FIELDS):
+    """Values of any of ``fields`` starting with ``prefix``, as index ranges
+
+    Run with CATALOG_COLLATION: the ranges are then case-insensitive and
+    served by the *_ci indexes. U+FFFF sorts after every character under
+    ICU collations, so it closes the range.
+    """
+    bounds = {'$gte': prefix, '$lt': prefix + '\uffff'}
+    # On an array a bare range is satisfied by any element per bound ('Zed' >= 'M',
+    # 'Aaron' < 'M\uffff'); $elemMatch makes one element meet both, so the range is tight
+    return {'$or': [{field: {'$elemMatch': dict(bounds)} if field in ARRAY_FIELDS else dict(bounds)}
+                    for field in fields]}
+
+def parse_search(search):
+    """``('prefix', term)``, ``('substring', term)`` or None for a search box value
+
+    ``term*`` is a prefix search; anything else is a literal substring match.
+    """
+    search = clean_search(search)
+    prefix = search[:-1].rstrip() if search.endswith('*') else None
+    if prefix and '*' not in prefix:
+        return 'prefix', prefix
+    search = search.strip('*').strip()
+    return ('substring', search) if search else None
+
+def compile_search(search, fields=HOMEPAGE_SEARCH_FIELDS):
+    """Filter for a search box value
+
+    Prefix searches are compiled to index ranges, substrings to an escaped
+    regex. Returns {} for blank input.
+    """
+    parsed = parse_search(search)
+    if parsed is None:
+        return {}
+    mode, term = parsed
+    if mode == 'prefix':
+        return prefix_search_filter(term, fields)
+    return regex_search_filter(term, fields)
+
+# Publication dates are calendar days, stored as BSON dates at midnight UTC
+# with the year alongside in `publish_year` for the year histograms.
+
+def parse_publish_date(value):
+    """Midnight UTC datetime for 'YYYY-MM-DD' (or a date/datetime); raises ValueError"""
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    try:
+        return datetime.strptime(str(value or '').strip()[:10], '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"Invalid publish date: {value!r} (use YYYY-MM-DD)")
+
+def publish_date_fields(value):
+    """The stored ``publish_date`` and ``publish_year`` fields for a date"""
+    publish_date = parse_publish_date(value)
+    return {'publish_date': publish_date, 'publish_year': publish_date.year}
+
+_DATE_BOUND_FORMATS = (('%Y-%m-%d', 'day'), ('%Y-%m', 'month'), ('%Y', 'year'))
+
+def date_bound(value, end=False):
+    """Start of the day, month or year written as 'YYYY-MM-DD', 'YYYY-MM' or 'YYYY'
+
+    With ``end``, the start of the following one (an exclusive upper bound).
+    """
+    value = (value or '').strip()
+    for pattern, unit in _DATE_BOUND_FORMATS:
+        try:
+            start = datetime.strptime(value, pattern)
+        except ValueError:
+            continue
+        if not end:
+            return start
+        if unit == 'day':
+            return start + timedelta(days=1)
+        if unit == 'month':
+            return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+        return datetime(start.year + 1, 1, 1)
+    raise ValueError(f"Invalid date: {value!r} (use YYYY, YYYY-MM or YYYY-MM-DD)")
+
+def publish_date_filter(date_from=None, date_to=None):
+    """Range filter on publish_date with both bounds inclusive, or None without bounds"""
+    bounds = {}
+    if date_from:
+        bounds['$gte'] = date_bound(date_from)
+    if date_to:
+        bounds['$lt'] = date_bound(date_to, end=True)
+    return {'publish_date': bounds} if bounds else None
+
+def combine_filters(parts):
+    """AND together the non-empty filter parts"""
+    if len(parts) > 1:
+        return {'$and': parts}
+    if len(parts) == 1:
+        return parts[0]
+    return {}
+
+def build_publication_query(search=None, author=None, category=None, publish_date=None,
+                            date_from=None, date_to=None, search_fields=HOMEPAGE_SEARCH_FIELDS):
+    """Build the publications filter for the catalog listing
+
+    ``date_from``/``date_to`` take 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD';
+    ``publish_date`` (one exact day) is kept for old links. Raises
+    ValueError on a malformed date.
+    """
+    parts = []
+    search_filter = compile_search(search, search_fields)
+    if search_filter:
+        parts.append(search_filter)
+    if author:
+        parts.append(author_filter(author))
+    if category:
+        parts.append({'category': category})
+    if publish_date:
+        date_from = date_to = publish_date
+    date_filter = publish_date_filter(date_from, date_to)
+    if date_filter:
+        parts.append(date_filter)
+    return combine_filters(parts)
+
+# Listings skip the precomputed related-publications list (only view_pdf and
+# the detail endpoints need it)
+LISTING_PROJECTION = {'related': 0}
+
+def text_search_query(query_text):
+    """Full-text search filter (requires the publications text index)"""
+    return {'$text': {'$search': clean_search(query_text)}}
+
+def pagination(page, per_page, total):
+    """Pagination block returned by the list endpoints"""
+    return {
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'pages': (total + per_page - 1) // per_page
+    }
+
+def _serialize_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return [_serialize_value(item) for item in value]
+    if isinstance(value, dict):
+        return serialize_document(value)
+    return value
+
+# Calendar-day fields, serialized as 'YYYY-MM-DD' rather than a timestamp
+DATE_ONLY_FIELDS = ('publish_date',)
+
+def serialize_document(doc):
+    """Make a MongoDB document JSON-safe (ObjectIds to strings, datetimes to ISO 8601)"""
+    return {key: value.date().isoformat() if key in DATE_ONLY_FIELDS and isinstance(value, datetime)
+            else _serialize_value(value)
+            for key, value in doc.items()}
+
+def keep_selected(counts, selected):
+    """Facet counts with the selected value listed even when nothing else matches it (count 0)"""
+    if selected and not any(isinstance(entry['_id'], str) and entry['_id'].lower() == selected.lower()
+                            for entry in counts):
+        counts = sorted(counts + [{'_id': selected, 'count': 0}], key=lambda entry: str(entry['_id']))
+    return counts
+
+# Aggregation pipelines shared by the stats and facet endpoints
+# The range on publish_year lets the whole histogram run on the publish_year index (covered)
+PUBLICATIONS_BY_YEAR_PIPELINE = [
+    {"$match": {"publish_year": {"$gt": 0}}},
+    {"$group": {"_id": "$publish_year", "count": {"$sum": 1}}},
+    {"$sort": {"_id": 1}}
+]
+
+CATEGORY_COUNTS_PIPELINE = [
+    {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+    {"$sort": {"_id": 1}}
+]
+
+PUBLICATIONS_BY_CATEGORY_PIPELINE = [
+    {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+    {"$sort": {"count": -1}}
+]
+
+# Unwind authors array to get individual authors, handle both old and new format
+AUTHOR_COUNTS_PIPELINE = [
+    {"$project": {
+        "author": 1,
+        "authors": 1,
+        "all_authors": {
+            "$cond": {
+                "if": {"$isArray": "$authors"},
+                "then": "$authors",
+                "else": {"$cond": {
+                    "if": {"$ne": ["$author", None]},
+                    "then": ["$author"],
+                    "else": []
+                }}
+            }
+        }
+    }},
+    {"$unwind": "$all_authors"},
+    {"$group": {"_id": "$all_authors", "count": {"$sum": 1}}},
+    {"$sort": {"_id": 1}}
+]
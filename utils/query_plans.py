@@ -0,0 +1,120 @@
+from bson.objectid import ObjectId
+from utils.indexes import CATALOG_COLLATION
+from utils.query import (author_filter, prefix_search_filter, publish_date_filter, API_SEARCH_FIELDS,
+                         HOMEPAGE_SEARCH_FIELDS)
+
+# Plan stages that mean a query is not index-backed: a full collection scan,
+# or a blocking in-memory sort.
+BAD_STAGES = ('COLLSCAN', 'SORT')
+
+SAMPLE_AUTHOR = 'Sample Author'
+SAMPLE_CATEGORY = 'Evaporator'
+SAMPLE_DATE_RANGE = publish_date_filter('2020', '2024-06')
+SAMPLE_PREFIX = 'desal'
+SAMPLE_ID = ObjectId('000000000000000000000000')
+
+class QueryShape:
+    """A query issued by the application, used to check its explain() plan"""
+
+    def __init__(self, name, collection, query, sort=None, limit=None, collation=None):
+        self.name = name
+        self.collection = collection
+        self.query = query
+        self.sort = sort
+        self.limit = limit
+        self.collation = collation
+
+    def explain(self, db):
+        cursor = db[self.collection].find(self.query)
+        if self.sort:
+            cursor = cursor.sort(self.sort)
+        if self.limit:
+            cursor = cursor.limit(self.limit)
+        if self.collation:
+            cursor = cursor.collation(self.collation)
+        return cursor.explain()
+
+# Query shapes issued by the routes and models.
+# Keep this list in step with the routes when a filter or sort is added.
+# Sorting by author (the multikey `authors` array), the unanchored substring
+# search and sorted prefix searches (ranges on several fields merged, then
+# sorted) cannot be served from an index and are deliberately not listed.
+QUERY_SHAPES = [
+    # routes/main.py:index
+    QueryShape('index: no filter, sorted by title', 'publications',
+               {}, [('title', 1)], limit=9, collation=CATALOG_COLLATION),
+    QueryShape('index: category, sorted by title', 'publications',
+               {'category': SAMPLE_CATEGORY}, [('title', 1)], limit=9, collation=CATALOG_COLLATION),
+    QueryShape('index: category + date range, sorted by title', 'publications',
+               {'$and': [{'category': SAMPLE_CATEGORY}, SAMPLE_DATE_RANGE]},
+               [('title', 1)], limit=9, collation=CATALOG_COLLATION),
+    QueryShape('index: date range, sorted by title', 'publications',
+               SAMPLE_DATE_RANGE, [('title', 1)], limit=9, collation=CATALOG_COLLATION),
+    QueryShape('index: category + date range, sorted by publish_date', 'publications',
+               {'$and': [{'category': SAMPLE_CATEGORY}, SAMPLE_DATE_RANGE]},
+               [('publish_date', 1)], limit=9, collation=CATALOG_COLLATION),
+    QueryShape('index: author, sorted by title', 'publications',
+               author_filter(SAMPLE_AUTHOR), [('title', 1)], limit=9, collation=CATALOG_COLLATION),
+    QueryShape('index: no filter, sorted by publish_date', 'publications',
+               {}, [('publish_date', 1)], limit=9, collation=CATALOG_COLLATION),
+    QueryShape('index: category, sorted by publish_date', 'publications',
+               {'category': SAMPLE_CATEGORY}, [('publish_date', 1)], limit=9, collation=CATALOG_COLLATION),
+    QueryShape('index: latest publications', 'publications',
+               {}, [('publish_date', -1)], limit=5),
+
+    # routes/main.py:author_info
+    QueryShape('author_info: latest publications by author', 'publications',
+               author_filter(SAMPLE_AUTHOR), [('publish_date', -1)], limit=5, collation=CATALOG_COLLATION),
+
+    # routes/api.py:get_publications
+    QueryShape('api: publications by category', 'publications',
+               {'category': SAMPLE_CATEGORY}, limit=20, collation=CATALOG_COLLATION),
+    QueryShape('api: publications by author', 'publications',
+               author_filter(SAMPLE_AUTHOR), limit=20, collation=CATALOG_COLLATION),
+    QueryShape('api: publications in a date range', 'publications',
+               SAMPLE_DATE_RANGE, limit=20, collation=CATALOG_COLLATION),
+    QueryShape('api: prefix search (search=term*)', 'publications',
+               prefix_search_filter(SAMPLE_PREFIX, API_SEARCH_FIELDS), limit=20, collation=CATALOG_COLLATION),
+    # routes/api.py:search without a text index
+    QueryShape('api search: prefix search (q=term*)', 'publications',
+               prefix_search_filter(SAMPLE_PREFIX, HOMEPAGE_SEARCH_FIELDS), limit=20, collation=CATALOG_COLLATION),
+
+    # routes/admin.py
+    QueryShape('admin: publications by created_at', 'publications',
+               {}, [('created_at', -1)], limit=20),
+    QueryShape('admin: recent authors', 'authors',
+               {}, [('created_at', -1)], limit=5),
+    QueryShape('main/admin: author by name', 'authors',
+               {'name': SAMPLE_AUTHOR}),
+
+    # models/favorite.py
+    QueryShape('favorites: listing by user', 'favorites',
+               {'user_id': SAMPLE_ID}, [('created_at', -1)], limit=20),
+    QueryShape('favorites: membership check', 'favorites',
+               {'user_id': SAMPLE_ID, 'publication_id': {'$in': [SAMPLE_ID]}}),
+]
+
+def plan_stages(plan):
+    """Yield every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for key in ('inputStage', 'queryPlan'):
+            if key in plan:
+                yield from plan_stages(plan[key])
+        for child in plan.get('inputStages', []):
+            yield from plan_stages(child)
+
+def check_query_plans(db, shapes=None):
+    """Explain every query shape and return ``(shape, bad_stages, stages)`` results
+
+    A shape passes when its winning plan contains none of BAD_STAGES.
+    """
+    shapes = QUERY_SHAPES if shapes is None else shapes
+    results = []
+    for shape in shapes:
+        explanation = shape.explain(db)
+        stages = list(plan_stages(explanation['queryPlanner']['winningPlan']))
+        bad = [stage for stage in stages if stage in BAD_STAGES]
+        results.append((shape, bad, stages))
+    return results
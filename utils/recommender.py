@@ -0,0 +1,264 @@
+import math
+import re
+from collections import Counter
+from datetime import datetime
+from pymongo import UpdateOne
+from utils.signals import publication_changed
+
+# Related-publications engine. A batch job (`flask wrdc related`) builds
+# TF-IDF vectors from each publication's title, extracted PDF text, authors
+# and category, finds its k most similar publications by cosine similarity
+# and stores them on the publication as a denormalized `related` list, so
+# view_pdf renders them from the document it already loaded. Publication
+# writes only enqueue the id in `related_queue`; the next incremental run
+# recomputes just the lists that can have changed.
+#
+# NumPy and SciPy are imported lazily: web workers only enqueue ids.
+
+# Relative weight of each feature block in the combined vector
+FIELD_WEIGHTS = {'title': 1.0, 'text': 0.6, 'authors': 0.8, 'category': 0.4}
+
+# Publication fields copied into each related entry
+SNIPPET_FIELDS = ('title', 'authors', 'author', 'category', 'publish_date', 'cover_filename')
+
+# Queue entry that forces a full rebuild (e.g. after a bulk migration)
+FULL_REBUILD = 'full'
+
+STOPWORDS = frozenset('''
+a an and are as at be by for from has in is it its of on or that the this to was were will with
+'''.split())
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    """Lower-case word tokens without stopwords and one-character tokens"""
+    return [token for token in _TOKEN_RE.findall((text or '').lower())
+            if len(token) > 1 and token not in STOPWORDS]
+
+def _authors(pub):
+    authors = pub.get('authors')
+    if isinstance(authors, list) and authors:
+        return authors
+    return [pub['author']] if pub.get('author') else []
+
+def document_terms(pub, text=None):
+    """Terms per feature block for one publication"""
+    return {
+        'title': tokenize(pub.get('title')),
+        'text': tokenize(text),
+        'authors': [name.strip().lower() for name in _authors(pub) if name],
+        'category': [pub['category'].strip().lower()] if pub.get('category') else [],
+    }
+
+def _require_numpy():
+    try:
+        import numpy
+        import scipy.sparse
+    except ImportError:
+        raise RuntimeError('The related-publications job requires numpy and scipy (pip install numpy scipy)')
+    return numpy, scipy.sparse
+
+def _tfidf_block(documents, weight):
+    """Sublinear TF-IDF matrix for one feature block, rows L2-normalized and scaled by ``weight``"""
+    np, sparse = _require_numpy()
+    vocabulary = {}
+    rows, cols, values = [], [], []
+    for row, terms in enumerate(documents):
+        for term, count in Counter(terms).items():
+            col = vocabulary.setdefault(term, len(vocabulary))
+            rows.append(row)
+            cols.append(col)
+            values.append(1.0 + math.log(count))
+    shape = (len(documents), max(1, len(vocabulary)))
+    matrix = sparse.csr_matrix((values, (rows, cols)), shape=shape, dtype=np.float64)
+
+    document_frequency = np.bincount(cols, minlength=shape[1]) if cols else np.zeros(shape[1])
+    idf = np.log((1.0 + shape[0]) / (1.0 + document_frequency)) + 1.0
+    matrix = matrix @ sparse.diags(idf)
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(weight / norms) @ matrix
+
+class RelatedModel:
+    """Combined, row-normalized TF-IDF vectors for the whole catalog"""
+
+    def __init__(self, ids, matrix):
+        self.ids = ids
+        self.rows = {publication_id: row for row, publication_id in enumerate(ids)}
+        self.matrix = matrix
+
+    @classmethod
+    def build(cls, publications, texts, weights=FIELD_WEIGHTS):
+        """Vectorize ``publications`` (a list of documents); ``texts`` maps _id to extracted text"""
+        np, sparse = _require_numpy()
+        terms = [document_terms(pub, texts.get(pub['_id'])) for pub in publications]
+        blocks = [_tfidf_block([t[field] for t in terms], weight)
+                  for field, weight in weights.items() if weight]
+        matrix = sparse.hstack(blocks).tocsr()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        matrix = (sparse.diags(1.0 / norms) @ matrix).tocsr()
+        return cls([pub['_id'] for pub in publications], matrix)
+
+    def similarities(self, rows):
+        """Dense (len(rows) x N) cosine similarity block"""
+        return (self.matrix[rows] @ self.matrix.T).toarray()
+
+    def neighbors(self, rows, k, min_score=0.0, chunk_size=256):
+        """Yield ``(row, [(col, score), ...])`` with the top-k neighbors of each row"""
+        np, _ = _require_numpy()
+        rows = list(rows)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            block = self.similarities(chunk)
+            for offset, row in enumerate(chunk):
+                scores = block[offset]
+                scores[row] = 0.0
+                if k < len(scores):
+                    candidates = np.argpartition(-scores, k)[:k]
+                else:
+                    candidates = np.arange(len(scores))
+                ranked = sorted(candidates, key=lambda col: -scores[col])
+                yield row, [(col, float(scores[col])) for col in ranked if scores[col] > min_score]
+
+def _snippet(pub, score):
+    entry = {'_id': pub['_id'], 'score': round(score, 4)}
+    for field in SNIPPET_FIELDS:
+        if pub.get(field) is not None:
+            entry[field] = pub[field]
+    return entry
+
+def load_corpus(db):
+    """Load the fields the recommender needs for every publication, plus extracted texts"""
+    projection = {field: 1 for field in SNIPPET_FIELDS}
+    projection['related'] = 1
+    publications = list(db.publications.find({}, projection).sort('_id', 1))
+    texts = {doc['_id']: doc.get('text', '') for doc in db.publication_text.find({}, {'text': 1})}
+    return publications, texts
+
+def _write_related(db, model, publications, rows, k, min_score):
+    """Recompute the related lists of ``rows`` and write the ones that changed"""
+    operations = []
+    now = datetime.utcnow()
+    for row, neighbors in model.neighbors(rows, k, min_score):
+        pub = publications[row]
+        related = [_snippet(publications[col], score) for col, score in neighbors]
+        if related != pub.get('related'):
+            operations.append(UpdateOne({'_id': pub['_id']},
+                                        {'$set': {'related': related, 'related_updated_at': now}}))
+            pub['related'] = related
+    for offset in range(0, len(operations), 500):
+        db.publications.bulk_write(operations[offset:offset + 500], ordered=False)
+    return len(operations)
+
+def rebuild_related(db, k=6, min_score=0.05, log=print):
+    """Recompute the related list of every publication"""
+    publications, texts = load_corpus(db)
+    if len(publications) < 2:
+        return 0
+    model = RelatedModel.build(publications, texts)
+    updated = _write_related(db, model, publications, range(len(publications)), k, min_score)
+    log(f"Related lists: {len(publications)} publication(s) scored, {updated} updated")
+    return updated
+
+def refresh_related(db, publication_ids, k=6, min_score=0.05, log=print):
+    """Recompute only the related lists that ``publication_ids`` can affect
+
+    That is the changed publications themselves, every list that already
+    contains one of them (covers edits and deletions) and every list whose
+    weakest entry now scores below one of them.
+    """
+    publications, texts = load_corpus(db)
+    if len(publications) < 2:
+        return 0
+    model = RelatedModel.build(publications, texts)
+    changed = set(publication_ids)
+    changed_rows = [model.rows[pid] for pid in changed if pid in model.rows]
+
+    rows = set(changed_rows)
+    for row, pub in enumerate(publications):
+        if any(entry['_id'] in changed for entry in pub.get('related') or []):
+            rows.add(row)
+
+    if changed_rows:
+        # Best similarity of every publication to any changed one
+        scores = model.similarities(changed_rows).max(axis=0)
+        for row, pub in enumerate(publications):
+            related = pub.get('related') or []
+            weakest = related[-1]['score'] if len(related) >= k else min_score
+            if scores[row] > weakest:
+                rows.add(row)
+
+    # Deleted publications no longer need their extracted text
+    deleted = [pid for pid in changed if pid not in model.rows]
+    if deleted:
+        db.publication_text.delete_many({'_id': {'$in': deleted}})
+
+    updated = _write_related(db, model, publications, sorted(rows), k, min_score)
+    log(f"Related lists: {len(changed)} changed publication(s), {len(rows)} list(s) rescored, {updated} updated")
+    return updated
+
+def process_queue(db, k=6, min_score=0.05, full=False, log=print):
+    """Apply queued publication changes; a queued (or requested) full rebuild supersedes the rest"""
+    started = datetime.utcnow()
+    queued = [entry['_id'] for entry in db.related_queue.find({'queued_at': {'$lte': started}}, {'_id': 1})]
+    if full or FULL_REBUILD in queued:
+        updated = rebuild_related(db, k, min_score, log)
+    elif queued:
+        updated = refresh_related(db, queued, k, min_score, log)
+    else:
+        log('Related lists: nothing queued')
+        return 0
+    # Entries re-queued while we ran have a newer queued_at and stay for the next run
+    db.related_queue.delete_many({'_id': {'$in': queued}, 'queued_at': {'$lte': started}})
+    return updated
+
+def extract_texts(db, storage, max_pages=3, max_chars=20000, log=print):
+    """Extract the first pages of text from PDFs (read from ``storage``) that have none stored yet"""
+    import fitz  # PyMuPDF
+    from utils.storage import upload_key
+
+    done = {doc['_id']: doc.get('extracted_at') for doc in db.publication_text.find({}, {'extracted_at': 1})}
+    extracted = 0
+    for pub in db.publications.find({'pdf_filename': {'$nin': [None, '']}},
+                                    {'pdf_filename': 1, 'updated_at': 1}):
+        extracted_at = done.get(pub['_id'])
+        if extracted_at and (not pub.get('updated_at') or pub['updated_at'] <= extracted_at):
+            continue
+        key = upload_key('pdfs', pub['pdf_filename'])
+        try:
+            if not storage.exists(key):
+                continue
+            with fitz.open(stream=b''.join(storage.open_range(key)), filetype='pdf') as doc:
+                text = ' '.join(doc[number].get_text() for number in range(min(max_pages, doc.page_count)))
+        except Exception as e:
+            log(f"Text extraction failed for {pub['pdf_filename']}: {e}")
+            continue
+        db.publication_text.update_one(
+            {'_id': pub['_id']},
+            {'$set': {'text': text[:max_chars], 'extracted_at': datetime.utcnow()}},
+            upsert=True
+        )
+        db.related_queue.update_one({'_id': pub['_id']}, {'$set': {'queued_at': datetime.utcnow()}}, upsert=True)
+        extracted += 1
+    log(f"Extracted text from {extracted} PDF(s)")
+    return extracted
+
+def enqueue(db, publication_id):
+    """Queue a publication for the next incremental refresh (None queues a full rebuild)"""
+    from bson.objectid import ObjectId
+    key = ObjectId(publication_id) if publication_id else FULL_REBUILD
+    db.related_queue.update_one({'_id': key}, {'$set': {'queued_at': datetime.utcnow()}}, upsert=True)
+
+def init_recommender(app):
+    """Queue publications for a related-list refresh whenever they change"""
+    from utils.db import mongo
+
+    def on_publication_changed(sender, op=None, id=None, **extra):
+        try:
+            enqueue(mongo.db, id)
+        except Exception as e:
+            print(f"Could not queue related-list refresh for {id}: {e}")
+
+    publication_changed.connect(on_publication_changed, weak=False)
@@ -0,0 +1,39 @@
+from blinker import Namespace
+
+# Write notifications for the catalog collections. The models send these after
+# every create/update/delete so caches and derived data can react without the
+# routes having to know about them.
+#
+# Receivers are called as ``receiver(sender, op=..., id=...)`` where ``op`` is
+# 'create', 'update' or 'delete' and ``id`` is the document id as a string.
+
+catalog_signals = Namespace()
+
+publication_changed = catalog_signals.signal('publication-changed')
+author_changed = catalog_signals.signal('author-changed')
+user_changed = catalog_signals.signal('user-changed')
+
+SIGNALS_BY_COLLECTION = {
+    'publications': publication_changed,
+    'authors': author_changed,
+    'users': user_changed,
+}
+
+# Process-local notification that a catalog document changed anywhere: in this
+# process or in another worker or node (see utils/invalidation.py). Sent once
+# in every process, so receivers must only drop in-process state and never
+# write to the database; derived data is kept current by the signals above.
+#
+# Receivers are called as ``receiver(sender, collection=..., op=..., id=...)``
+# with ``collection`` a key of SIGNALS_BY_COLLECTION; ``id`` is None when the
+# whole collection may have changed. Updates seen on a change stream also pass
+# ``fields``, the top-level fields they touched (None when unknown).
+catalog_invalidated = catalog_signals.signal('catalog-invalidated')
+
+# Fields written on every view, download or recommender run; an update touching
+# only these changes nothing that catalog caches, facets or suggestions show
+COUNTER_FIELDS = frozenset({'view_count', 'download_count', 'related', 'related_updated_at'})
+
+def counters_only(op, fields):
+    """Whether a `catalog_invalidated` event is an update of COUNTER_FIELDS alone"""
+    return op == 'update' and fields is not None and COUNTER_FIELDS.issuperset(fields)
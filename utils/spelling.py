@@ -0,0 +1,266 @@
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from utils.signals import publication_changed, author_changed, catalog_invalidated, counters_only
+
+# "Did you mean" corrections for catalog searches, using symmetric-delete
+# candidate generation (SymSpell). Every vocabulary word is indexed under the
+# strings obtained by deleting up to MAX_EDIT_DISTANCE characters from its
+# first PREFIX_LENGTH characters; a query word is looked up under its own
+# deletes, so finding candidates costs a bounded number of dict lookups
+# whatever the vocabulary size. Candidates are then checked with a real edit
+# distance and ranked by distance, then by how many documents use the word.
+#
+# The vocabulary (words from titles, author names and categories, with
+# document counts) lives in `spelling_vocabulary`. Writes keep it current:
+# each document's word set is stored in `spelling_terms`, and the signal
+# receivers apply only the difference between the old and new sets. Each
+# worker holds an in-memory index and pulls changed words from the collection
+# at most every SPELLING_SYNC_SECONDS, when a search actually needs a
+# suggestion. `flask wrdc spelling` rebuilds everything from the catalog.
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+
+# Words shorter than this are neither indexed nor corrected
+MIN_WORD_LENGTH = 3
+
+_WORD_RE = re.compile(r'[^\W\d_]+')
+
+# Changed words are pulled with this much overlap, covering clock differences between hosts
+SYNC_OVERLAP = timedelta(seconds=60)
+
+def tokenize(text):
+    """Lowercase words of ``text`` long enough to index"""
+    return [word for word in _WORD_RE.findall((text or '').lower()) if len(word) >= MIN_WORD_LENGTH]
+
+def publication_terms(pub):
+    """Vocabulary words of a publication (title, authors, category)"""
+    authors = pub.get('authors') or ([pub['author']] if pub.get('author') else [])
+    texts = [pub.get('title'), pub.get('category')] + list(authors)
+    return sorted({word for text in texts for word in tokenize(text)})
+
+def author_terms(author):
+    """Vocabulary words of an author profile"""
+    return sorted(set(tokenize(author.get('name'))))
+
+# Collection -> (projection, terms function)
+TERM_SOURCES = {
+    'publications': ({'title': 1, 'category': 1, 'authors': 1, 'author': 1}, publication_terms),
+    'authors': ({'name': 1}, author_terms),
+}
+
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance, or ``max_distance + 1`` once it is exceeded"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+def _deletes(word, max_distance):
+    """``word`` plus every string reachable by deleting up to ``max_distance`` characters"""
+    results = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {item[:i] + item[i + 1:] for item in frontier if len(item) > 1 for i in range(len(item))}
+        results |= frontier
+    return results
+
+class SpellingIndex:
+    """In-memory symmetric-delete index over word counts"""
+
+    def __init__(self, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.counts = {}
+        self.deletes = {}
+        self.synced_at = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def _keys(self, word):
+        return _deletes(word[:self.prefix_length], self.max_distance)
+
+    def set_count(self, word, count):
+        """Add, update or (with ``count`` <= 0) remove a word"""
+        if count > 0:
+            if word not in self.counts:
+                for key in self._keys(word):
+                    self.deletes.setdefault(key, []).append(word)
+            self.counts[word] = count
+        elif self.counts.pop(word, None) is not None:
+            for key in self._keys(word):
+                words = self.deletes.get(key)
+                if words is not None:
+                    words.remove(word)
+                    if not words:
+                        del self.deletes[key]
+
+    def lookup(self, word, limit=3):
+        """Up to ``limit`` ``(candidate, distance, count)`` for ``word``, best first"""
+        if word in self.counts:
+            return [(word, 0, self.counts[word])]
+        max_distance = 1 if len(word) <= 4 else self.max_distance
+        seen = set()
+        found = []
+        for key in _deletes(word[:self.prefix_length], max_distance):
+            for candidate in self.deletes.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate, max_distance)
+                if distance <= max_distance:
+                    found.append((candidate, distance, self.counts[candidate]))
+        found.sort(key=lambda item: (item[1], -item[2], item[0]))
+        return found[:limit]
+
+    def suggest(self, text, limit=3):
+        """Corrected versions of a search string, best first (empty if every word is known or uncorrectable)
+
+        Each unknown word is replaced by one of its best candidates; phrases
+        are ranked by total edit distance, then by how common their words are.
+        """
+        with self.lock:
+            return self._suggest(_WORD_RE.findall((text or '').lower()), limit)
+
+    def _suggest(self, words, limit):
+        phrases = [((0, 0), [])]
+        changed = False
+        for word in words:
+            if len(word) < MIN_WORD_LENGTH or word in self.counts:
+                options = [(word, 0, 0)]
+            else:
+                options = self.lookup(word, limit) or [(word, 0, 0)]
+                changed = changed or options[0][0] != word
+            phrases = sorted(((distance + option_distance, popularity - count), phrase + [option])
+                             for (distance, popularity), phrase in phrases
+                             for option, option_distance, count in options)[:limit]
+        if not changed:
+            return []
+        text = ' '.join(words)
+        return [' '.join(phrase) for _, phrase in phrases if ' '.join(phrase) != text]
+
+    def sync(self, db, interval=60):
+        """Pull words changed since the last sync (everything the first time); at most every ``interval`` seconds"""
+        now = time.monotonic()
+        if self.synced_at is not None and now - self.checked_at < interval:
+            return
+        with self.lock:
+            if self.synced_at is not None and now - self.checked_at < interval:
+                return
+            started = datetime.utcnow()
+            if self.synced_at is None:
+                query = {'count': {'$gt': 0}}
+            else:
+                query = {'updated_at': {'$gte': self.synced_at - SYNC_OVERLAP}}
+            for doc in db.spelling_vocabulary.find(query, {'count': 1}):
+                self.set_count(doc['_id'], doc['count'])
+            self.synced_at = started
+            self.checked_at = now
+
+    def expire(self):
+        """Make the next sync() pull changes whatever the interval"""
+        self.checked_at = float('-inf')
+
+def _apply_term_changes(db, key, terms):
+    """Swap a document's stored word set for ``terms`` and adjust the word counts by the difference"""
+    if terms:
+        previous = db.spelling_terms.find_one_and_update({'_id': key},
+                                                         {'$set': {'terms': terms, 'updated_at': datetime.utcnow()}},
+                                                         upsert=True, return_document=ReturnDocument.BEFORE)
+    else:
+        previous = db.spelling_terms.find_one_and_delete({'_id': key})
+    old = set(previous['terms']) if previous else set()
+    new = set(terms)
+    now = datetime.utcnow()
+    operations = [UpdateOne({'_id': word}, {'$inc': {'count': 1 if word in new else -1}, '$set': {'updated_at': now}},
+                            upsert=True)
+                  for word in old ^ new]
+    if operations:
+        db.spelling_vocabulary.bulk_write(operations, ordered=False)
+
+def update_terms(db, collection, document_id):
+    """Bring the vocabulary up to date with one (possibly deleted) publication or author"""
+    projection, terms = TERM_SOURCES[collection]
+    doc = db[collection].find_one({'_id': ObjectId(document_id)}, projection)
+    _apply_term_changes(db, f"{collection}:{document_id}", terms(doc) if doc else [])
+
+def rebuild_vocabulary(db, log=print):
+    """Recompute the vocabulary and every document's word set from the catalog"""
+    started = datetime.utcnow()
+    counts = {}
+    for collection, (projection, terms) in TERM_SOURCES.items():
+        operations = []
+        for doc in db[collection].find({}, projection):
+            words = terms(doc)
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+            operations.append(UpdateOne({'_id': f"{collection}:{doc['_id']}"},
+                                        {'$set': {'terms': words, 'updated_at': started}}, upsert=True))
+            if len(operations) >= 500:
+                db.spelling_terms.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            db.spelling_terms.bulk_write(operations, ordered=False)
+    # Word sets of documents deleted before this run
+    db.spelling_terms.delete_many({'updated_at': {'$lt': started}})
+
+    operations = [UpdateOne({'_id': word}, {'$set': {'count': count, 'updated_at': started}}, upsert=True)
+                  for word, count in counts.items()]
+    for offset in range(0, len(operations), 500):
+        db.spelling_vocabulary.bulk_write(operations[offset:offset + 500], ordered=False)
+    # Words no longer used anywhere
+    removed = db.spelling_vocabulary.update_many({'updated_at': {'$lt': started}, 'count': {'$ne': 0}},
+                                                 {'$set': {'count': 0, 'updated_at': datetime.utcnow()}}).modified_count
+    log(f"Spelling vocabulary: {len(counts)} word(s), {removed} removed")
+    return len(counts)
+
+def get_suggestions(db, text, limit=3):
+    """"Did you mean" corrections for a search string, using the app's index"""
+    from flask import current_app
+    index = current_app.extensions['wrdc_spelling']
+    index.sync(db, current_app.config['SPELLING_SYNC_SECONDS'])
+    return index.suggest(text, limit)
+
+def init_spelling(app):
+    """Create the per-process index and keep the vocabulary current on catalog writes"""
+    from utils.db import mongo
+    app.extensions['wrdc_spelling'] = SpellingIndex(app.config['SPELLING_MAX_EDIT_DISTANCE'])
+
+    def receiver(collection):
+        def on_changed(sender, op=None, id=None, **extra):
+            # Bulk changes (id=None) are picked up by `flask wrdc spelling`
+            if id is None:
+                return
+            try:
+                update_terms(mongo.db, collection, id)
+            except Exception as e:
+                print(f"Could not update spelling vocabulary: {e}")
+        return on_changed
+
+    publication_changed.connect(receiver('publications'), weak=False)
+    author_changed.connect(receiver('authors'), weak=False)
+
+    def on_invalidated(sender, collection=None, op=None, id=None, fields=None, **extra):
+        # Another process changed the vocabulary; pick it up on the next suggestion
+        if collection in TERM_SOURCES and not counters_only(op, fields):
+            app.extensions['wrdc_spelling'].expire()
+
+    catalog_invalidated.connect(on_invalidated, weak=False)
@@ -0,0 +1,156 @@
+import threading
+from datetime import datetime, timedelta
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+from utils.query import PUBLICATIONS_BY_YEAR_PIPELINE, PUBLICATIONS_BY_CATEGORY_PIPELINE
+from utils.signals import publication_changed, author_changed, user_changed
+from utils.versions import make_etag
+
+# Library statistics snapshots. The admin dashboard and /api/v1/stats serve
+# the latest document in `stats_snapshots` (one indexed find_one) instead of
+# counting and aggregating on every request. Snapshots are recomputed by
+# `flask wrdc stats` from cron, and in the background when a request finds the
+# latest one older than STATS_SNAPSHOT_MAX_AGE_SECONDS, or marked dirty by a
+# write and older than STATS_SNAPSHOT_MIN_INTERVAL_SECONDS. Old snapshots
+# expire through a TTL index on as_of.
+
+# Single document in `stats_state` tracking pending writes and refresh claims
+STATE_ID = 'snapshot'
+
+# How long a worker's refresh claim blocks the others
+REFRESH_CLAIM_SECONDS = 60
+
+def compute_snapshot(db, budget=None):
+    """Compute the statistics shown by the dashboard and the stats API
+
+    Totals use estimated_document_count (collection metadata, no scan); they
+    can be off briefly after an unclean shutdown, which is fine for a dashboard.
+    """
+    started = datetime.utcnow()
+    options = {'maxTimeMS': budget} if budget else {}
+    snapshot = {
+        'total_publications': db.publications.estimated_document_count(**options),
+        'total_authors': db.authors.estimated_document_count(**options),
+        'total_users': db.users.estimated_document_count(**options),
+        'publications_by_year': list(db.publications.aggregate(PUBLICATIONS_BY_YEAR_PIPELINE, **options)),
+        'publications_by_category': list(db.publications.aggregate(PUBLICATIONS_BY_CATEGORY_PIPELINE, **options)),
+    }
+    snapshot['as_of'] = started
+    snapshot['duration_ms'] = int((datetime.utcnow() - started).total_seconds() * 1000)
+    return snapshot
+
+def refresh_snapshot(db, budget=None):
+    """Compute and store a new snapshot; clears the dirty mark for writes made before it started"""
+    snapshot = compute_snapshot(db, budget)
+    db.stats_snapshots.insert_one(snapshot)
+    db.stats_state.update_one({'_id': STATE_ID, 'dirty_since': {'$lte': snapshot['as_of']}},
+                              {'$unset': {'dirty_since': ''}})
+    db.stats_state.update_one({'_id': STATE_ID}, {'$unset': {'refreshing_until': ''}})
+    return snapshot
+
+def latest_snapshot(db, projection=None):
+    """Most recent snapshot, or None if none has been computed yet"""
+    return db.stats_snapshots.find_one({}, projection, sort=[('as_of', DESCENDING)])
+
+def mark_dirty(db):
+    """Record that a write may have changed the statistics"""
+    db.stats_state.update_one({'_id': STATE_ID}, {'$min': {'dirty_since': datetime.utcnow()}}, upsert=True)
+
+def needs_refresh(snapshot, state, max_age, min_interval, now=None):
+    """Whether ``snapshot`` is too old, or dirty and past the minimum refresh interval"""
+    if snapshot is None:
+        return True
+    age = ((now or datetime.utcnow()) - snapshot['as_of']).total_seconds()
+    if age > max_age:
+        return True
+    return bool(state and state.get('dirty_since')) and age > min_interval
+
+def _claim_refresh(db):
+    """Claim the next refresh across workers; False if another one is already running"""
+    now = datetime.utcnow()
+    try:
+        db.stats_state.update_one(
+            {'_id': STATE_ID, '$or': [{'refreshing_until': {'$exists': False}}, {'refreshing_until': {'$lt': now}}]},
+            {'$set': {'refreshing_until': now + timedelta(seconds=REFRESH_CLAIM_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The state document exists and holds a live claim
+        return False
+    return True
+
+_refresh_lock = threading.Lock()
+
+def start_background_refresh(db, budget=None):
+    """Refresh the snapshot in a daemon thread unless a refresh is already running"""
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+    try:
+        claimed = _claim_refresh(db)
+    except Exception:
+        _refresh_lock.release()
+        raise
+    if not claimed:
+        _refresh_lock.release()
+        return False
+
+    def run():
+        try:
+            refresh_snapshot(db, budget)
+        except Exception as e:
+            print(f"Stats snapshot refresh failed: {e}")
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=run, name='stats-snapshot', daemon=True).start()
+    return True
+
+def get_snapshot(db, budget=None, max_age=300, min_interval=30, projection=None):
+    """Latest snapshot, scheduling a background refresh when it is stale
+
+    Only the very first call (no snapshot yet) computes inline, and then
+    returns the whole snapshot whatever the ``projection``.
+    """
+    snapshot = latest_snapshot(db, projection)
+    if snapshot is None:
+        return refresh_snapshot(db, budget)
+    if needs_refresh(snapshot, db.stats_state.find_one({'_id': STATE_ID}), max_age, min_interval):
+        start_background_refresh(db, budget)
+    return snapshot
+
+# Snapshot fields returned by /api/v1/stats
+STATS_FIELDS = ('total_publications', 'total_authors', 'total_users',
+                'publications_by_year', 'publications_by_category')
+
+def stats_payload(snapshot):
+    """The /api/v1/stats ``data`` block for a snapshot, with its ``as_of`` time"""
+    data = {field: snapshot.get(field) for field in STATS_FIELDS}
+    data['as_of'] = snapshot['as_of'].isoformat()
+    return data
+
+def snapshot_validators(snapshot):
+    """``(etag, last_modified)`` of a snapshot (only _id and as_of are needed)"""
+    return make_etag('stats', snapshot['_id']), snapshot['as_of']
+
+def snapshot_settings(config):
+    """``(max_age, min_interval)`` from the app config"""
+    return config['STATS_SNAPSHOT_MAX_AGE_SECONDS'], config['STATS_SNAPSHOT_MIN_INTERVAL_SECONDS']
+
+def init_stats(app):
+    """Mark the stats snapshot dirty on writes that change its figures"""
+    from utils.db import mongo
+
+    def on_catalog_changed(sender, op=None, id=None, **extra):
+        try:
+            mark_dirty(mongo.db)
+        except Exception as e:
+            print(f"Could not mark stats snapshot dirty: {e}")
+
+    def on_membership_changed(sender, op=None, id=None, **extra):
+        # Author and user updates leave the totals unchanged
+        if op in ('create', 'delete'):
+            on_catalog_changed(sender, op=op, id=id)
+
+    publication_changed.connect(on_catalog_changed, weak=False)
+    author_changed.connect(on_membership_changed, weak=False)
+    user_changed.connect(on_membership_changed, weak=False)
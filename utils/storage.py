@@ -0,0 +1,430 @@
+import mimetypes
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from flask import abort, current_app, redirect, request, Response, send_from_directory, url_for
+
+# Blob storage for uploaded files (PDFs, covers, author pictures) with
+# pluggable backends, selected by STORAGE_BACKEND:
+#
+#   local   files under STORAGE_LOCAL_ROOT (default static/uploads, one host)
+#   gridfs  the `uploads` GridFS bucket in the application database
+#   s3      an S3-compatible bucket (AWS S3, MinIO, ...); requires boto3
+#
+# Publications and authors keep storing bare filenames; a blob's key is
+# "<kind>/<filename>" with kind one of UPLOAD_KINDS, which matches the
+# directory layout under static/uploads. Templates link to files through
+# upload_url(kind, filename): static URLs for local files inside the static
+# folder, presigned URLs for S3, and the /files/ route (streamed, with range
+# support) otherwise.
+
+UPLOAD_KINDS = ('pdfs', 'covers', 'authors')
+
+CHUNK_SIZE = 256 * 1024
+
+def upload_key(kind, filename):
+    """Storage key of an uploaded file"""
+    if kind not in UPLOAD_KINDS:
+        raise ValueError(f"Unknown upload kind: {kind}")
+    return f"{kind}/{filename}"
+
+def _content_type(key, content_type=None):
+    return content_type or mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+def _copy_stream(source, target):
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        target.write(chunk)
+
+class LocalStorage:
+    """Files in a directory on this host"""
+
+    def __init__(self, root, static_folder=None):
+        self.root = os.path.abspath(root)
+        # Files inside the app's static folder are linked through the static route
+        self.static_prefix = None
+        if static_folder:
+            static_folder = os.path.abspath(static_folder)
+            if os.path.commonpath([self.root, static_folder]) == static_folder:
+                self.static_prefix = os.path.relpath(self.root, static_folder).replace(os.sep, '/')
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def put(self, key, stream, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial upload
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                _copy_stream(stream, f)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def size(self, key):
+        """Size in bytes, or None if the file does not exist"""
+        try:
+            return os.path.getsize(self._path(key))
+        except OSError:
+            return None
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def open_range(self, key, start=0, end=None):
+        """Iterate over bytes ``start``..``end`` (inclusive; None reads to the end)"""
+        with open(self._path(key), 'rb') as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def modified(self, key):
+        """Last write time (naive UTC), or None if the file does not exist"""
+        try:
+            return datetime.utcfromtimestamp(os.path.getmtime(self._path(key)))
+        except OSError:
+            return None
+
+    def list(self, prefix=''):
+        """Iterate over ``(key, size)`` for every stored file under ``prefix``
+
+        Directories are read entry by entry (os.scandir), so a directory with
+        many files is never held in memory as a whole.
+        """
+        base = self._path(prefix) if prefix else self.root
+        pending = [base]
+        while pending:
+            try:
+                entries = os.scandir(pending.pop())
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file() and not entry.name.endswith('.part'):
+                        try:
+                            size = entry.stat().st_size
+                        except FileNotFoundError:
+                            continue
+                        yield os.path.relpath(entry.path, self.root).replace(os.sep, '/'), size
+
+    def url(self, key, expires=None):
+        """Direct URL for the file, or None if it must be streamed by the app"""
+        if self.static_prefix is None:
+            return None
+        return url_for('static', filename=f"{self.static_prefix}/{key}")
+
+    def send(self, key):
+        """Response for the /files/ route (conditional and range requests handled by Werkzeug)"""
+        directory, filename = os.path.split(self._path(key))
+        return send_from_directory(directory, filename, conditional=True)
+
+class GridFSStorage:
+    """Files in a GridFS bucket, shared by every app server using the database"""
+
+    def __init__(self, db, bucket_name='uploads'):
+        import gridfs
+        self.db = db
+        self.bucket_name = bucket_name
+        self.bucket = gridfs.GridFSBucket(db, bucket_name=bucket_name, chunk_size_bytes=CHUNK_SIZE)
+        self.files = db[f"{bucket_name}.files"]
+
+    def _latest(self, key):
+        return self.files.find_one({'filename': key}, sort=[('uploadDate', -1)])
+
+    def put(self, key, stream, content_type=None):
+        file_id = self.bucket.upload_from_stream(key, stream,
+                                                 metadata={'contentType': _content_type(key, content_type)})
+        # Older revisions of the same key are only removed once the new one is complete
+        for old in self.files.find({'filename': key, '_id': {'$ne': file_id}}, {'_id': 1}):
+            self.bucket.delete(old['_id'])
+
+    def size(self, key):
+        latest = self._latest(key)
+        return latest['length'] if latest else None
+
+    def exists(self, key):
+        return self._latest(key) is not None
+
+    def modified(self, key):
+        latest = self._latest(key)
+        return latest['uploadDate'] if latest else None
+
+    def open_range(self, key, start=0, end=None):
+        latest = self._latest(key)
+        if latest is None:
+            raise FileNotFoundError(key)
+        with self.bucket.open_download_stream(latest['_id']) as grid_out:
+            grid_out.seek(start)
+            remaining = (latest['length'] if end is None else end + 1) - start
+            while remaining > 0:
+                chunk = grid_out.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key):
+        for old in self.files.find({'filename': key}, {'_id': 1}):
+            self.bucket.delete(old['_id'])
+
+    def list(self, prefix=''):
+        query = {'filename': {'$regex': f"^{re.escape(prefix)}"}} if prefix else {}
+        # Sorted like GridFS's own (filename, uploadDate) index: only the newest
+        # revision of each file is yielded without remembering every name seen
+        previous = None
+        for doc in self.files.find(query, {'filename': 1, 'length': 1}).sort([('filename', 1), ('uploadDate', -1)]):
+            if doc['filename'] != previous:
+                previous = doc['filename']
+                yield doc['filename'], doc['length']
+
+    def url(self, key, expires=None):
+        return None
+
+    def send(self, key):
+        latest = self._latest(key)
+        if latest is None:
+            abort(404)
+        content_type = (latest.get('metadata') or {}).get('contentType') or _content_type(key)
+        return stream_response(self, key, latest['length'], content_type,
+                               etag=str(latest['_id']), last_modified=latest['uploadDate'])
+
+class S3Storage:
+    """Objects in an S3-compatible bucket; clients download directly through presigned URLs"""
+
+    def __init__(self, bucket, endpoint_url=None, region=None, access_key_id=None,
+                 secret_access_key=None, prefix='', public_url=None, url_expires=3600):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND='s3' requires boto3 (pip install boto3)")
+        self.ClientError = ClientError
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix and prefix.strip('/') else ''
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.url_expires = url_expires
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None,
+                                   aws_access_key_id=access_key_id or None,
+                                   aws_secret_access_key=secret_access_key or None)
+
+    def _object_key(self, key):
+        return self.prefix + key
+
+    def put(self, key, stream, content_type=None):
+        # upload_fileobj streams in multipart chunks; no temporary copy
+        self.client.upload_fileobj(stream, self.bucket, self._object_key(key),
+                                   ExtraArgs={'ContentType': _content_type(key, content_type)})
+
+    def _head(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def size(self, key):
+        head = self._head(key)
+        return head['ContentLength'] if head else None
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def modified(self, key):
+        head = self._head(key)
+        return head['LastModified'].astimezone(timezone.utc).replace(tzinfo=None) if head else None
+
+    def open_range(self, key, start=0, end=None):
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key), Range=byte_range)['Body']
+        try:
+            for chunk in body.iter_chunks(CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(prefix)):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):], obj['Size']
+
+    def url(self, key, expires=None):
+        if self.public_url:
+            return f"{self.public_url}/{self._object_key(key)}"
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._object_key(key)},
+            ExpiresIn=expires or self.url_expires)
+
+    def send(self, key):
+        return redirect(self.url(key))
+
+def stream_response(storage, key, size, content_type, etag=None, last_modified=None):
+    """Stream a stored file, answering single-range requests with 206 Partial Content"""
+    byte_range = request.range
+    start, end, status = 0, size - 1, 200
+    if byte_range and byte_range.units == 'bytes' and len(byte_range.ranges) == 1:
+        range_bounds = byte_range.range_for_length(size)
+        if range_bounds is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f"bytes */{size}"
+            return response
+        start, end, status = range_bounds[0], range_bounds[1] - 1, 206
+
+    response = Response(storage.open_range(key, start, end) if size else iter(()), status=status,
+                        mimetype=content_type, direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.content_length = end - start + 1 if size else 0
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    if etag:
+        response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request) if status == 200 else response
+
+def create_storage(config, db=None, backend=None, static_folder=None):
+    """Build the storage backend named by ``backend`` (default STORAGE_BACKEND)
+
+    ``config`` is app.config or a Config class.
+    """
+    from utils.db import _setting
+    backend = backend or _setting(config, 'STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalStorage(_setting(config, 'STORAGE_LOCAL_ROOT') or _setting(config, 'UPLOAD_FOLDER'),
+                            static_folder=static_folder)
+    if backend == 'gridfs':
+        if db is None:
+            raise RuntimeError("STORAGE_BACKEND='gridfs' needs a database handle")
+        return GridFSStorage(db, _setting(config, 'STORAGE_GRIDFS_BUCKET', 'uploads'))
+    if backend == 's3':
+        return S3Storage(
+            _setting(config, 'STORAGE_S3_BUCKET'),
+            endpoint_url=_setting(config, 'STORAGE_S3_ENDPOINT_URL'),
+            region=_setting(config, 'STORAGE_S3_REGION'),
+            access_key_id=_setting(config, 'STORAGE_S3_ACCESS_KEY_ID'),
+            secret_access_key=_setting(config, 'STORAGE_S3_SECRET_ACCESS_KEY'),
+            prefix=_setting(config, 'STORAGE_S3_PREFIX', ''),
+            public_url=_setting(config, 'STORAGE_S3_PUBLIC_URL'),
+            url_expires=_setting(config, 'STORAGE_URL_EXPIRES', 3600),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+def migrate_storage(source, target, delete_source=False, dry_run=False, log=print):
+    """Copy every blob from ``source`` to ``target``
+
+    Blobs already present in the target with the same size are skipped, so an
+    interrupted run can simply be restarted. Returns ``(copied, skipped)``.
+    """
+    copied = skipped = 0
+    for kind in UPLOAD_KINDS:
+        for key, size in source.list(kind + '/'):
+            if target.size(key) == size:
+                skipped += 1
+                continue
+            if dry_run:
+                log(f"would copy {key} ({size} bytes)")
+                copied += 1
+                continue
+            with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as buffer:
+                for chunk in source.open_range(key):
+                    buffer.write(chunk)
+                buffer.seek(0)
+                target.put(key, buffer, _content_type(key))
+            if target.size(key) != size:
+                raise RuntimeError(f"Size mismatch after copying {key}")
+            if delete_source:
+                source.delete(key)
+            copied += 1
+            if copied % 100 == 0:
+                log(f"{copied} file(s) copied")
+    log(f"Storage migration: {copied} file(s) {'to copy' if dry_run else 'copied'}, {skipped} already present")
+    return copied, skipped
+
+def save_upload(kind, filename, stream, content_type=None):
+    """Store an uploaded file through the app's storage backend"""
+    get_storage().put(upload_key(kind, filename), stream, content_type)
+
+def delete_upload(kind, filename):
+    """Remove a stored upload (missing files are ignored)"""
+    get_storage().delete(upload_key(kind, filename))
+
+def read_upload(kind, filename):
+    """Whole contents of a stored upload as bytes"""
+    return b''.join(get_storage().open_range(upload_key(kind, filename)))
+
+def upload_url(kind, filename):
+    """URL of an uploaded file: direct to the store when it can serve it, else the /files/ route"""
+    if not filename:
+        return ''
+    return get_storage().url(upload_key(kind, filename)) or url_for('files', kind=kind, filename=filename)
+
+@contextmanager
+def temporary_copy(file_storage, suffix=''):
+    """Spool an uploaded file to a temporary path (for tools that need a real file)"""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _copy_stream(file_storage.stream, f)
+        yield path
+    finally:
+        os.remove(path)
+
+def get_storage():
+    """Get the storage backend for the current app"""
+    return current_app.extensions['wrdc_storage']
+
+def init_storage(app, db):
+    """Create the storage backend, register upload_url() and the /files/ route"""
+    storage = create_storage(app.config, db, static_folder=app.static_folder)
+    app.extensions['wrdc_storage'] = storage
+    if isinstance(storage, LocalStorage):
+        for kind in UPLOAD_KINDS:
+            os.makedirs(os.path.join(storage.root, kind), exist_ok=True)
+
+    app.add_template_global(upload_url)
+
+    def serve_file(kind, filename):
+        """Serve an uploaded file from the storage backend"""
+        if kind not in UPLOAD_KINDS:
+            abort(404)
+        key = upload_key(kind, filename)
+        try:
+            if not storage.exists(key):
+                abort(404)
+        except ValueError:
+            abort(404)
+        return storage.send(key)
+
+    app.add_url_rule('/files/<kind>/<path:filename>', 'files', serve_file)
+    return storage
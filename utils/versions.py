@@ -0,0 +1,114 @@
+import hashlib
+from datetime import datetime
+from flask import Response, request
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+from utils.signals import SIGNALS_BY_COLLECTION
+
+# Validators (ETag / Last-Modified) for conditional GETs on the JSON API.
+#
+# Collections carry a version counter in `collection_versions`, bumped by the
+# catalog signals on every write, so list and facet endpoints can answer
+# If-None-Match / If-Modified-Since with one find_one by _id instead of
+# running their query. Single documents derive their validators from the
+# fields that change when they do (updated_at and the fields written outside
+# the models' update()), read with a small projection first.
+#
+# List and search responses are keyed on the publications counter plus the
+# query string. View and download counts are not model writes, so the counts
+# in a cached list can lag until the next one.
+#
+# Writes that bypass the models (mongosh, bulk scripts) don't bump the
+# counters; call bump_version() after them.
+
+# Fields that change whenever a single document's API representation does
+DOCUMENT_VERSION_FIELDS = {
+    'publications': ('updated_at', 'related_updated_at', 'extracted_at', 'view_count', 'download_count'),
+    'authors': ('updated_at',),
+}
+
+def make_etag(*parts):
+    """Opaque entity tag for a tuple of values"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+def bump_version(db, name):
+    """Record a write to collection ``name``"""
+    db.collection_versions.update_one(
+        {'_id': name},
+        {'$inc': {'version': 1}, '$set': {'changed_at': datetime.utcnow()}},
+        upsert=True
+    )
+
+def version_validators(name, state, *extra):
+    """``(etag, last_modified)`` from a `collection_versions` document (None before the first write)
+
+    ``extra`` (e.g. the query string) distinguishes responses built from the
+    same collection.
+    """
+    state = state or {}
+    return make_etag(name, state.get('version', 0), state.get('changed_at'), *extra), state.get('changed_at')
+
+def collection_validators(db, name, *extra):
+    """Validators for a response built from collection ``name``"""
+    return version_validators(name, db.collection_versions.find_one({'_id': name}), *extra)
+
+def document_projection(collection):
+    """Projection fetching only what document_validators() needs"""
+    return {field: 1 for field in DOCUMENT_VERSION_FIELDS[collection]}
+
+def document_validators(doc, collection):
+    """``(etag, last_modified)`` of a single document"""
+    fields = DOCUMENT_VERSION_FIELDS[collection]
+    values = [doc.get(field) for field in fields]
+    last_modified = max((value for value in values if isinstance(value, datetime)), default=None)
+    return make_etag(collection, doc['_id'], *values), last_modified
+
+def is_conditional(headers):
+    """Whether request headers ask for revalidation (If-None-Match or If-Modified-Since)"""
+    return bool(headers.get('If-None-Match') or headers.get('If-Modified-Since'))
+
+def not_modified(headers, etag, last_modified=None):
+    """Whether a GET with these request headers can be answered with 304
+
+    If-None-Match wins over If-Modified-Since when both are sent (RFC 9110).
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    since = parse_date(headers.get('If-Modified-Since'))
+    if since is None or last_modified is None:
+        return False
+    # HTTP dates have one-second resolution
+    return last_modified.replace(microsecond=0) <= since.replace(tzinfo=None)
+
+def validator_headers(etag, last_modified=None, private=False):
+    """Response headers carrying the validators; clients must revalidate before reuse"""
+    headers = {'ETag': quote_etag(etag), 'Cache-Control': 'private, no-cache' if private else 'no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def conditional_response(etag, last_modified=None):
+    """A 304 response for the current request if the client's copy is current, else None"""
+    if not_modified(request.headers, etag, last_modified):
+        return Response(status=304, headers=validator_headers(etag, last_modified))
+    return None
+
+def with_validators(response, etag, last_modified=None):
+    """Add the validator headers to a Flask response"""
+    response.headers.update(validator_headers(etag, last_modified))
+    return response
+
+def init_versions(app):
+    """Bump a collection's version counter on every catalog write"""
+    from utils.db import mongo
+
+    def receiver(name):
+        def on_changed(sender, op=None, id=None, **extra):
+            try:
+                bump_version(mongo.db, name)
+            except Exception as e:
+                print(f"Could not bump {name} version: {e}")
+        return on_changed
+
+    for name, signal in SIGNALS_BY_COLLECTION.items():
+        signal.connect(receiver(name), weak=False)
@@ -0,0 +1,13 @@
+"""WSGI entry point for production servers
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+WRDC_CONFIG selects the config class (default: production). The app, and
+with it the MongoClient, is created when a worker imports this module, i.e.
+after the fork, so workers never share a connection pool.
+"""
+import os
+from app import create_app
+from config import get_config
+
+app = create_app(get_config(os.environ.get('WRDC_CONFIG', 'production')))